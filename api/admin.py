@@ -1,3 +1,72 @@
 from django.contrib import admin
+from django.utils.html import format_html, format_html_join
 
-# Register your models here.
+from pingme.paginators import EstimatedCountPaginator
+from .models import RequestProfile
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = [
+        'target', 'kind', 'mode', 'status_code', 'duration', 'query_count', 'query_time', 'user', 'created_at'
+    ]
+    list_filter = ['kind', 'mode', 'created_at']
+    search_fields = ['target']
+    list_select_related = ['user']
+    list_per_page = 50
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    fieldsets = (
+        ('Request', {
+            'fields': ('target', 'kind', 'status_code', 'user', 'created_at')
+        }),
+        ('Timings', {
+            'fields': ('duration', 'cpu_ms', 'query_count', 'query_time')
+        }),
+        ('Profile', {
+            'fields': ('mode', 'profile_display')
+        }),
+        ('SQL', {
+            'fields': ('queries_display',)
+        }),
+    )
+    readonly_fields = [
+        'target', 'kind', 'status_code', 'user', 'created_at', 'duration', 'cpu_ms',
+        'query_count', 'query_time', 'mode', 'profile_display', 'queries_display',
+    ]
+
+    def duration(self, obj):
+        return f'{obj.duration_ms:.1f} ms'
+    duration.short_description = 'Duration'
+    duration.admin_order_field = 'duration_ms'
+
+    def query_time(self, obj):
+        return f'{obj.query_ms:.1f} ms'
+    query_time.short_description = 'SQL time'
+    query_time.admin_order_field = 'query_ms'
+
+    def profile_display(self, obj):
+        return format_html('<pre style="white-space: pre; overflow-x: auto">{}</pre>', obj.profile)
+    profile_display.short_description = 'Profile'
+
+    def queries_display(self, obj):
+        """Queries in execution order, slowest highlighted"""
+        if not obj.queries:
+            return '-'
+        slowest = max(query['ms'] for query in obj.queries)
+        rows = format_html_join(
+            '',
+            '<tr><td>{}</td><td>{}</td><td style="{}">{}</td><td><code>{}</code></td></tr>',
+            (
+                (number, query['alias'], 'font-weight: bold' if query['ms'] == slowest else '', query['ms'], query['sql'])
+                for number, query in enumerate(obj.queries, 1)
+            ),
+        )
+        return format_html('<table><tr><th>#</th><th>Database</th><th>ms</th><th>SQL</th></tr>{}</table>', rows)
+    queries_display.short_description = 'Queries'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,42 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+import statistics
+from contextlib import contextmanager
+
+from django.test.utils import (
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+
+
+@contextmanager
+def benchmark_database(aliases=None):
+    """Run the block against throwaway test databases (all of them by default) instead of real data"""
+    setup_test_environment()
+    old_config = setup_databases(
+        verbosity=0, interactive=False, aliases=set(aliases) if aliases else None
+    )
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+        teardown_test_environment()
+
+
+def summarize(timings, elapsed):
+    """Throughput and latency percentiles for a list of per-call timings"""
+    timings = sorted(timings)
+    return {
+        'requests': len(timings),
+        'rps': len(timings) / elapsed if elapsed else 0.0,
+        'p50_ms': statistics.median(timings) * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+    }
+
+
+def format_row(label, stats):
+    return (
+        f'{label:<40} {stats["requests"]:>6} req  {stats["rps"]:>8.1f} req/s  '
+        f'p50 {stats["p50_ms"]:>7.1f} ms  p95 {stats["p95_ms"]:>7.1f} ms'
+    )
@@ -0,0 +1,81 @@
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from pingme.roles import ROLE_DEFERRED_APPS
+
+# What each entry point runs before it can serve anything
+ENTRY_POINTS = {
+    # daphne pingme.asgi:application
+    'asgi': 'import pingme.asgi',
+    # Every manage.py command, before its own imports
+    'manage.py': 'import django; django.setup()',
+}
+
+RE_IMPORTTIME = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| +(\S+)')
+
+
+class Command(BaseCommand):
+    help = (
+        'Cold start of the daphne and manage.py entry points per PINGME_ROLE: '
+        'wall time and peak RSS of fresh interpreters, and a -X importtime '
+        'breakdown by top-level package'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh processes per role and entry point')
+        parser.add_argument('--top', type=int, default=15, help='Packages shown in the import breakdown, 0 for none')
+        parser.add_argument('--roles', nargs='+', default=list(ROLE_DEFERRED_APPS), choices=list(ROLE_DEFERRED_APPS))
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"entry point":<12}{"role":<6}{"median ms":>12}{"min ms":>10}{"RSS MiB":>10}')
+        for entry_point, code in ENTRY_POINTS.items():
+            for role in options['roles']:
+                timings, rss = [], []
+                for _ in range(options['runs']):
+                    elapsed, max_rss, _ = self.run(role, code)
+                    timings.append(elapsed)
+                    rss.append(max_rss)
+                self.stdout.write(
+                    f'{entry_point:<12}{role:<6}{statistics.median(timings) * 1000:>12.0f}'
+                    f'{min(timings) * 1000:>10.0f}{statistics.median(rss) / 1024:>10.1f}'
+                )
+
+        if options['top']:
+            for role in options['roles']:
+                _, _, stderr = self.run(role, ENTRY_POINTS['asgi'], importtime=True)
+                packages = self.import_breakdown(stderr)
+                self.stdout.write(
+                    f'\nimport pingme.asgi, PINGME_ROLE={role}: '
+                    f'{sum(packages.values()) / 1000:.0f} ms importing {len(packages)} packages'
+                )
+                for package, microseconds in packages.most_common(options['top']):
+                    self.stdout.write(f'  {package:<32}{microseconds / 1000:>8.1f} ms')
+
+    def run(self, role, code, importtime=False):
+        """``(seconds, peak RSS in KiB, stderr)`` of a fresh interpreter running ``code``"""
+        env = dict(os.environ, PINGME_ROLE=role)
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        # VmHWM rather than ru_maxrss, which a child inherits from this process
+        command += ['-c', f'{code}\nprint(open("/proc/self/status").read().split("VmHWM:")[1].split()[0])']
+        started = time.perf_counter()
+        result = subprocess.run(
+            command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        return time.perf_counter() - started, int(result.stdout.split()[-1]), result.stderr
+
+    def import_breakdown(self, stderr):
+        """Microseconds spent importing each top-level package's own modules"""
+        packages = Counter()
+        for match in RE_IMPORTTIME.finditer(stderr):
+            packages[match[3].split('.')[0]] += int(match[1])
+        return packages
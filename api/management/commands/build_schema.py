@@ -0,0 +1,29 @@
+import shutil
+
+from django.core.management.base import BaseCommand
+
+from api import schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the OpenAPI schema for the current code version and store it '
+        'compressed in OPENAPI_SCHEMA["ARTIFACT_DIR"], where api/schema/ serves it from'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Keep artifacts of other code versions instead of deleting them',
+        )
+
+    def handle(self, *args, **options):
+        version = schema.code_version()
+        directory, variants = schema.build(version)
+        for (name, encoding), content in sorted(variants.items()):
+            self.stdout.write(f'{name:<6}{encoding:<6}{len(content):>9} bytes')
+        if not options['keep_old']:
+            for other in directory.parent.iterdir():
+                if other.is_dir() and other != directory:
+                    shutil.rmtree(other)
+        self.stdout.write(self.style.SUCCESS(f'Schema for {version} written to {directory}'))
@@ -0,0 +1,48 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        'Local stand-in for database replication: copy the primary SQLite file '
+        'into each DB_REPLICAS file, once or every --interval seconds'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Seconds between copies, i.e. the simulated replication lag; 0 copies once',
+        )
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES['default']
+        aliases = settings.READ_REPLICAS['ALIASES']
+        if not primary['ENGINE'].endswith('sqlite3'):
+            raise CommandError('replicate_sqlite only works with SQLite databases')
+        if not aliases:
+            raise CommandError('No replicas configured, set DB_REPLICAS')
+
+        while True:
+            started = time.perf_counter()
+            for alias in aliases:
+                self.copy(primary['NAME'], settings.DATABASES[alias]['NAME'])
+            self.stdout.write(
+                f'Replicated to {", ".join(aliases)} in {(time.perf_counter() - started) * 1000:.0f} ms'
+            )
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+    def copy(self, source_name, target_name):
+        # The backup API takes a consistent snapshot while the primary keeps
+        # accepting writes
+        source = sqlite3.connect(source_name)
+        target = sqlite3.connect(target_name, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,21 @@
+# Generated by Django 6.0.1 on 2026-10-19 12:02
+
+from django.db import migrations
+
+
+def redact_queries(apps, schema_editor):
+    # Profiles stored so far hold SQL with its parameters filled in
+    RequestProfile = apps.get_model('api', 'RequestProfile')
+    RequestProfile.objects.filter(target__contains=' /auth/').delete()
+    RequestProfile.objects.update(queries=[])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(redact_queries, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,38 @@
+from django.contrib.auth import get_user_model
 from django.db import models
 
-# Create your models here.
+User = get_user_model()
+
+
+class RequestProfile(models.Model):
+    """One profiled request or WebSocket event, captured on a staff user's demand (api/profiling.py)"""
+    KIND_CHOICES = [
+        ('http', 'HTTP request'),
+        ('websocket', 'WebSocket event'),
+    ]
+    MODE_CHOICES = [
+        ('cprofile', 'cProfile'),
+        ('sample', 'Sampling'),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='+')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    # "GET /api/chat/conversations/?page=2" or "message" for a WebSocket frame
+    target = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.FloatField()
+    cpu_ms = models.FloatField(null=True, blank=True)
+    query_count = models.PositiveIntegerField(default=0)
+    query_ms = models.FloatField(default=0)
+    # [{"alias", "sql", "ms"}, ...] in execution order
+    queries = models.JSONField(default=list)
+    # pstats listing (cProfile) or sampled stacks with their counts
+    profile = models.TextField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.target} ({self.duration_ms:.0f} ms)'
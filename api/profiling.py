@@ -0,0 +1,280 @@
+"""
+Profiling of single requests on a staff user's demand.
+
+A DRF request carrying an ``X-Profile`` header or a ``?profile=`` parameter
+from a staff user (session or bearer token) runs under a profiler; its SQL
+(without parameters) and timings are stored as a RequestProfile, shown in
+the admin, and the response gets an ``X-Profile-Id`` header. Auth endpoints
+are never profiled. ChatConsumer does the same for a
+frame with ``"profile": ...`` from a staff user. The value picks the
+profiler: ``sample`` for the statistical sampler (low overhead, good for
+slow requests), anything else for cProfile. Requests without the flag only
+pay for looking it up.
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from rest_framework.views import APIView
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from api.models import RequestProfile
+from user.authentication import CachedJWTAuthentication
+
+HEADER = 'HTTP_X_PROFILE'
+PARAM = 'profile'
+
+# The session whose queries the current context records, so a wrapper on a
+# connection shared with other consumers only records its own
+_session = ContextVar('profile_session', default=None)
+
+
+def requested_mode(value):
+    return 'sample' if value == 'sample' else 'cprofile'
+
+
+class Sampler(threading.Thread):
+    """Counts the call stacks of some threads every SAMPLE_INTERVAL_MS"""
+
+    def __init__(self, thread_ids):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_ids = set(thread_ids)
+        self.interval = settings.PROFILING['SAMPLE_INTERVAL_MS'] / 1000
+        self.stacks = Counter()
+        self.samples = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{code.co_filename}:{frame.f_lineno}({code.co_name})')
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def report(self):
+        """Functions by samples spent in them, then every stack in collapsed (flame graph) format"""
+        own = Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        lines = [f'{self.samples} samples every {self.interval * 1000:g} ms', '', 'samples  function']
+        lines += [f'{count:7}  {function}' for function, count in own.most_common(settings.PROFILING['TOP_FUNCTIONS'])]
+        lines += ['', 'Stacks (collapsed):']
+        lines += [f'{stack} {count}' for stack, count in self.stacks.most_common()]
+        return '\n'.join(lines)
+
+
+class ProfileSession:
+    """Profiler, SQL and timings of one request or event"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.queries = []
+        self.profiler = None
+        self.sampler = None
+        self.started = self.cpu_started = None
+        self.duration_ms = self.cpu_ms = None
+
+    def record(self, execute, sql, params, many, context):
+        if _session.get() is not self:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if len(self.queries) < settings.PROFILING['MAX_QUERIES']:
+                # The SQL as sent, placeholders and all: parameters can be
+                # password hashes, tokens or message contents
+                self.queries.append({
+                    'alias': context['connection'].alias,
+                    'sql': sql,
+                    'ms': round((time.perf_counter() - started) * 1000, 3),
+                })
+
+    @contextmanager
+    def recording_queries(self):
+        """Record the queries of this thread's connections made in this context"""
+        token = _session.set(self)
+        try:
+            with self.query_wrappers():
+                yield
+        finally:
+            _session.reset(token)
+
+    @contextmanager
+    def query_wrappers(self):
+        """
+        Wrap this thread's connections; only queries from contexts where this
+        session is current are recorded (see ``recording_queries``)
+        """
+        with ExitStack() as stack:
+            for alias in settings.DATABASES:
+                stack.enter_context(connections[alias].execute_wrapper(self.record))
+            yield
+
+    def start(self, thread_ids=None):
+        """Profile the current thread; the sampler can also watch ``thread_ids``"""
+        if self.mode == 'sample':
+            self.sampler = Sampler({threading.get_ident(), *(thread_ids or ())})
+            self.sampler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+
+    def stop(self):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        self.cpu_ms = (time.thread_time() - self.cpu_started) * 1000
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def report(self):
+        if self.sampler is not None:
+            return self.sampler.report()
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(settings.PROFILING['TOP_FUNCTIONS'])
+        return stream.getvalue()
+
+    def save(self, **fields):
+        return RequestProfile.objects.create(
+            mode=self.mode,
+            duration_ms=self.duration_ms,
+            cpu_ms=self.cpu_ms,
+            query_count=len(self.queries),
+            query_ms=sum(query['ms'] for query in self.queries),
+            queries=self.queries,
+            profile=self.report(),
+            **fields,
+        )
+
+
+async def aprofile(mode, handle, **fields):
+    """
+    Run the coroutine function ``handle`` under a profiler and store a
+    RequestProfile with ``fields``. cProfile sees the event loop, so also
+    whatever other connections run meanwhile; the sampler also watches the
+    thread sync (database) code runs in, whose queries are recorded.
+    """
+    session = ProfileSession(mode)
+    sync_thread = await sync_to_async(threading.get_ident)()
+    wrappers = ExitStack()
+    await sync_to_async(wrappers.enter_context)(session.query_wrappers())
+    token = _session.set(session)
+    session.start(thread_ids=[sync_thread])
+    try:
+        await handle()
+    finally:
+        session.stop()
+        _session.reset(token)
+        await sync_to_async(wrappers.close)()
+        profile = await sync_to_async(session.save)(**fields)
+    return profile
+
+
+def staff_user(request):
+    """The request's user if staff, from the session or a bearer token, else None"""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user if user.is_staff else None
+    try:
+        result = CachedJWTAuthentication().authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    if result is not None and result[0].is_staff:
+        return result[0]
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Runs flagged DRF views of staff users under a profiler. It only has a
+    ``process_view``, in the handler's own mode so unflagged requests do not
+    cross threads for it.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            self.process_view = self.aprocess_view
+        else:
+            self.process_view = self.sprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    @staticmethod
+    def requested(request, view_func):
+        if not settings.PROFILING['ENABLED']:
+            return None
+        value = request.META.get(HEADER) or request.GET.get(PARAM)
+        if not value or request.path.startswith(tuple(settings.PROFILING['EXCLUDED_PATHS'])):
+            return None
+        view_class = getattr(view_func, 'cls', None)
+        if not (isinstance(view_class, type) and issubclass(view_class, APIView)):
+            return None
+        return value
+
+    def sprocess_view(self, request, view_func, view_args, view_kwargs):
+        value = self.requested(request, view_func)
+        if value is None:
+            return None
+        return self.profile_view(value, request, view_func, view_args, view_kwargs)
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        value = self.requested(request, view_func)
+        if value is None:
+            return None
+        # DRF views are sync: profile in the thread the view would run in
+        return await sync_to_async(self.profile_view)(value, request, view_func, view_args, view_kwargs)
+
+    def profile_view(self, value, request, view_func, view_args, view_kwargs):
+        user = staff_user(request)
+        if user is None:
+            # Handled as usual
+            return None
+        session = ProfileSession(requested_mode(value))
+        response = None
+        try:
+            with session.recording_queries():
+                session.start()
+                try:
+                    response = view_func(request, *view_args, **view_kwargs)
+                    if hasattr(response, 'render') and callable(response.render):
+                        response = response.render()
+                finally:
+                    session.stop()
+        finally:
+            profile = session.save(
+                user=user,
+                kind='http',
+                target=f'{request.method} {request.get_full_path()}'[:255],
+                status_code=getattr(response, 'status_code', 500),
+            )
+        response['X-Profile-Id'] = str(profile.pk)
+        return response
@@ -0,0 +1,143 @@
+"""
+The OpenAPI schema as a prebuilt artifact. Generating it introspects every
+view and serializer, so it is done once per code version (by
+``manage.py build_schema`` or on the first request) and the compressed
+result is kept on disk and in memory.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from functools import cache
+from pathlib import Path
+
+import django
+import rest_framework
+from django.conf import settings
+
+from pingme import compression
+
+# Format -> (content type, suffix); YAML is the default like SpectacularAPIView
+FORMATS = {
+    'yaml': ('application/vnd.oai.openapi', 'yaml'),
+    'json': ('application/vnd.oai.openapi+json', 'json'),
+}
+
+# Not part of the code: skipped when hashing the sources
+IGNORED_DIRS = {'__pycache__', 'build', 'venv', 'node_modules'}
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+@cache
+def code_version():
+    """
+    OPENAPI_SCHEMA['CODE_VERSION'] when set (e.g. the git revision at deploy),
+    otherwise a hash of the project's Python sources, the schema settings and
+    the versions of the packages that generate it.
+    """
+    configured = settings.OPENAPI_SCHEMA['CODE_VERSION']
+    if configured:
+        return configured
+    # Imported here: the slim PINGME_ROLEs do not load the docs
+    import drf_spectacular
+
+    digest = hashlib.sha1(repr((
+        django.__version__, rest_framework.VERSION, drf_spectacular.__version__,
+        settings.SPECTACULAR_SETTINGS,
+    )).encode())
+    base_dir = Path(settings.BASE_DIR)
+    for path in sorted(base_dir.rglob('*.py')):
+        relative = path.relative_to(base_dir)
+        if any(part in IGNORED_DIRS or part.startswith('.') for part in relative.parts[:-1]):
+            continue
+        digest.update(str(relative).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def artifact_dir(version):
+    return Path(settings.OPENAPI_SCHEMA['ARTIFACT_DIR']) / version
+
+
+def generate():
+    """The schema rendered in every format, uncompressed"""
+    from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=spectacular_settings.SERVE_URLCONF)
+    schema = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+    return {
+        'yaml': OpenApiYamlRenderer().render(schema, renderer_context={}),
+        'json': OpenApiJsonRenderer().render(schema, renderer_context={}),
+    }
+
+
+def compress(rendered):
+    """``{(format, encoding): bytes}`` with gzip, and Brotli when installed, for every format"""
+    variants = {}
+    for name, content in rendered.items():
+        variants[name, 'gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+        if compression.brotli is not None:
+            variants[name, 'br'] = compression.brotli.compress(content, quality=11)
+    return variants
+
+
+def write(version, variants):
+    """Store the artifact; files are renamed into place so readers never see half of one"""
+    directory = artifact_dir(version)
+    directory.mkdir(parents=True, exist_ok=True)
+    for (name, encoding), content in variants.items():
+        path = directory / f'openapi.{FORMATS[name][1]}.{"gz" if encoding == "gzip" else encoding}'
+        temporary = path.with_name(f'.{path.name}.{os.getpid()}')
+        temporary.write_bytes(content)
+        os.replace(temporary, path)
+    return directory
+
+
+def read(version):
+    """The stored artifact for ``version``, or None when it was not built"""
+    directory = artifact_dir(version)
+    variants = {}
+    for name, (_, suffix) in FORMATS.items():
+        try:
+            variants[name, 'gzip'] = (directory / f'openapi.{suffix}.gz').read_bytes()
+        except FileNotFoundError:
+            return None
+        brotli_path = directory / f'openapi.{suffix}.br'
+        if brotli_path.exists():
+            variants[name, 'br'] = brotli_path.read_bytes()
+    return variants
+
+
+def build(version=None):
+    """Generate and store the artifact for ``version`` (the running code by default)"""
+    version = version or code_version()
+    variants = compress(generate())
+    return write(version, variants), variants
+
+
+def load():
+    """
+    ``(version, variants)`` for the running code, where ``variants`` maps
+    ``(format, encoding)`` to bytes with ``identity`` decompressed once. Read
+    from disk, or built when the artifact is missing; a read-only artifact
+    directory only costs the write.
+    """
+    version = code_version()
+    if version in _loaded:
+        return version, _loaded[version]
+    with _lock:
+        if version not in _loaded:
+            variants = read(version)
+            if variants is None:
+                variants = compress(generate())
+                try:
+                    write(version, variants)
+                except OSError:
+                    pass
+            for name in FORMATS:
+                variants[name, 'identity'] = gzip.decompress(variants[name, 'gzip'])
+            _loaded[version] = variants
+    return version, _loaded[version]
@@ -0,0 +1,81 @@
+"""Serializer helpers shared by the apps' APIs."""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework.serializers import BaseSerializer, ListSerializer
+
+
+def requested_fields(params):
+    """Field names from ``?fields=a,b``, or None when not given"""
+    value = params.get('fields')
+    if not value:
+        return None
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SelectableFieldsMixin:
+    """
+    Serializer taking ``fields=[...]`` to output only those fields (unknown
+    names are ignored, ``id`` is always kept).
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            keep = set(fields) | {'id'}
+            for name in set(self.fields) - keep:
+                self.fields.pop(name)
+
+
+def serializer_columns(serializer):
+    """
+    ``(columns, nested)`` a serializer reads: the model fields to pass to
+    ``QuerySet.only()`` and the foreign keys rendered by nested serializers.
+
+    Fields that are not plain model fields (properties, method fields) need an
+    entry in ``Meta.source_columns``, mapping the field name to the columns it
+    reads; without one the columns are unknown and None is returned.
+    """
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    model = serializer.Meta.model
+    declared = getattr(serializer.Meta, 'source_columns', {})
+    columns = {model._meta.pk.name}
+    nested = {}
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        if name in declared:
+            columns.update(declared[name])
+            continue
+        if len(field.source_attrs) != 1:
+            return None
+        try:
+            model_field = model._meta.get_field(field.source_attrs[0])
+        except FieldDoesNotExist:
+            return None
+        if not model_field.concrete or model_field.many_to_many:
+            return None
+        columns.add(model_field.name)
+        if isinstance(field, BaseSerializer) and model_field.is_relation:
+            nested[model_field.name] = field
+    return columns, nested
+
+
+def load_only(queryset, serializer):
+    """
+    ``queryset`` loading only the columns ``serializer`` outputs; related rows
+    of nested serializers are prefetched (not joined, so it works across
+    shards) with their own columns only.
+    """
+    found = serializer_columns(serializer)
+    if found is None:
+        return queryset
+    columns, nested = found
+    for name, nested_serializer in nested.items():
+        related_model = queryset.model._meta.get_field(name).related_model
+        related = related_model._base_manager.all()
+        nested_found = serializer_columns(nested_serializer)
+        if nested_found is not None:
+            related = related.only(*nested_found[0])
+        queryset = queryset.prefetch_related(Prefetch(name, queryset=related))
+    return queryset.only(*columns)
@@ -1,3 +1,112 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.models import RequestProfile
+from chat.models import Conversation
+from pingme.paginators import AtLeast, EstimatedCountPaginator
+from pingme.routers import ReplicaRouter, is_pinned
+
+User = get_user_model()
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', password='pw', is_staff=True
+        )
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.staff)}')
+
+    def test_queries_are_stored_without_parameters(self):
+        response = self.client.get('/api/chat/conversations/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profile = RequestProfile.objects.get(pk=response['X-Profile-Id'])
+        self.assertTrue(profile.queries)
+        # The user id is bound, never written into the stored SQL
+        self.assertTrue(any('%s' in query['sql'] for query in profile.queries))
+
+    def test_auth_endpoints_are_not_profiled(self):
+        response = self.client.get('/auth/users/search/', {'q': 'staff'}, HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class EstimatedCountPaginatorTests(TestCase):
+    def setUp(self):
+        for i in range(7):
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='pw')
+        self.users = User.objects.filter(username__startswith='user').order_by('pk')
+
+    def paginator(self, limit):
+        paginator = EstimatedCountPaginator(self.users, 2)
+        paginator.count_limit = limit
+        return paginator
+
+    def test_filtered_count_is_cut_off_but_pages_stay_reachable(self):
+        paginator = self.paginator(3)
+        self.assertIsInstance(paginator.count, AtLeast)
+        self.assertEqual(str(paginator.count), '3+')
+        self.assertEqual(paginator.num_pages, 2)
+        page = paginator.page(3)
+        self.assertEqual(len(page.object_list), 2)
+        self.assertTrue(page.has_next())
+        last = paginator.page(4)
+        self.assertEqual(paginator.count, 7)
+        self.assertFalse(last.has_next())
+
+    def test_small_tables_are_counted_exactly(self):
+        with mock.patch('pingme.paginators.estimated_row_count', return_value=3):
+            paginator = self.paginator(3)
+            self.assertEqual(paginator.count, 7)
+            self.assertNotIsInstance(paginator.count, AtLeast)
+
+
+@override_settings(READ_REPLICAS={'ALIASES': ['replica1'], 'STICKY_SECONDS': 10})
+class ReadReplicaTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        # The replica alias shares the test database's connection, so only
+        # the routing decisions differ
+        connections['replica1'] = connections['default']
+        self.addCleanup(connections.__delitem__, 'replica1')
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def conversation_reads(self, method, url, data=None):
+        """Aliases the request read conversations from"""
+        real_db_for_read = ReplicaRouter.db_for_read
+        aliases = []
+
+        def db_for_read(router, model, **hints):
+            alias = real_db_for_read(router, model, **hints)
+            if model is Conversation:
+                aliases.append(alias)
+            return alias
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', db_for_read):
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 400)
+        return set(aliases)
+
+    def test_list_and_retrieve_read_from_the_replica(self):
+        self.assertEqual(self.conversation_reads('get', '/api/chat/conversations/'), {'replica1'})
+        url = f'/api/chat/conversations/{self.conversation.pk}/'
+        self.assertEqual(self.conversation_reads('get', url), {'replica1'})
+        self.assertFalse(is_pinned(self.alice.pk))
+
+    def test_writers_read_their_writes_from_the_primary(self):
+        self.conversation_reads('post', '/api/chat/messages/', {
+            'conversation': self.conversation.pk, 'sender_id': self.alice.pk, 'content': 'hi',
+        })
+        self.assertTrue(is_pinned(self.alice.pk))
+        self.assertEqual(self.conversation_reads('get', '/api/chat/conversations/'), {'default'})
@@ -1,3 +1,166 @@
-from django.shortcuts import render
+import hashlib
+from contextlib import ExitStack
 
-# Create your views here.
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+from api import schema
+from pingme.compression import re_accepts_brotli
+from pingme.routers import ais_pinned, is_pinned, pin_to_primary, replica_reads
+from user.authentication import CachedJWTAuthentication
+
+
+def make_etag(*parts):
+    """Weak ETag from version values; the bytes may differ (compression) while the content is the same"""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:24]
+    return f'W/"{digest}"'
+
+
+def conditional_response(request, validators, respond, public=False):
+    """
+    Answer with 304 Not Modified when If-None-Match / If-Modified-Since match
+    ``validators``, an ``(etag, last_modified)`` pair read from cheap version
+    columns, so nothing is loaded or serialized. Otherwise return
+    ``respond()`` with the validators attached. ``validators`` may be None to
+    skip conditional handling (e.g. for a 404). ``public`` lets shared caches
+    keep responses that are the same for everyone.
+    """
+    if validators is None:
+        return respond()
+    etag, last_modified = validators
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+    response.headers['ETag'] = etag
+    if timestamp is not None:
+        response.headers['Last-Modified'] = http_date(timestamp)
+    if public:
+        patch_cache_control(response, public=True, no_cache=True)
+    else:
+        # Per-user content: browsers may keep it but must revalidate, shared caches must not
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ReadReplicaMixin:
+    """
+    Serve ``replica_actions`` from a read replica for safe requests, unless
+    the user wrote recently; successful unsafe requests pin the user to the
+    primary for a while (see pingme/routers.py).
+    """
+    replica_actions = ('list', 'retrieve')
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if (
+            request.method in SAFE_METHODS
+            and self.action in self.replica_actions
+            and not is_pinned(request.user.id)
+        ):
+            self._replica_context = ExitStack()
+            self._replica_context.enter_context(replica_reads())
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        replica_context = getattr(self, '_replica_context', None)
+        if replica_context is not None:
+            self._replica_context = None
+            replica_context.close()
+        elif request.method not in SAFE_METHODS and response.status_code < 400:
+            pin_to_primary(request.user.id)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of DRF's APIView for hot read endpoints.
+
+    Authenticates bearer tokens like the REST API does and keeps the whole
+    request on the event loop instead of DRF's thread-sensitive executor.
+    Subclasses implement ``async def get`` and return ``self.render(...)``.
+    """
+    http_method_names = ['get', 'head', 'options']
+    authentication_class = CachedJWTAuthentication
+    # Read from a replica unless the user wrote recently
+    read_from_replica = False
+    
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            result = await self.authentication_class().aauthenticate(request)
+            if result is None:
+                return self.render(
+                    {'detail': 'Authentication credentials were not provided.'},
+                    status=status.HTTP_401_UNAUTHORIZED
+                )
+            request.user, request.auth = result
+            use_replica = self.read_from_replica and not await ais_pinned(request.user.id)
+            with replica_reads(enabled=use_replica):
+                return await super().dispatch(request, *args, **kwargs)
+        except APIException as exc:
+            return self.render(
+                exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail},
+                status=exc.status_code
+            )
+    
+    def render(self, data, status=status.HTTP_200_OK):
+        return JsonResponse(data, status=status, safe=False)
+    
+    def get_limit(self):
+        """Page size from ``?limit=``, capped at ten pages"""
+        default = settings.REST_FRAMEWORK['PAGE_SIZE']
+        try:
+            limit = int(self.request.GET.get('limit', default))
+        except ValueError:
+            limit = default
+        return max(1, min(limit, default * 10))
+
+
+class SchemaView(View):
+    """
+    The OpenAPI schema served from the prebuilt artifact (see api/schema.py)
+    instead of being generated per request, precompressed in the encoding
+    the client accepts and revalidated by ETag. JSON for ``?format=json`` or
+    a JSON Accept header, YAML otherwise, like SpectacularAPIView.
+    """
+    http_method_names = ['get', 'head']
+
+    def get(self, request):
+        name = self.get_format(request)
+        version, variants = schema.load()
+        encoding = self.get_encoding(request, name, variants)
+
+        def respond():
+            content_type, suffix = schema.FORMATS[name]
+            response = HttpResponse(variants[name, encoding], content_type=content_type)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+            title = settings.SPECTACULAR_SETTINGS.get('TITLE') or 'schema'
+            response.headers['Content-Disposition'] = f'inline; filename="{title}.{suffix}"'
+            return response
+
+        response = conditional_response(request, (make_etag(version, name), None), respond, public=True)
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        return response
+
+    def get_format(self, request):
+        requested = request.GET.get('format')
+        if requested in schema.FORMATS:
+            return requested
+        return 'json' if 'json' in request.headers.get('Accept', '') else 'yaml'
+
+    def get_encoding(self, request, name, variants):
+        accepted = request.headers.get('Accept-Encoding', '')
+        if (name, 'br') in variants and re_accepts_brotli.search(accepted):
+            return 'br'
+        if re_accepts_gzip.search(accepted):
+            return 'gzip'
+        return 'identity'
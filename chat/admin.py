@@ -1,28 +1,105 @@
+from datetime import datetime
+
 from django.contrib import admin
+from django.db.models import Count, IntegerField, Max, Min, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from django.forms.models import BaseInlineFormSet
+from django.utils import timezone
 from django.utils.html import format_html
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import Conversation, Message
+
+from pingme.paginators import EstimatedCountPaginator
+from .models import Conversation, Membership, Message, MessageArchive
+from .signals import chat_rows_updated
+from .unread import set_read_state
 
 User = get_user_model()
 
+# Participants shown per conversation in the changelists
+PARTICIPANT_PREVIEW = 5
+
+
+class MonthListFilter(admin.SimpleListFilter):
+    """
+    Month drill-down on an indexed date column. The months come from
+    MIN/MAX (two index lookups) instead of the DISTINCT over the whole table
+    that date_hierarchy runs, and the chosen month is a range the index serves.
+    """
+    field_name = None
+    max_months = 24
+    
+    def lookups(self, request, model_admin):
+        bounds = model_admin.model._default_manager.aggregate(
+            first=Min(self.field_name), last=Max(self.field_name)
+        )
+        if bounds['last'] is None:
+            return []
+        first, last = (timezone.localtime(bounds[key]) for key in ('first', 'last'))
+        year, month = last.year, last.month
+        months = []
+        while (year, month) >= (first.year, first.month) and len(months) < self.max_months:
+            months.append((f'{year}-{month:02}', datetime(year, month, 1).strftime('%B %Y')))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return months
+    
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            year, month = (int(part) for part in self.value().split('-'))
+            start = timezone.make_aware(datetime(year, month, 1))
+        except ValueError:
+            return queryset.none()
+        end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+        return queryset.filter(**{f'{self.field_name}__gte': start, f'{self.field_name}__lt': end})
+
+
+def month_filter(field_name, title):
+    return type(f'{field_name.title()}MonthFilter', (MonthListFilter,), {
+        'field_name': field_name,
+        'parameter_name': f'{field_name}_month',
+        'title': title,
+    })
+
+
+class LimitedInlineFormSet(BaseInlineFormSet):
+    """Inline showing only the first ``limit`` rows, so large conversations still open"""
+    ordering = ['pk']
+    limit = 100
+    
+    def get_queryset(self):
+        if not hasattr(self, '_limited'):
+            self._limited = list(super().get_queryset().order_by(*self.ordering)[:self.limit])
+        return self._limited
+
+
+class RecentMessagesFormSet(LimitedInlineFormSet):
+    ordering = ['-timestamp']
+    limit = 20
+
 
 class ParticipantInline(admin.TabularInline):
     """Inline for displaying participants in Conversation admin"""
-    model = Conversation.participants.through
+    model = Membership
     extra = 1
+    fields = ['user', 'role', 'muted', 'last_read_message_id', 'joined_at']
+    readonly_fields = ['joined_at']
+    # A select listing every user does not scale; pick users by id
+    raw_id_fields = ['user']
+    formset = LimitedInlineFormSet
     verbose_name = "Participant"
     verbose_name_plural = "Participants"
     
-    def formfield_for_foreignkey(self, db_field, request, **kwargs):
-        if db_field.name == "user":
-            kwargs["queryset"] = User.objects.filter(is_active=True).order_by('username')
-        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
 
 
 class MessageInline(admin.TabularInline):
-    """Inline for displaying messages in Conversation admin"""
+    """Inline for displaying the latest messages in Conversation admin"""
     model = Message
+    formset = RecentMessagesFormSet
+    verbose_name_plural = "Recent messages"
     extra = 0
     readonly_fields = ['sender', 'timestamp', 'get_preview']
     fields = ['sender', 'get_preview', 'is_read', 'timestamp']
@@ -46,6 +123,9 @@ class MessageInline(admin.TabularInline):
     
     def has_change_permission(self, request, obj=None):
         return False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('sender')
 
 
 @admin.register(Conversation)
@@ -61,7 +141,9 @@ class ConversationAdmin(admin.ModelAdmin):
     ]
     list_filter = [
         'is_group', 
+        'is_broadcast',
         'created_at', 
+        month_filter('created_at', 'created in'),
         'updated_at'
     ]
     search_fields = [
@@ -77,7 +159,7 @@ class ConversationAdmin(admin.ModelAdmin):
     ]
     fieldsets = (
         ('Basic Information', {
-            'fields': ('is_group', 'group_name', 'group_admin')
+            'fields': ('is_group', 'is_broadcast', 'group_name', 'group_admin')
         }),
         ('Participants', {
             'fields': ('participants_list',)
@@ -88,36 +170,39 @@ class ConversationAdmin(admin.ModelAdmin):
         }),
     )
     inlines = [ParticipantInline, MessageInline]
-    filter_horizontal = ('participants',)
     autocomplete_fields = ['group_admin']
     list_per_page = 20
-    date_hierarchy = 'created_at'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def get_participants_list(self, obj):
         """Display participants as clickable links"""
-        participants = obj.participants.all()[:5]  # Show first 5 participants
+        participants = obj.first_participants
         links = []
         for user in participants:
-            url = reverse('admin:auth_user_change', args=[user.id])
+            url = reverse('admin:user_user_change', args=[user.id])
             links.append(f'<a href="{url}">{user.username}</a>')
         
-        participant_count = obj.participants.count()
-        if participant_count > 5:
-            links.append(f'<span class="help">+{participant_count - 5} more</span>')
+        # Cached count, kept up to date by chat.signals
+        if obj.participant_count > PARTICIPANT_PREVIEW:
+            links.append(f'<span class="help">+{obj.participant_count - PARTICIPANT_PREVIEW} more</span>')
         
         return format_html(', '.join(links))
     get_participants_list.short_description = 'Participants'
     get_participants_list.admin_order_field = 'participants__username'
     
     def participants_list(self, obj):
-        """Display all participants in detail view"""
-        participants = obj.participants.all()
-        return format_html('<br>'.join([f'• {user.username} ({user.email})' for user in participants]))
+        """Display participants in detail view, up to 100"""
+        participants = obj.participants.only('username', 'email').order_by('username')[:100]
+        lines = [f'• {user.username} ({user.email})' for user in participants]
+        if obj.participant_count > len(lines):
+            lines.append(f'… and {obj.participant_count - len(lines)} more')
+        return format_html('<br>'.join(lines))
     participants_list.short_description = 'All Participants'
     
     def message_count(self, obj):
         """Display total message count"""
-        return obj.messages.count()
+        return obj.message_total
     message_count.short_description = 'Messages'
     
     def message_count_display(self, obj):
@@ -128,18 +213,28 @@ class ConversationAdmin(admin.ModelAdmin):
     
     def last_activity(self, obj):
         """Show last message timestamp"""
-        last_message = obj.messages.last()
-        if last_message:
-            return last_message.timestamp
-        return obj.updated_at
+        return obj.last_message_at or obj.updated_at
     last_activity.short_description = 'Last Activity'
     last_activity.admin_order_field = 'updated_at'
     
     def get_queryset(self, request):
-        """Optimize queries with select_related and prefetch_related"""
-        return super().get_queryset(request).prefetch_related(
-            'participants',
-            'messages'
+        """
+        Message count and latest timestamp as correlated subqueries, which
+        the database evaluates only for the rows of the page, each from the
+        (conversation, timestamp) index; participants limited to a preview
+        """
+        messages = Message.objects.filter(conversation=OuterRef('pk')).order_by().values('conversation')
+        return super().get_queryset(request).annotate(
+            message_total=Coalesce(
+                Subquery(messages.annotate(total=Count('pk')).values('total'), output_field=IntegerField()), 0
+            ),
+            last_message_at=Subquery(messages.annotate(last=Max('timestamp')).values('last')),
+        ).prefetch_related(
+            Prefetch(
+                'participants',
+                queryset=User.objects.only('username').order_by('username')[:PARTICIPANT_PREVIEW],
+                to_attr='first_participants',
+            )
         ).select_related('group_admin')
 
 
@@ -157,6 +252,7 @@ class MessageAdmin(admin.ModelAdmin):
     list_filter = [
         'is_read', 
         'timestamp', 
+        month_filter('timestamp', 'sent in'),
         'attachment_type',
         'conversation__is_group'
     ]
@@ -169,7 +265,8 @@ class MessageAdmin(admin.ModelAdmin):
     readonly_fields = [
         'timestamp',
         'get_attachment_preview',
-        'get_conversation_link'
+        'get_conversation_link',
+        'client_id'
     ]
     fieldsets = (
         ('Message Details', {
@@ -180,7 +277,7 @@ class MessageAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Metadata', {
-            'fields': ('timestamp', 'get_conversation_link'),
+            'fields': ('timestamp', 'client_id', 'get_conversation_link'),
             'classes': ('collapse',)
         }),
     )
@@ -188,12 +285,13 @@ class MessageAdmin(admin.ModelAdmin):
     autocomplete_fields = ['sender']
     list_select_related = ['sender', 'conversation']
     list_per_page = 50
-    date_hierarchy = 'timestamp'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     actions = ['mark_as_read', 'mark_as_unread']
     
     def get_sender(self, obj):
         """Display sender as clickable link"""
-        url = reverse('admin:auth_user_change', args=[obj.sender.id])
+        url = reverse('admin:user_user_change', args=[obj.sender.id])
         return format_html(f'<a href="{url}">{obj.sender.username}</a>')
     get_sender.short_description = 'Sender'
     get_sender.admin_order_field = 'sender__username'
@@ -205,7 +303,10 @@ class MessageAdmin(admin.ModelAdmin):
         if obj.conversation.is_group and obj.conversation.group_name:
             display_name = obj.conversation.group_name
         else:
-            participants = obj.conversation.participants.exclude(id=obj.sender.id)[:3]
+            # Filter the prefetched participants instead of querying per row
+            participants = [
+                p for p in obj.conversation.first_participants if p.id != obj.sender_id
+            ][:3]
             names = [p.username for p in participants]
             if len(names) > 2:
                 display_name = f"{', '.join(names[:2])} +{len(names)-2}"
@@ -263,21 +364,52 @@ class MessageAdmin(admin.ModelAdmin):
     
     def mark_as_read(self, request, queryset):
         """Admin action to mark messages as read"""
-        updated = queryset.update(is_read=True)
+        updated = self.update_read_state(queryset, read=True)
         self.message_user(request, f'{updated} message(s) marked as read.')
     mark_as_read.short_description = "Mark selected messages as read"
     
     def mark_as_unread(self, request, queryset):
         """Admin action to mark messages as unread"""
-        updated = queryset.update(is_read=False)
+        updated = self.update_read_state(queryset, read=False)
         self.message_user(request, f'{updated} message(s) marked as unread.')
     mark_as_unread.short_description = "Mark selected messages as unread"
     
+    def update_read_state(self, queryset, read):
+        """Update is_read and the unread badges of the members it affects"""
+        changed = set_read_state(Message.objects.filter(pk__in=queryset.values('pk')), read=read)
+        chat_rows_updated.send(sender=Message, messages=changed, conversation_ids=[])
+        return sum(len(ids) for ids in changed.values())
+    
     def get_queryset(self, request):
         """Optimize queries with select_related"""
         return super().get_queryset(request).select_related(
             'sender', 'conversation'
-        ).prefetch_related('conversation__participants')
+        ).prefetch_related(
+            Prefetch(
+                'conversation__participants',
+                queryset=User.objects.only('username').order_by('pk')[:4],
+                to_attr='first_participants',
+            )
+        )
+
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['conversation', 'month', 'message_count', 'updated_at']
+    list_select_related = ['conversation']
+    raw_id_fields = ['conversation']
+    exclude = ['data']
+    readonly_fields = [
+        'conversation', 'month', 'message_count',
+        'first_message_id', 'last_message_id', 'created_at', 'updated_at'
+    ]
+    date_hierarchy = 'month'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 # Optional: Add custom admin site header and title
@@ -0,0 +1,195 @@
+"""
+Moving old messages out of the hot ``chat_message`` table into compressed
+per-conversation, per-month ``MessageArchive`` segments, and reading them back.
+"""
+import json
+import zlib
+from collections import Counter
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from chat import unread
+from chat.models import Conversation, Message, MessageArchive
+from chat.sharding import scatter
+
+User = get_user_model()
+
+_archiving = ContextVar('archiving', default=False)
+
+# Column order of the rows stored in a segment
+FIELDS = ('id', 'sender_id', 'content', 'timestamp', 'is_read', 'attachment', 'attachment_type')
+
+
+def encode_rows(rows):
+    payload = json.dumps({'fields': FIELDS, 'rows': rows}, separators=(',', ':'))
+    return zlib.compress(payload.encode(), 9)
+
+
+def decode_rows(data):
+    payload = json.loads(zlib.decompress(bytes(data)))
+    fields = payload['fields']
+    return [dict(zip(fields, row)) for row in payload['rows']]
+
+
+def message_to_row(message):
+    return [
+        message.id,
+        message.sender_id,
+        message.content,
+        message.timestamp.isoformat(),
+        message.is_read,
+        message.attachment.name or None,
+        message.attachment_type,
+    ]
+
+
+def is_archiving():
+    """True while archive_conversation deletes hot rows, which are moved rather than removed"""
+    return _archiving.get()
+
+
+def month_of(timestamp):
+    return date(timestamp.year, timestamp.month, 1)
+
+
+def month_after(month):
+    """Start of the month after ``month``, as an aware UTC datetime"""
+    year, month = divmod(month.year * 12 + month.month, 12)
+    return datetime(year, month + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_cutoff(conversation):
+    days = conversation.retention_days
+    if days is None:
+        days = settings.CHAT_ARCHIVE['AFTER_DAYS']
+    if not days:
+        # 0: this conversation (or, by default, every one) is never archived
+        return None
+    return timezone.now() - timedelta(days=days)
+
+
+def write_segment(conversation_id, month, rows):
+    """Merge ``rows`` (lists in FIELDS order) into the month's segment"""
+    segment = MessageArchive.objects.select_for_update().filter(
+        conversation_id=conversation_id, month=month
+    ).first()
+    if segment is not None:
+        # FIELDS order is fixed, so stored rows can be merged as lists
+        existing = [[row[field] for field in FIELDS] for row in decode_rows(segment.data)]
+        rows = existing + rows
+    rows = sorted({row[0]: row for row in rows}.values(), key=lambda row: row[0])
+    if segment is None:
+        segment = MessageArchive(conversation_id=conversation_id, month=month)
+    segment.data = encode_rows(rows)
+    segment.message_count = len(rows)
+    segment.first_message_id = rows[0][0]
+    segment.last_message_id = rows[-1][0]
+    segment.save()
+    return segment
+
+
+def archive_conversation(conversation, cutoff=None, batch_size=None):
+    """
+    Archive the conversation's messages older than its cutoff; returns how
+    many moved. Each month is one transaction that writes its segment once;
+    ``batch_size`` rows are read and deleted per query.
+    """
+    cutoff = cutoff or archive_cutoff(conversation)
+    if cutoff is None:
+        return 0
+    batch_size = batch_size or settings.CHAT_ARCHIVE['BATCH_SIZE']
+    old_messages = Message.objects.filter(conversation=conversation, timestamp__lt=cutoff).order_by('timestamp', 'id')
+    moved = 0
+    while True:
+        # The conversation's database, which is a shard when chat is sharded
+        with transaction.atomic(using=conversation._state.db):
+            oldest = old_messages.values_list('timestamp', flat=True).first()
+            if oldest is None:
+                return moved
+            month = month_of(oldest)
+            rows = []
+            unread_by_sender = Counter()
+            for message in old_messages.filter(timestamp__lt=month_after(month)).iterator(chunk_size=batch_size):
+                rows.append(message_to_row(message))
+                if not message.is_read:
+                    unread_by_sender[message.sender_id] += 1
+            write_segment(conversation.pk, month, rows)
+            # Unread messages leave the table the unread badges count
+            unread.read_state_changed(conversation.pk, dict(unread_by_sender))
+            token = _archiving.set(True)
+            try:
+                for start in range(0, len(rows), batch_size):
+                    Message.objects.filter(pk__in=[row[0] for row in rows[start:start + batch_size]]).delete()
+            finally:
+                _archiving.reset(token)
+        moved += len(rows)
+
+
+def merge_archives(keeper_id, conversation_ids):
+    """Fold other conversations' segments into ``keeper_id`` (used when merging conversations)"""
+    for segment in MessageArchive.objects.filter(conversation_id__in=conversation_ids):
+        rows = [[row[field] for field in FIELDS] for row in decode_rows(segment.data)]
+        write_segment(keeper_id, segment.month, rows)
+        segment.delete()
+
+
+def parse_month(value):
+    """``'2026-03'`` -> ``date(2026, 3, 1)``, or None when malformed"""
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except (AttributeError, ValueError):
+        return None
+
+
+def archived_messages(conversation, month):
+    """
+    Unsaved Message instances rebuilt from a segment, oldest first, with
+    ``sender`` attached so they serialize exactly like hot messages.
+    """
+    segment = MessageArchive.objects.filter(conversation=conversation, month=month).first()
+    if segment is None:
+        return []
+    rows = decode_rows(segment.data)
+    senders = User.objects.in_bulk({row['sender_id'] for row in rows})
+    messages = []
+    for row in rows:
+        if row['sender_id'] not in senders:
+            # Deleting a user cascades to their hot messages; mirror that here
+            continue
+        message = Message(
+            id=row['id'],
+            conversation=conversation,
+            sender_id=row['sender_id'],
+            content=row['content'],
+            timestamp=parse_datetime(row['timestamp']),
+            is_read=row['is_read'],
+            attachment=row['attachment'],
+            attachment_type=row['attachment_type'],
+        )
+        message.sender = senders[row['sender_id']]
+        messages.append(message)
+    return messages
+
+
+def conversations_to_archive():
+    """Conversations that may hold messages past their retention"""
+    ids = set(scatter(
+        Conversation.objects.filter(retention_days__gt=0).values_list('pk', flat=True)
+    ))
+    default_days = settings.CHAT_ARCHIVE['AFTER_DAYS']
+    if default_days:
+        cutoff = timezone.now() - timedelta(days=default_days)
+        ids.update(scatter(
+            Message.objects.filter(timestamp__lt=cutoff)
+            .values_list('conversation_id', flat=True)
+            .order_by()
+            .distinct()
+        ))
+    return Conversation.objects.filter(pk__in=ids)
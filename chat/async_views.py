@@ -0,0 +1,114 @@
+from django.db.models import Case, Count, IntegerField, OuterRef, Prefetch, Subquery, When
+from django.db.models.functions import Coalesce
+
+from api.serializers import load_only, requested_fields, serializer_columns
+from api.views import AsyncAPIView
+from chat.membership import aattach_participants
+from chat.models import Conversation, Membership, Message
+from chat.serializers import (
+    CompactMessageSerializer, InboxConversationSerializer, MessageSerializer, acompact_messages,
+)
+from chat.sharding import scatter
+from user.serializers import UserProfileSerializer
+
+
+def inbox_queryset(user):
+    """User's conversations, newest activity first, with everything the inbox shows"""
+    unread = (
+        Message.objects
+        .filter(conversation=OuterRef('pk'), is_read=False)
+        .exclude(sender=user)
+        .values('conversation')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    # Broadcast conversations count from the user's read cursor instead
+    read_cursor = Membership.objects.filter(conversation=OuterRef('pk'), user=user).values('last_read_message_id')
+    unread_after_cursor = (
+        Message.objects
+        .filter(conversation=OuterRef('pk'), id__gt=Coalesce(OuterRef('read_cursor'), 0))
+        .exclude(sender=user)
+        .values('conversation')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    # Senders and participants are loaded in separate queries: users are not
+    # on the same database as conversations when chat is sharded
+    latest = load_only(Message.objects.order_by('-timestamp', '-id'), MessageSerializer())[:1]
+    conversations = load_only(Conversation.objects.filter(participants=user), InboxConversationSerializer())
+    return scatter(
+        conversations
+        .annotate(read_cursor=Subquery(read_cursor))
+        .annotate(unread=Coalesce(
+            Case(
+                When(is_broadcast=True, then=Subquery(unread_after_cursor, output_field=IntegerField())),
+                default=Subquery(unread, output_field=IntegerField()),
+            ),
+            0,
+        ))
+        .prefetch_related(Prefetch('messages', queryset=latest, to_attr='latest_messages'))
+        .order_by('-updated_at', '-id')
+    )
+
+
+class InboxView(AsyncAPIView):
+    """Async inbox: the user's conversations, paginated with ``?offset=``"""
+    read_from_replica = True
+    
+    async def get(self, request):
+        limit = self.get_limit()
+        try:
+            offset = max(0, int(request.GET.get('offset', 0)))
+        except ValueError:
+            offset = 0
+        
+        conversations = [
+            conversation
+            async for conversation in inbox_queryset(request.user)[offset:offset + limit + 1]
+        ]
+        has_more = len(conversations) > limit
+        await aattach_participants(
+            conversations[:limit], user_columns=serializer_columns(UserProfileSerializer())[0]
+        )
+        serializer = InboxConversationSerializer(
+            conversations[:limit], many=True, context={'request': request}
+        )
+        return self.render({
+            'next_offset': offset + limit if has_more else None,
+            'results': serializer.data,
+        })
+
+
+class MessageHistoryView(AsyncAPIView):
+    """
+    Async message history of one conversation. Pages go backwards in time
+    with ``?before=<message id>``; each page is returned oldest first.
+    Takes ``?compact=1`` and ``?fields=`` like the REST message lists.
+    """
+    read_from_replica = True
+    
+    async def get(self, request, pk):
+        is_participant = await Conversation.objects.filter(
+            pk=pk, participants=request.user
+        ).aexists()
+        if not is_participant:
+            return self.render({'detail': 'No Conversation matches the given query.'}, status=404)
+        
+        limit = self.get_limit()
+        fields = requested_fields(request.GET)
+        compact = request.GET.get('compact') in ('1', 'true')
+        serializer_class = CompactMessageSerializer if compact else MessageSerializer
+        messages = load_only(Message.objects.filter(conversation_id=pk), serializer_class(fields=fields))
+        before = request.GET.get('before')
+        if before and before.isdigit():
+            messages = messages.filter(id__lt=int(before))
+        
+        page = [message async for message in messages.order_by('-id')[:limit + 1]]
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
+        data = {'before': page[0].id if has_more else None}
+        if compact:
+            data['results'], data['users'] = await acompact_messages(page, fields)
+        else:
+            data['results'] = MessageSerializer(page, many=True, fields=fields).data
+        return self.render(data)
@@ -1,63 +1,294 @@
 # chat/consumers.py
 import json
+import random
+import weakref
+from functools import partial
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import AnonymousUser
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from api.profiling import aprofile, requested_mode
+from chat.membership import (
+    acan_post, advance_read_cursor, ais_broadcast, ais_member, amember_ids, asubscribed_broadcast_ids,
+    broadcast_group,
+)
+from chat.models import Message
+from chat.serializers import MessageSerializer
+from chat.signals import messages_read
+from chat.unread import set_read_state
+from pingme.routers import pin_to_primary
+from user.cache import get_cached_user
+from user.middleware import ConnectionUser
+
+# Close code after a drain: 1012 ("Service Restart") moved to the private
+# range, daphne's WebSocket library only lets applications send 1000 and 3000-4999
+SERVICE_RESTART = 4012
+
+CLIENT_ID_LENGTH = Message._meta.get_field('client_id').max_length
+
+# Connected consumers of this process, for drain_consumers()
+_live = weakref.WeakSet()
+_draining = False
+
+
+async def drain_consumers():
+    """
+    Ask every client connected to this process to reconnect elsewhere, once
+    the message its consumer is handling (if any) is done, and refuse new
+    connections. Each client gets its own random delay within
+    LAUNCHER['RECONNECT_SPREAD_MS'] so they do not all come back at once.
+    Returns the number of consumers asked.
+    """
+    global _draining
+    _draining = True
+    spread = settings.LAUNCHER['RECONNECT_SPREAD_MS']
+    channel_layer = get_channel_layer()
+    consumers = list(_live)
+    for consumer in consumers:
+        # Queued behind whatever the consumer is processing, so in-flight
+        # sends finish before the socket closes
+        await channel_layer.send(consumer.channel_name, {
+            'type': 'server.drain',
+            'retry_after': random.randint(0, spread),
+        })
+    return len(consumers)
+
+
+def live_consumers():
+    return len(_live)
+
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    Connections are idle most of the time, so the consumer keeps as little as
+    possible per connection: the user's id, not the user.
+
+    Messages of broadcast conversations reach subscribers through the
+    conversation's group (``broadcast_<id>``), which each connection joins for
+    its subscriptions, instead of one send per subscriber. Typing indicators
+    and read receipts are not shared there; reading only moves the reader's
+    read cursor.
+
+    A ``message`` frame may carry a ``client_id`` (up to 64 characters,
+    unique per sender and conversation). The sender then gets ``{"type": "message_ack",
+    "client_id": ..., "message": {...}, "duplicate": <bool>}`` once the
+    message is stored and can drop it from its pending queue; resending with
+    the same client_id is acknowledged again (``duplicate`` true) without
+    storing or delivering the message twice.
+
+    ``{"type": "unread_total", "unread": n}`` carries the user's new unread
+    badge whenever it changes (see chat/unread.py).
+
+    Staff users can add ``"profile": true`` (or ``"sample"``) to a frame to
+    have its handling profiled (api/profiling.py); they then get
+    ``{"type": "profile", "id": <RequestProfile id>}``.
+
+    Besides chat events, clients may receive ``{"type": "reconnect",
+    "retry_after": <ms>}`` when the server shuts down; the socket then closes
+    with code 4012 and the client should reconnect after ``retry_after``
+    milliseconds, backing off from there if that fails.
+    """
+    # Set once the connection is accepted; rejected ones disconnect without them
+    user_id = None
+    broadcast_ids = ()
+
     async def connect(self):
-        self.user = self.scope["user"]
-        if self.user == AnonymousUser():
+        user = self.scope["user"]
+        if not user.is_authenticated or _draining:
             await self.close()
             return
-        
-        self.room_group_name = f"user_{self.user.id}"
-        
+
+        # Only the id is kept while the connection is open; a session user
+        # is a full model instance, swap it for the lean form token
+        # connections already have
+        self.user_id = user.id
+        if not isinstance(user, ConnectionUser):
+            self.scope["user"] = ConnectionUser.from_user(user)
+
         # Join user's personal room
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
+        # And the groups of the broadcast conversations they subscribe to
+        self.broadcast_ids = tuple(await asubscribed_broadcast_ids(self.user_id))
+        for conversation_id in self.broadcast_ids:
+            await self.channel_layer.group_add(broadcast_group(conversation_id), self.channel_name)
+
         await self.accept()
-    
+        _live.add(self)
+
     async def disconnect(self, close_code):
-        if hasattr(self, 'room_group_name'):
+        _live.discard(self)
+        if self.user_id is not None:
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
-    
+        for conversation_id in self.broadcast_ids:
+            await self.channel_layer.group_discard(broadcast_group(conversation_id), self.channel_name)
+
+    @property
+    def room_group_name(self):
+        return f"user_{self.user_id}"
+
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if data.get('profile') and self.scope["user"].is_staff and settings.PROFILING['ENABLED']:
+            profile = await aprofile(
+                requested_mode(data['profile']), partial(self.handle_frame, data),
+                user_id=self.user_id, kind='websocket', target=str(data.get('type'))[:255],
+            )
+            await self.send(text_data=json.dumps({'type': 'profile', 'id': profile.pk}))
+            return
+        await self.handle_frame(data)
+
+    async def handle_frame(self, data):
         message_type = data.get('type')
-        
+
         if message_type == 'message':
             await self.handle_message(data)
         elif message_type == 'typing':
             await self.handle_typing(data)
         elif message_type == 'read_receipt':
             await self.handle_read_receipt(data)
-    
+
     async def handle_message(self, data):
-        # Save message to database
-        message = await self.save_message(data)
-        
-        # Send to all conversation participants
-        for participant in message.conversation.participants.all():
-            if participant.id != self.user.id:
-                await self.channel_layer.group_send(
-                    f"user_{participant.id}",
-                    {
-                        'type': 'chat_message',
-                        'message': await self.message_to_dict(message)
-                    }
-                )
-    
+        conversation_id = data.get('conversation')
+        client_id = data.get('client_id')
+        if client_id is not None and not (isinstance(client_id, str) and 0 < len(client_id) <= CLIENT_ID_LENGTH):
+            await self.send_error(f'client_id must be a string of 1 to {CLIENT_ID_LENGTH} characters.')
+            return
+        if not await acan_post(conversation_id, self.user_id):
+            await self.send_error('You cannot post to this conversation.')
+            return
+
+        # Save message to database; a retry finds the message it sent before
+        message, created = await self.save_message(data)
+        message_dict = await self.message_to_dict(message)
+        if client_id is not None:
+            await self.send(text_data=json.dumps({
+                'type': 'message_ack',
+                'client_id': client_id,
+                'message': message_dict,
+                'duplicate': not created,
+            }))
+        if not created:
+            # Already delivered the first time
+            return
+        event = {
+            'type': 'chat_message',
+            'message': message_dict
+        }
+
+        if await ais_broadcast(conversation_id):
+            # One send, however many subscribers
+            await self.channel_layer.group_send(broadcast_group(conversation_id), event)
+        else:
+            # Send to all conversation participants
+            await self.fan_out(conversation_id, event)
+
+    async def handle_typing(self, data):
+        conversation_id = data.get('conversation')
+        if await ais_broadcast(conversation_id) or not await ais_member(conversation_id, self.user_id):
+            return
+        await self.fan_out(conversation_id, {
+            'type': 'typing_indicator',
+            'conversation': conversation_id,
+            'user': self.user_id,
+        })
+
+    async def handle_read_receipt(self, data):
+        conversation_id = data.get('conversation')
+        if not await ais_member(conversation_id, self.user_id):
+            return
+        if await ais_broadcast(conversation_id):
+            await self.move_read_cursor(conversation_id, data.get('message'))
+            return
+        await self.mark_read(conversation_id, data.get('message'))
+        await self.fan_out(conversation_id, {
+            'type': 'read_receipt',
+            'conversation': conversation_id,
+            'message': data.get('message'),
+            'user': self.user_id,
+        })
+
+    async def fan_out(self, conversation_id, event):
+        """Send an event to every other participant's personal group"""
+        for user_id in await amember_ids(conversation_id):
+            if user_id != self.user_id:
+                await self.channel_layer.group_send(f"user_{user_id}", event)
+
+    async def send_error(self, detail):
+        await self.send(text_data=json.dumps({'type': 'error', 'detail': detail}))
+
     async def chat_message(self, event):
         await self.send(text_data=json.dumps(event))
-    
+
+    async def typing_indicator(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def read_receipt(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def unread_total(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def notification_batch(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def broadcast_subscribed(self, event):
+        conversation_id = event['conversation']
+        if conversation_id not in self.broadcast_ids:
+            self.broadcast_ids += (conversation_id,)
+            await self.channel_layer.group_add(broadcast_group(conversation_id), self.channel_name)
+
+    async def broadcast_unsubscribed(self, event):
+        conversation_id = event['conversation']
+        if conversation_id in self.broadcast_ids:
+            self.broadcast_ids = tuple(id for id in self.broadcast_ids if id != conversation_id)
+            await self.channel_layer.group_discard(broadcast_group(conversation_id), self.channel_name)
+
+    async def server_drain(self, event):
+        await self.send(text_data=json.dumps({'type': 'reconnect', 'retry_after': event['retry_after']}))
+        await self.close(code=SERVICE_RESTART)
+
     @database_sync_to_async
     def save_message(self, data):
-        # Implementation to save message to database
-        pass
\ No newline at end of file
+        message, created = Message.objects.create_once(
+            conversation_id=data['conversation'],
+            sender_id=self.user_id,
+            content=data.get('content', ''),
+            client_id=data.get('client_id'),
+        )
+        # For the serializer, without keeping a User on the consumer
+        message.sender = get_cached_user(self.user_id)
+        pin_to_primary(self.user_id)
+        return message, created
+
+    @database_sync_to_async
+    def mark_read(self, conversation_id, message_id):
+        messages = Message.objects.filter(conversation_id=conversation_id, is_read=False)
+        if message_id:
+            messages = messages.filter(id__lte=message_id)
+        messages = messages.exclude(sender_id=self.user_id)
+        if set_read_state(messages):
+            messages_read.send(
+                sender=Message, conversation_id=conversation_id,
+                reader_id=self.user_id, up_to=message_id,
+            )
+        pin_to_primary(self.user_id)
+
+    @database_sync_to_async
+    def move_read_cursor(self, conversation_id, message_id):
+        if advance_read_cursor(conversation_id, self.user_id, message_id or None):
+            messages_read.send(
+                sender=Message, conversation_id=conversation_id,
+                reader_id=self.user_id, up_to=message_id,
+            )
+        pin_to_primary(self.user_id)
+
+    @database_sync_to_async
+    def message_to_dict(self, message):
+        return MessageSerializer(message).data
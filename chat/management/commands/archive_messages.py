@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from chat.archive import archive_conversation, conversations_to_archive
+from chat.models import Conversation
+
+
+class Command(BaseCommand):
+    help = (
+        'Move messages older than each conversation\'s retention out of the hot '
+        'table into compressed monthly archive segments'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', type=int, help='Only archive this conversation')
+        parser.add_argument('--batch-size', type=int, help='Messages read and deleted per query')
+
+    def handle(self, *args, **options):
+        if options['conversation']:
+            conversations = Conversation.objects.filter(pk=options['conversation'])
+        else:
+            conversations = conversations_to_archive()
+
+        total = 0
+        for conversation in conversations.iterator():
+            moved = archive_conversation(conversation, batch_size=options['batch_size'])
+            if moved:
+                self.stdout.write(f'Conversation {conversation.pk}: archived {moved} message(s)')
+            total += moved
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} message(s)'))
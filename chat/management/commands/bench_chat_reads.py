@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.benchmarks import benchmark_database, format_row, summarize
+from chat.models import Conversation, Message
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare sync viewsets and async read endpoints under concurrency, '
+        'both served through the ASGI handler, on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--conversations', type=int, default=30)
+        parser.add_argument('--messages', type=int, default=40, help='Messages per conversation')
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            user, conversation = self.seed(options['conversations'], options['messages'])
+            token = str(AccessToken.for_user(user))
+            pairs = [
+                ('inbox', '/api/chat/conversations/', '/api/chat/async/inbox/'),
+                (
+                    'history',
+                    f'/api/chat/conversations/{conversation.pk}/messages/',
+                    f'/api/chat/async/conversations/{conversation.pk}/messages/',
+                ),
+                ('profile', '/auth/profile/', '/auth/async/profile/'),
+            ]
+            self.stdout.write(
+                f'{options["requests"]} requests per endpoint, concurrency {options["concurrency"]}'
+            )
+            for name, sync_url, async_url in pairs:
+                for label, url in ((f'{name} (sync viewset)', sync_url), (f'{name} (async)', async_url)):
+                    stats = asyncio.run(self.hammer(url, token, options['requests'], options['concurrency']))
+                    self.stdout.write(format_row(label, stats))
+
+    def seed(self, conversation_count, message_count):
+        user = User.objects.create_user(email='bench@example.com', username='bench', password='bench-pass-1')
+        peers = [
+            User.objects.create_user(email=f'peer{i}@example.com', username=f'peer{i}', password='bench-pass-1')
+            for i in range(conversation_count)
+        ]
+        conversation = None
+        for peer in peers:
+            conversation = Conversation.objects.create()
+            conversation.participants.set([user, peer])
+            Message.objects.bulk_create([
+                Message(conversation=conversation, sender=peer if i % 2 else user, content=f'message {i}')
+                for i in range(message_count)
+            ])
+        return user, conversation
+
+    async def hammer(self, url, token, total, concurrency):
+        client = AsyncClient()
+        headers = {'Authorization': f'Bearer {token}'}
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(url)
+        timings = []
+
+        async def worker():
+            while not queue.empty():
+                target = queue.get_nowait()
+                started = time.perf_counter()
+                response = await client.get(target, headers=headers)
+                timings.append(time.perf_counter() - started)
+                assert response.status_code == 200, (target, response.status_code)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return summarize(timings, time.perf_counter() - started)
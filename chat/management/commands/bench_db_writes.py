@@ -0,0 +1,123 @@
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connections, transaction
+from django.db.backends.signals import connection_created
+
+from api.benchmarks import benchmark_database, format_row, summarize
+from chat.models import Conversation, Message
+from pingme.database import database_config
+from user.models import User
+
+
+@contextmanager
+def database_profile(profile, path):
+    """Point the default alias at ``profile`` (test database in ``path``) for the block"""
+    connection = connections['default']
+    connection.close()
+    settings_dict = connection.settings_dict
+    original = dict(settings_dict)
+    settings_dict.update(OPTIONS={}, CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False)
+    settings_dict.update(database_config(profile, path))
+    if settings_dict['ENGINE'].endswith('sqlite3'):
+        # A file, not the shared in-memory test database, so locking is real
+        settings_dict['TEST'] = dict(settings_dict['TEST'], NAME=str(path))
+    try:
+        yield
+    finally:
+        connection.close()
+        settings_dict.clear()
+        settings_dict.update(original)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare database profiles (see pingme/database.py) under concurrent '
+        'message writes on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profiles', nargs='+', default=['sqlite', 'sqlite-tuned'],
+            choices=['sqlite', 'sqlite-tuned', 'postgres'],
+        )
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--writes', type=int, default=2000, help='Total messages written per profile')
+        parser.add_argument('--conversations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{options["writes"]} writes per profile, {options["threads"]} threads')
+        opened = []
+        counter = lambda **kwargs: opened.append(1)
+        connection_created.connect(counter)
+        try:
+            for profile in options['profiles']:
+                with tempfile.TemporaryDirectory() as directory:
+                    path = Path(directory) / 'bench.sqlite3'
+                    with database_profile(profile, path), benchmark_database():
+                        conversations = self.seed(options['conversations'])
+                        opened.clear()
+                        stats, errors = self.hammer(conversations, options['writes'], options['threads'])
+                        self.stdout.write(
+                            f'{format_row(profile, stats)}  errors {errors:>5}  connections {len(opened):>5}'
+                        )
+        finally:
+            connection_created.disconnect(counter)
+
+    def seed(self, conversation_count):
+        conversations = []
+        for i in range(conversation_count):
+            users = [
+                User.objects.create_user(email=f'writer{i}-{n}@example.com', username=f'writer{i}-{n}')
+                for n in range(2)
+            ]
+            conversation = Conversation.objects.create()
+            conversation.participants.set(users)
+            conversations.append((conversation.pk, [user.pk for user in users]))
+        return conversations
+
+    def hammer(self, conversations, total, thread_count):
+        """Each write is one "request": reads the conversation, then inserts a message"""
+        remaining = iter(range(total))
+        lock = threading.Lock()
+        timings = []
+        errors = []
+
+        def write(i):
+            conversation_id, user_ids = conversations[i % len(conversations)]
+            with transaction.atomic():
+                conversation = Conversation.objects.get(pk=conversation_id)
+                Message.objects.create(
+                    conversation=conversation, sender_id=user_ids[i % 2], content=f'message {i}'
+                )
+
+        def worker():
+            while True:
+                with lock:
+                    i = next(remaining, None)
+                if i is None:
+                    break
+                # Same connection handling as request_started/request_finished
+                close_old_connections()
+                started = time.perf_counter()
+                try:
+                    write(i)
+                except OperationalError:
+                    # "database is locked"; only successful writes are timed
+                    errors.append(i)
+                else:
+                    timings.append(time.perf_counter() - started)
+                close_old_connections()
+            connections.close_all()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(timings, time.perf_counter() - started), len(errors)
@@ -0,0 +1,83 @@
+import random
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.benchmarks import benchmark_database
+from chat.models import Conversation, Message
+from pingme import compression
+from user.models import User
+
+WORDS = (
+    'ok sure see you at the station tomorrow morning can you send me the file '
+    'from last week running late sorry lunch today? the build is green again '
+    'thanks for the review I pushed a fix let me know what you think'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Bytes on the wire for one page of message history in full, compact and '
+        '?fields= form, uncompressed, gzip and Brotli, on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=60, help='Messages per conversation')
+        parser.add_argument('--group-size', type=int, default=8)
+
+    def handle(self, *args, **options):
+        encodings = ['identity', 'gzip']
+        if compression.brotli is not None:
+            encodings.append('br')
+        else:
+            self.stdout.write('brotli is not installed, skipping br')
+
+        with benchmark_database():
+            rng = random.Random(1)
+            reader, direct, group = self.seed(rng, options['messages'], options['group_size'])
+            client = Client(headers={'Authorization': f'Bearer {AccessToken.for_user(reader)}'})
+            variants = [
+                ('full', ''),
+                ('compact', '?compact=1'),
+                ('compact, fields', '?compact=1&fields=id,sender,content,timestamp'),
+            ]
+            self.stdout.write(f'{"page":<32}' + ''.join(f'{encoding:>12}' for encoding in encodings))
+            for name, conversation in (('1:1', direct), (f'group of {options["group_size"]}', group)):
+                baseline = None
+                for label, query in variants:
+                    url = f'/api/chat/conversations/{conversation.pk}/messages/{query}'
+                    sizes = [self.size(client, url, encoding) for encoding in encodings]
+                    baseline = baseline or sizes[0]
+                    self.stdout.write(
+                        f'{f"{name} {label}":<32}'
+                        + ''.join(f'{size:>7} {size * 100 // baseline:>3}%' for size in sizes)
+                    )
+
+    def size(self, client, url, encoding):
+        response = client.get(url, headers={'Accept-Encoding': encoding})
+        assert response.status_code == 200, (url, response.status_code)
+        assert response.get('Content-Encoding', 'identity') == encoding, (url, encoding)
+        return len(response.content)
+
+    def seed(self, rng, message_count, group_size):
+        """Users with filled-in profiles, a 1:1 and a group conversation"""
+        users = [
+            User.objects.create_user(
+                email=f'payload{i}@example.com', username=f'payload{i}', password='bench-pass-1',
+                first_name=f'First{i}', last_name=f'Last{i}', phone_number=f'+4412345678{i:02}',
+                bio=' '.join(rng.choices(WORDS, k=40)),
+            )
+            for i in range(group_size)
+        ]
+        direct = Conversation.objects.create()
+        direct.participants.set(users[:2])
+        group = Conversation.objects.create(is_group=True, group_name='Payloads', group_admin=users[0])
+        group.participants.set(users)
+        for conversation, senders in ((direct, users[:2]), (group, users)):
+            for i in range(message_count):
+                Message.objects.create(
+                    conversation=conversation, sender=rng.choice(senders),
+                    content=' '.join(rng.choices(WORDS, k=rng.randint(2, 20))),
+                )
+        return users[0], direct, group
@@ -0,0 +1,115 @@
+import asyncio
+import gc
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.benchmarks import benchmark_database
+from user.models import User
+
+# Headers a browser sends on a WebSocket handshake, roughly
+HEADERS = [
+    (b'host', b'testserver'),
+    (b'origin', b'http://testserver'),
+    (b'user-agent', b'Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0'),
+    (b'accept-language', b'en-US,en;q=0.5'),
+    (b'sec-websocket-version', b'13'),
+    (b'sec-websocket-key', b'dGhlIHNhbXBsZSBub25jZQ=='),
+    (b'connection', b'Upgrade'),
+    (b'upgrade', b'websocket'),
+]
+
+
+def rss_kib():
+    with open('/proc/self/status') as status:
+        return int(status.read().split('VmRSS:')[1].split()[0])
+
+
+class Command(BaseCommand):
+    help = (
+        'Memory held per idle WebSocket connection by the ASGI application '
+        '(middleware, consumer, channel layer): RSS and Python heap growth '
+        'over N connections opened in-process, on a throwaway database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=5000, help='One user each')
+        parser.add_argument(
+            '--tracemalloc', type=int, default=0, metavar='N',
+            help='Also trace Python allocations (slow, inflates RSS) and list the N largest sources',
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_database():
+            users = User.objects.bulk_create([
+                User(email=f'ws{i}@example.com', username=f'ws{i}', password='!')
+                for i in range(options['connections'] + 100)
+            ])
+            tokens = [str(AccessToken.for_user(user)).encode() for user in users]
+            asyncio.run(self.measure(tokens[:100], tokens[100:], options['tracemalloc']))
+
+    async def measure(self, warmup_tokens, tokens, top):
+        from pingme.asgi import application
+
+        # Warm up code paths, caches and the channel layer first
+        warm = [await self.connect(application, token) for token in warmup_tokens]
+        await self.close(warm)
+
+        gc.collect()
+        rss_before = rss_kib()
+        if top:
+            tracemalloc.start()
+            snapshot_before = tracemalloc.take_snapshot()
+        count = len(tokens)
+        connections = [await self.connect(application, token) for token in tokens]
+        gc.collect()
+        rss = rss_kib() - rss_before
+
+        self.stdout.write(f'{count} idle connections')
+        self.stdout.write(f'RSS          {rss / 1024:8.1f} MiB  {rss / count:6.2f} KiB per connection')
+        if top:
+            stats = tracemalloc.take_snapshot().compare_to(snapshot_before, 'lineno')
+            tracemalloc.stop()
+            heap = sum(stat.size_diff for stat in stats)
+            self.stdout.write(f'Python heap  {heap / 1024 / 1024:8.1f} MiB  {heap / count / 1024:6.2f} KiB per connection')
+            for stat in stats[:top]:
+                self.stdout.write(f'  {stat.size_diff / count:8.0f} B  {stat.traceback[0]}')
+        self.stdout.write(
+            'Server socket buffers and the WebSocket protocol object of daphne '
+            'come on top; only the application side is measured'
+        )
+        await self.close(connections)
+
+    async def connect(self, application, token):
+        """Drive one connection like daphne does: an input queue and a send callable"""
+        scope = {
+            'type': 'websocket',
+            'asgi': {'version': '3.0'},
+            'scheme': 'ws',
+            'path': '/ws/chat/',
+            'raw_path': b'/ws/chat/',
+            'query_string': b'token=' + token,
+            'root_path': '',
+            'headers': list(HEADERS),
+            'client': ('127.0.0.1', 50000),
+            'server': ('127.0.0.1', 8000),
+            'subprotocols': [],
+        }
+        queue = asyncio.Queue()
+        accepted = asyncio.get_running_loop().create_future()
+
+        async def send(message):
+            if not accepted.done():
+                accepted.set_result(message)
+
+        task = asyncio.ensure_future(application(scope, queue.get, send))
+        await queue.put({'type': 'websocket.connect'})
+        message = await accepted
+        assert message['type'] == 'websocket.accept', message
+        return task, queue
+
+    async def close(self, connections):
+        for task, queue in connections:
+            await queue.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
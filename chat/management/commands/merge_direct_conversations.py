@@ -0,0 +1,102 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Max, Value, When
+
+from chat.archive import merge_archives
+from chat.models import Conversation, Membership, Message
+from chat.signals import chat_rows_updated
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill Conversation.direct_key for existing 1:1 conversations and merge '
+        'duplicate conversations between the same pair of users'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without changing anything')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        by_key = self.group_by_pair()
+        merged = keyed = 0
+
+        for key, conversation_ids in by_key.items():
+            keeper, *duplicates = sorted(conversation_ids)
+            if duplicates:
+                self.stdout.write(f'{key}: keeping {keeper}, merging {duplicates}')
+            if dry_run:
+                merged += len(duplicates)
+                continue
+            with transaction.atomic():
+                self.merge(key, keeper, duplicates)
+            merged += len(duplicates)
+            keyed += 1
+
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}{len(by_key)} direct pairs, {merged} duplicate conversations merged, {keyed} keys written'
+        ))
+
+    def group_by_pair(self):
+        """Map each direct pair key to the ids of its 1:1 conversations"""
+        members = defaultdict(list)
+        memberships = (
+            Membership.objects
+            .filter(conversation__is_group=False, conversation__participant_count__in=[1, 2])
+            .values_list('conversation_id', 'user_id')
+            .order_by('conversation_id')
+        )
+        for conversation_id, user_id in memberships.iterator(chunk_size=2000):
+            members[conversation_id].append(user_id)
+
+        by_key = defaultdict(list)
+        for conversation_id, user_ids in members.items():
+            # Keyed like ConversationSerializer.create keys new ones
+            pair = Conversation.direct_pair(user_ids)
+            if pair is not None:
+                by_key[Conversation.make_direct_key(*pair)].append(conversation_id)
+        return by_key
+
+    def merge(self, key, keeper, duplicates):
+        moved = []
+        if duplicates:
+            moved = list(Message.objects.filter(conversation_id__in=duplicates).values_list('pk', flat=True))
+            self.release_client_ids(keeper, duplicates)
+            Message.objects.filter(conversation_id__in=duplicates).update(conversation_id=keeper)
+            merge_archives(keeper, duplicates)
+            Conversation.objects.filter(pk__in=duplicates).delete()
+
+        last_activity = (
+            Conversation.objects.filter(pk=keeper)
+            .aggregate(last=Max('messages__timestamp'))['last']
+        )
+        Conversation.objects.filter(pk=keeper).update(direct_key=key)
+        if last_activity:
+            Conversation.objects.filter(pk=keeper, updated_at__lt=last_activity).update(updated_at=last_activity)
+        chat_rows_updated.send(sender=Conversation, messages={keeper: moved} if moved else {}, conversation_ids=[keeper])
+
+    def release_client_ids(self, keeper, duplicates):
+        """Clear client ids a moved message shares with another sent by the same user
+
+        client_id is unique per conversation, so the keeper's message, or else
+        the oldest, keeps it and the others are stored without one.
+        """
+        seen = set()
+        clashes = []
+        messages = (
+            Message.objects
+            .filter(conversation_id__in=[keeper, *duplicates], client_id__isnull=False)
+            .annotate(moved=Case(When(conversation_id=keeper, then=Value(1)), default=Value(2)))
+            .order_by('moved', 'pk')
+            .values_list('pk', 'sender_id', 'client_id')
+        )
+        for pk, sender_id, client_id in messages.iterator(chunk_size=2000):
+            if (sender_id, client_id) in seen:
+                clashes.append(pk)
+            else:
+                seen.add((sender_id, client_id))
+        if clashes:
+            Message.objects.filter(pk__in=clashes).update(client_id=None)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from chat.unread import reconcile_batches
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount every user\'s unread badge from the messages and fix the '
+        'counters that drifted, in batches of users'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--users', type=int, nargs='+', metavar='ID', help='Only these users')
+
+    def handle(self, *args, **options):
+        checked = fixed = 0
+        for batch, drifted in reconcile_batches(options['users'], options['batch_size']):
+            for user_id, (was, now) in drifted.items():
+                self.stdout.write(f'User {user_id}: {was} -> {now}')
+            checked += len(batch)
+            fixed += len(drifted)
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} users, fixed {fixed} counters'))
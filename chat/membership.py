@@ -0,0 +1,315 @@
+"""
+Cached "who is in this conversation" lookups used for fan-out and permission
+checks. Broadcast conversations are never loaded as a member set: their
+subscribers are checked one indexed row at a time and reached through the
+conversation's channel-layer group (``broadcast_group``).
+"""
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from chat import sharding
+from chat.models import Conversation, Membership, Message
+from chat.sharding import scatter
+from pingme.cache import TwoLevelCache
+
+User = get_user_model()
+
+# Ids bound per query when users have to be looked up by id, below SQLite's
+# limit on query parameters
+ID_CHUNK_SIZE = 900
+
+_members = TwoLevelCache(
+    'conversation-members',
+    local_ttl=settings.MEMBERSHIP_CACHE['LOCAL_TTL'],
+    shared_ttl=settings.MEMBERSHIP_CACHE['SHARED_TTL'],
+    immutable=True,
+)
+_broadcast = TwoLevelCache(
+    'conversation-broadcast',
+    local_ttl=settings.MEMBERSHIP_CACHE['LOCAL_TTL'],
+    shared_ttl=settings.MEMBERSHIP_CACHE['SHARED_TTL'],
+    immutable=True,
+)
+# The user changing memberships in this context, see ``changed_by``
+_changed_by = ContextVar('membership_changed_by', default=None)
+
+# Not invalidated: a new contact only changes search ranking, for a few minutes
+_contacts = TwoLevelCache(
+    'user-contacts',
+    local_ttl=settings.MEMBERSHIP_CACHE['LOCAL_TTL'],
+    shared_ttl=settings.MEMBERSHIP_CACHE['SHARED_TTL'],
+    immutable=True,
+)
+
+
+@contextmanager
+def changed_by(user_id):
+    """Attribute the membership changes made inside to ``user_id``, who is not notified of them"""
+    token = _changed_by.set(user_id)
+    try:
+        yield
+    finally:
+        _changed_by.reset(token)
+
+
+def membership_actor():
+    """The user ``changed_by`` attributes the current membership changes to, or None"""
+    return _changed_by.get()
+
+
+def _load_member_ids(conversation_id):
+    return frozenset(
+        Membership.objects.filter(conversation_id=conversation_id).values_list('user_id', flat=True)
+    )
+
+
+async def _aload_member_ids(conversation_id):
+    return frozenset([
+        user_id async for user_id in
+        Membership.objects.filter(conversation_id=conversation_id).values_list('user_id', flat=True)
+    ])
+
+
+def member_ids(conversation_id):
+    """Frozen set of the ids of every user in the conversation"""
+    return _members.get(conversation_id, lambda: _load_member_ids(conversation_id))
+
+
+async def amember_ids(conversation_id):
+    """Async variant of ``member_ids``"""
+    return await _members.aget(conversation_id, lambda: _aload_member_ids(conversation_id))
+
+
+def is_broadcast(conversation_id):
+    """Whether the conversation is a broadcast one; False when it does not exist"""
+    return bool(_broadcast.get(
+        conversation_id,
+        lambda: Conversation.objects.filter(pk=conversation_id).values_list('is_broadcast', flat=True).first(),
+    ))
+
+
+async def ais_broadcast(conversation_id):
+    """Async variant of ``is_broadcast``"""
+    return bool(await _broadcast.aget(
+        conversation_id,
+        lambda: Conversation.objects.filter(pk=conversation_id).values_list('is_broadcast', flat=True).afirst(),
+    ))
+
+
+def invalidate_broadcast(conversation_id):
+    _broadcast.delete(conversation_id)
+
+
+def broadcast_group(conversation_id):
+    """Channel-layer group every connection of a broadcast conversation's subscribers joins"""
+    return f'broadcast_{conversation_id}'
+
+
+def _membership(conversation_id, user_id, admin):
+    memberships = Membership.objects.filter(conversation_id=conversation_id, user_id=user_id)
+    return memberships.filter(role='admin') if admin else memberships
+
+
+def is_member(conversation_id, user_id):
+    if is_broadcast(conversation_id):
+        return _membership(conversation_id, user_id, admin=False).exists()
+    return user_id in member_ids(conversation_id)
+
+
+async def ais_member(conversation_id, user_id):
+    if await ais_broadcast(conversation_id):
+        return await _membership(conversation_id, user_id, admin=False).aexists()
+    return user_id in await amember_ids(conversation_id)
+
+
+def can_post(conversation_id, user_id):
+    """Members post to conversations, only admins to broadcast ones"""
+    if is_broadcast(conversation_id):
+        return _membership(conversation_id, user_id, admin=True).exists()
+    return user_id in member_ids(conversation_id)
+
+
+async def acan_post(conversation_id, user_id):
+    """Async variant of ``can_post``"""
+    if await ais_broadcast(conversation_id):
+        return await _membership(conversation_id, user_id, admin=True).aexists()
+    return user_id in await amember_ids(conversation_id)
+
+
+def shown_member_ids(conversation_id):
+    """Ids of the participants a conversation lists: everyone, or the admins of a broadcast one"""
+    if is_broadcast(conversation_id):
+        return frozenset(
+            Membership.objects.filter(conversation_id=conversation_id, role='admin').values_list('user_id', flat=True)
+        )
+    return member_ids(conversation_id)
+
+
+def members_last_seen(conversation_id):
+    """
+    Newest ``last_seen`` of the participants a conversation lists. It moves on
+    every profile save (auto_now) and presence change, so it versions their
+    profiles with one aggregate query instead of a lookup per member.
+    """
+    if sharding.enabled():
+        # Memberships are on the conversation's shard and users on the
+        # default database, so go by the cached ids
+        user_ids = sorted(shown_member_ids(conversation_id))
+        chunks = [user_ids[start:start + ID_CHUNK_SIZE] for start in range(0, len(user_ids), ID_CHUNK_SIZE)]
+        seen = [User.objects.filter(pk__in=chunk).aggregate(last=Max('last_seen'))['last'] for chunk in chunks]
+        return max(filter(None, seen), default=None)
+    memberships = Membership.objects.filter(conversation_id=conversation_id)
+    if is_broadcast(conversation_id):
+        memberships = memberships.filter(role='admin')
+    return User.objects.filter(pk__in=memberships.values('user_id')).aggregate(last=Max('last_seen'))['last']
+
+
+def invalidate_members(conversation_id):
+    _members.delete(conversation_id)
+
+
+async def asubscribed_broadcast_ids(user_id):
+    """Ids of the broadcast conversations the user subscribes to"""
+    return [
+        conversation_id async for conversation_id in scatter(
+            Membership.objects
+            .filter(user_id=user_id, conversation__is_broadcast=True)
+            .values_list('conversation_id', flat=True)
+        )
+    ]
+
+
+def latest_message_id(conversation_id):
+    return Message.objects.filter(conversation_id=conversation_id).aggregate(latest=Max('id'))['latest']
+
+
+def start_read_cursors(conversation_id, user_ids):
+    """New subscribers start with everything already posted read"""
+    Membership.objects.filter(
+        conversation_id=conversation_id, user_id__in=user_ids, last_read_message_id__isnull=True,
+    ).update(last_read_message_id=latest_message_id(conversation_id) or 0)
+
+
+def advance_read_cursor(conversation_id, user_id, up_to=None):
+    """
+    Move the user's read cursor forward to message ``up_to`` (the latest
+    message when None); never backwards. Returns whether it moved.
+    """
+    if up_to is None:
+        up_to = latest_message_id(conversation_id)
+        if up_to is None:
+            return False
+    memberships = _membership(conversation_id, user_id, admin=False)
+    return bool(
+        memberships.filter(last_read_message_id__lt=up_to).update(last_read_message_id=up_to)
+        or memberships.filter(last_read_message_id__isnull=True).update(last_read_message_id=up_to)
+    )
+
+
+def unread_after_cursor(conversation_id, user_id):
+    """Unread messages of a broadcast conversation for the user, counted from their read cursor"""
+    cursor = (
+        _membership(conversation_id, user_id, admin=False)
+        .values_list('last_read_message_id', flat=True).first()
+    )
+    return (
+        Message.objects.filter(conversation_id=conversation_id, id__gt=cursor or 0)
+        .exclude(sender_id=user_id).count()
+    )
+
+
+def contact_memberships(user_id):
+    """
+    Memberships of the user's contacts: the other members of their 1:1
+    conversations and of groups of at most USER_SEARCH['CONTACT_GROUP_SIZE'],
+    as one join. Broadcast audiences and big groups are not contacts.
+    """
+    return (
+        Membership.objects
+        .filter(
+            conversation__memberships__user_id=user_id,
+            conversation__is_broadcast=False,
+            conversation__participant_count__lte=settings.USER_SEARCH['CONTACT_GROUP_SIZE'],
+        )
+        .exclude(user_id=user_id)
+    )
+
+
+def _load_contact_ids(user_id):
+    contacts = scatter(
+        contact_memberships(user_id).values_list('user_id', flat=True).distinct().order_by('user_id')
+    )
+    return frozenset(contacts[:settings.USER_SEARCH['CONTACTS']])
+
+
+def contact_ids(user_id):
+    """Frozen set of at most USER_SEARCH['CONTACTS'] of the user's contacts, see ``contact_memberships``"""
+    return _contacts.get(user_id, lambda: _load_contact_ids(user_id))
+
+
+def refresh_participant_counts(conversation_ids):
+    """Recompute the cached participant_count of the given conversations in one UPDATE"""
+    counts = (
+        Membership.objects
+        .filter(conversation=OuterRef('pk'))
+        .values('conversation')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    Conversation.objects.filter(pk__in=conversation_ids).update(
+        participant_count=Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+    )
+
+
+def _participants_query(conversations):
+    """Rows of the participants shown: everyone, or only the admins of broadcast conversations"""
+    memberships = Membership.objects.filter(
+        conversation_id__in=[conversation.pk for conversation in conversations]
+    )
+    broadcast_ids = [conversation.pk for conversation in conversations if conversation.is_broadcast]
+    if broadcast_ids:
+        memberships = memberships.exclude(conversation_id__in=broadcast_ids, role='member')
+    return memberships.order_by('pk').values_list('conversation_id', 'user_id')
+
+
+def _attach(conversations, rows, users):
+    by_conversation = defaultdict(list)
+    for conversation_id, user_id in rows:
+        if user_id in users:
+            by_conversation[conversation_id].append(users[user_id])
+    for conversation in conversations:
+        conversation._participant_users = by_conversation[conversation.pk]
+
+
+def _users(columns):
+    return User.objects.only(*columns) if columns else User.objects.all()
+
+
+def attach_participants(conversations, user_columns=None):
+    """
+    Fill ``participant_users`` of many conversations with one membership query
+    per database and one user query, without joining users to memberships.
+    ``user_columns`` limits the user columns loaded.
+    """
+    conversations = list(conversations)
+    if not conversations:
+        return
+    rows = list(_participants_query(conversations))
+    users = _users(user_columns).in_bulk({user_id for _, user_id in rows})
+    _attach(conversations, rows, users)
+
+
+async def aattach_participants(conversations, user_columns=None):
+    """Async variant of ``attach_participants``"""
+    conversations = list(conversations)
+    if not conversations:
+        return
+    rows = [row async for row in _participants_query(conversations)]
+    users = await _users(user_columns).ain_bulk({user_id for _, user_id in rows})
+    _attach(conversations, rows, users)
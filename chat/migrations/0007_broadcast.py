@@ -0,0 +1,27 @@
+# Generated by Django 6.0.1 on 2026-10-19 09:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_admin_date_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='is_broadcast',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='last_read_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'id'], name='message_cursor_idx'),
+        ),
+    ]
@@ -1,19 +1,149 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth import get_user_model
 
+from chat import sharding
+from chat.sharding import ShardedManager
+
 User = get_user_model()
 
+class ConversationManager(ShardedManager):
+    def get_or_create_direct(self, user_a, user_b):
+        """Return the 1:1 conversation between two users, creating it if needed"""
+        key = Conversation.make_direct_key(user_a.pk, user_b.pk)
+        conversation = self.filter(direct_key=key).first()
+        if conversation is not None:
+            return conversation, False
+        try:
+            with transaction.atomic(using=sharding.shard_for_key(key) or self.db):
+                conversation = self.create(direct_key=key)
+                conversation.participants.set({user_a, user_b})
+            return conversation, True
+        except IntegrityError:
+            # Lost a race with a concurrent create of the same pair
+            return self.get(direct_key=key), False
+
+class MessageManager(ShardedManager):
+    def create_once(self, **fields):
+        """
+        Create a message, or return the one its sender already created with
+        the same ``client_id`` in that conversation; returns
+        ``(message, created)``. Retries of a send are found through the
+        (conversation, sender, client_id) unique index, which lives on the
+        conversation's shard like all of its messages.
+        """
+        client_id = fields.get('client_id')
+        if not client_id:
+            return self.create(**fields), True
+        conversation_id = fields.get('conversation_id') or fields['conversation'].pk
+        lookup = {
+            'conversation_id': conversation_id,
+            'sender_id': fields.get('sender_id') or fields['sender'].pk,
+            'client_id': client_id,
+        }
+        message = self.filter(**lookup).first()
+        if message is not None:
+            return message, False
+        using = sharding.shard_for_id(conversation_id) if sharding.enabled() else self.db
+        try:
+            with transaction.atomic(using=using):
+                return self.create(**fields), True
+        except IntegrityError:
+            # Lost a race with a concurrent retry of the same send
+            message = self.filter(**lookup).first()
+            if message is None:
+                raise
+            return message, False
+
 class Conversation(models.Model):
-    participants = models.ManyToManyField(User, related_name='conversations')
+    participants = models.ManyToManyField(User, through='Membership', related_name='conversations')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_group = models.BooleanField(default=False)
+    # Announcement channel: admins post, subscribers read. Messages reach
+    # subscribers through one shared channel-layer group and unread counts
+    # come from their read cursors, so posting costs the same at any audience
+    is_broadcast = models.BooleanField(default=False)
     group_name = models.CharField(max_length=100, blank=True, null=True)
-    group_admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='admin_groups')
+    # Users live on `default`, conversations may live on a shard (chat/sharding.py)
+    group_admin = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, related_name='admin_groups', db_constraint=False
+    )
+    # Maintained by chat.signals whenever memberships change
+    participant_count = models.PositiveIntegerField(default=0, editable=False)
+    # "<lower user id>:<higher user id>" for 1:1 conversations, None for groups
+    direct_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
+    # Days messages stay in the hot table before archive_messages moves them
+    # into MessageArchive; empty means settings.CHAT_ARCHIVE['AFTER_DAYS'],
+    # 0 never archives this conversation
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    
+    objects = ConversationManager()
+    
+    class Meta:
+        # Related lookups (e.g. notification.conversation) route to the shard too
+        base_manager_name = 'objects'
+        indexes = [
+            # Admin date filters and sorting
+            models.Index(fields=['created_at'], name='conversation_created_idx'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if sharding.assign_id(self):
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def make_direct_key(user_id_a, user_id_b):
+        low, high = sorted([int(user_id_a), int(user_id_b)])
+        return f'{low}:{high}'
+    
+    @staticmethod
+    def direct_pair(participants):
+        """
+        The two users a non-group conversation between ``participants`` is
+        keyed by, or None when it is not a 1:1 conversation. A conversation
+        with oneself pairs the user with themselves.
+        """
+        participants = list(participants)
+        if len(participants) == 1:
+            return participants[0], participants[0]
+        if len(participants) == 2:
+            return participants[0], participants[1]
+        return None
+    
+    @property
+    def participant_users(self):
+        """
+        Participants as a list of users. Unlike ``participants`` this does
+        not join the user table, so it also works on a shard; use
+        chat.membership.attach_participants to load many at once.
+        """
+        if not hasattr(self, '_participant_users'):
+            from chat.membership import attach_participants
+            attach_participants([self])
+        return self._participant_users
+
+class Membership(models.Model):
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memberships', db_constraint=False)
+    role = models.CharField(max_length=20, choices=[
+        ('member', 'Member'),
+        ('admin', 'Admin')
+    ], default='member')
+    joined_at = models.DateTimeField(auto_now_add=True)
+    muted = models.BooleanField(default=False)
+    # Id of the newest message the user has read; broadcast conversations
+    # count unread messages from it instead of Message.is_read
+    last_read_message_id = models.BigIntegerField(null=True, blank=True)
+    
+    objects = ShardedManager()
+    
+    class Meta:
+        unique_together = [('conversation', 'user')]
 
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
-    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages', db_constraint=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
@@ -24,4 +154,74 @@ class Message(models.Model):
         ('video', 'Video'),
         ('audio', 'Audio'),
         ('file', 'File')
-    ], null=True, blank=True)
\ No newline at end of file
+    ], null=True, blank=True)
+    # Optional id the sending client generates, so retried sends are stored
+    # and delivered once (MessageManager.create_once)
+    client_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    
+    objects = MessageManager()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'timestamp'], name='message_history_idx'),
+            # Messages after a read cursor
+            models.Index(fields=['conversation', 'id'], name='message_cursor_idx'),
+            # Admin date filters and sorting across conversations
+            models.Index(fields=['timestamp'], name='message_timestamp_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conversation', 'sender', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='unique_message_client_id',
+            ),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if sharding.assign_id(self):
+            kwargs['force_insert'] = True
+        super().save(*args, **kwargs)
+
+class MessageArchive(models.Model):
+    """Compressed segment holding one month of a conversation's archived messages"""
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archives')
+    month = models.DateField(help_text='First day of the archived month')
+    message_count = models.PositiveIntegerField(default=0)
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    # zlib-compressed JSON, see chat/archive.py
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = ShardedManager()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'month'], name='unique_archive_month'),
+        ]
+        ordering = ['month']
+
+class UnreadCounter(models.Model):
+    """
+    Per-user total of unread messages in their conversations (broadcast ones
+    aside), kept by chat/unread.py so the badge never sums a COUNT per
+    conversation. Lives on `default` like users.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='unread_counter')
+    unread = models.PositiveIntegerField(default=0)
+
+class IdSequence(models.Model):
+    """Central counter on `default` for ids that must be unique across shards"""
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+class MessageWorkerLease(models.Model):
+    """
+    One worker number of the message id generator (chat/sharding.py), held by
+    a live process until ``expires_at``
+    """
+    slot = models.PositiveSmallIntegerField(primary_key=True)
+    # "<host>:<pid>:<random>" of the holder
+    owner = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
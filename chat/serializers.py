@@ -1,28 +1,76 @@
 from rest_framework import serializers
-from user.serializers import UserProfileSerializer
-from chat.models import Conversation, Message
+from api.serializers import SelectableFieldsMixin
+from user.cache import aget_cached_user, get_cached_user
+from user.serializers import UserProfileSerializer, UserSummarySerializer
+from chat.membership import unread_after_cursor
+from chat.models import Conversation, Membership, Message
 from django.contrib.auth import get_user_model
 
 
 User = get_user_model()
     
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
     sender = UserProfileSerializer(read_only=True)
     sender_id = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
         source='sender',
         write_only=True
     )
+    # Sending again with the same client_id returns the first message
+    client_id = serializers.CharField(max_length=64, required=False, allow_null=True)
     
     class Meta:
         model = Message
         fields = ['id', 'conversation', 'sender', 'sender_id', 'content', 
-                  'timestamp', 'is_read', 'attachment', 'attachment_type']
+                  'timestamp', 'is_read', 'attachment', 'attachment_type', 'client_id']
         read_only_fields = ['timestamp', 'sender']
+        # (conversation, sender, client_id) duplicates are not errors, see create()
+        validators = []
+    
+    def create(self, validated_data):
+        message, created = Message.objects.create_once(**validated_data)
+        message.created = created
+        return message
+    
+    def update(self, instance, validated_data):
+        # Only a send names its client_id; edits keep it
+        validated_data.pop('client_id', None)
+        return super().update(instance, validated_data)
+
+class CompactMessageSerializer(SelectableFieldsMixin, serializers.ModelSerializer):
+    """Message whose sender is an id; profiles travel once per page in a ``users`` map"""
+    
+    class Meta:
+        model = Message
+        fields = ['id', 'conversation', 'sender', 'content', 'timestamp', 'is_read',
+                  'attachment', 'attachment_type']
+        read_only_fields = fields
+
+def _users_map(users):
+    return {str(user.pk): UserSummarySerializer(user).data for user in users if user is not None}
+
+def compact_messages(messages, fields=None):
+    """
+    ``(results, users)`` for a page of messages: compact messages plus each
+    distinct sender's summary, read from the user cache instead of a join
+    """
+    serializer = CompactMessageSerializer(messages, many=True, fields=fields)
+    if 'sender' not in serializer.child.fields:
+        return serializer.data, {}
+    sender_ids = sorted({message.sender_id for message in messages})
+    return serializer.data, _users_map(get_cached_user(user_id) for user_id in sender_ids)
+
+async def acompact_messages(messages, fields=None):
+    """Async variant of ``compact_messages``"""
+    serializer = CompactMessageSerializer(messages, many=True, fields=fields)
+    if 'sender' not in serializer.child.fields:
+        return serializer.data, {}
+    sender_ids = sorted({message.sender_id for message in messages})
+    return serializer.data, _users_map([await aget_cached_user(user_id) for user_id in sender_ids])
 
 class ConversationSerializer(serializers.ModelSerializer):
-    participants = UserProfileSerializer(many=True, read_only=True)
+    participants = UserProfileSerializer(source='participant_users', many=True, read_only=True)
     participants_ids = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
         source='participants',
@@ -35,8 +83,39 @@ class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
         fields = ['id', 'participants', 'participants_ids', 'created_at', 
-                  'updated_at', 'is_group', 'group_name', 'group_admin',
+                  'updated_at', 'is_group', 'is_broadcast', 'group_name', 'group_admin',
                   'last_message', 'unread_count']
+        # Loaded separately (attach_participants) or through relations, not
+        # from the conversation's own columns
+        source_columns = {'participants': [], 'last_message': [], 'unread_count': []}
+    
+    def create(self, validated_data):
+        participants = set(validated_data.pop('participants', []))
+        request = self.context.get('request')
+        if request is not None:
+            participants.add(request.user)
+        
+        if validated_data.get('is_broadcast'):
+            # The creator runs the channel; everyone else subscribes
+            validated_data['is_group'] = True
+            if request is not None:
+                validated_data.setdefault('group_admin', request.user)
+            conversation = Conversation.objects.create(**validated_data)
+            conversation.participants.set(participants)
+            if request is not None:
+                Membership.objects.filter(conversation_id=conversation.pk, user_id=request.user.pk).update(role='admin')
+            return conversation
+        
+        # 1:1 conversations (and one with oneself) are unique per pair: reuse the existing one
+        pair = None if validated_data.get('is_group') else Conversation.direct_pair(participants)
+        if pair is not None:
+            conversation, created = Conversation.objects.get_or_create_direct(*pair)
+            conversation.created = created
+            return conversation
+        
+        conversation = Conversation.objects.create(**validated_data)
+        conversation.participants.set(participants)
+        return conversation
     
     def get_last_message(self, obj):
         last_msg = obj.messages.last()
@@ -46,4 +125,20 @@ class ConversationSerializer(serializers.ModelSerializer):
     
     def get_unread_count(self, obj):
         user = self.context.get('request').user
-        return obj.messages.filter(is_read=False).exclude(sender=user).count()
\ No newline at end of file
+        if obj.is_broadcast:
+            return unread_after_cursor(obj.pk, user.pk)
+        return obj.messages.filter(is_read=False).exclude(sender=user).count()
+
+class InboxConversationSerializer(ConversationSerializer):
+    """
+    Conversation serializer that reads the last message and unread count
+    from annotations made by the inbox queryset instead of querying per row.
+    """
+    
+    def get_last_message(self, obj):
+        if obj.latest_messages:
+            return MessageSerializer(obj.latest_messages[0]).data
+        return None
+    
+    def get_unread_count(self, obj):
+        return obj.unread
@@ -0,0 +1,562 @@
+"""
+Optional sharding of conversations across several databases.
+
+With CHAT_SHARDS['ALIASES'] set, every Conversation lives on one shard
+together with its memberships, messages and archive segments, while users
+and all other data stay on ``default``. A conversation's id encodes its
+shard (``shards[id % len(shards)]``); 1:1 conversations are placed by their
+direct key, so the unique constraint on it holds across shards.
+
+``ShardedQuerySet`` sends a query to the right shard whenever it filters on
+a conversation, and ``ShardRouter`` does the same for instances and related
+managers. Queries that span shards (a user's inbox, their messages) go
+through ``scatter()``, which runs them on every shard and merges the results
+by the queryset's ordering. Relations to users cannot be joined in SQL on a
+shard: use ``prefetch_related('sender')`` instead of ``select_related`` and
+``Conversation.participant_users`` instead of ``participants``.
+"""
+import asyncio
+import atexit
+import functools
+import heapq
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, models, transaction
+from django.db.models import F, Q
+from django.db.models.query import FlatValuesListIterable, ValuesListIterable
+from django.utils import timezone
+
+SHARDED_MODELS = {'chat.Conversation', 'chat.Membership', 'chat.Message', 'chat.MessageArchive'}
+
+# Lookups that pin a query on each sharded model to a single conversation
+CONVERSATION_LOOKUPS = {
+    'chat.Conversation': ('pk', 'id'),
+    'chat.Membership': ('conversation', 'conversation_id', 'conversation__pk', 'conversation__id'),
+    'chat.Message': ('conversation', 'conversation_id', 'conversation__pk', 'conversation__id'),
+    'chat.MessageArchive': ('conversation', 'conversation_id', 'conversation__pk', 'conversation__id'),
+}
+
+# Message ids: 41 bits of milliseconds since 2026-01-01, a 6 bit worker
+# number and a 6 bit per-millisecond counter. 53 bits keep them exact as
+# JavaScript numbers; ids from one process are strictly increasing. Worker
+# numbers are leased (MessageWorkerLease), so at most 64 processes can make
+# message ids at the same time.
+MESSAGE_ID_EPOCH_MS = 1767225600000
+WORKER_BITS = 6
+SEQUENCE_BITS = 6
+
+
+def shard_aliases():
+    return settings.CHAT_SHARDS['ALIASES']
+
+
+def enabled():
+    return bool(shard_aliases())
+
+
+def shard_for_id(conversation_id):
+    aliases = shard_aliases()
+    return aliases[int(conversation_id) % len(aliases)]
+
+
+def direct_key_index(direct_key):
+    return zlib.crc32(direct_key.encode()) % len(shard_aliases())
+
+
+def shard_for_key(direct_key):
+    """Shard holding the 1:1 conversation with ``direct_key``, None when not sharded"""
+    if not enabled():
+        return None
+    return shard_aliases()[direct_key_index(direct_key)]
+
+
+def shard_for_instance(instance):
+    if instance._state.db in shard_aliases():
+        return instance._state.db
+    label = instance._meta.label
+    if label == 'chat.Conversation':
+        return shard_for_id(instance.pk) if instance.pk is not None else None
+    if label in SHARDED_MODELS and instance.conversation_id is not None:
+        return shard_for_id(instance.conversation_id)
+    return None
+
+
+def reserve(name, count):
+    """Reserve ``count`` consecutive values of the central sequence ``name``; returns the first"""
+    from chat.models import IdSequence
+
+    sequences = IdSequence.objects.using('default')
+    with transaction.atomic(using='default'):
+        sequences.bulk_create([IdSequence(name=name)], ignore_conflicts=True)
+        sequences.filter(name=name).update(value=F('value') + count)
+        return sequences.get(name=name).value - count + 1
+
+
+class BlockAllocator:
+    """Values of a central sequence, reserved a block at a time (hi/lo)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.next = self.end = 0
+        self.pid = None
+
+    def __call__(self):
+        with self.lock:
+            if self.next >= self.end or self.pid != os.getpid():
+                size = settings.CHAT_SHARDS['ID_BLOCK_SIZE']
+                self.next = reserve(self.name, size)
+                self.end = self.next + size
+                self.pid = os.getpid()
+            value = self.next
+            self.next += 1
+            return value
+
+
+def claim_worker(owner):
+    """Lease a free worker number to ``owner``; returns it"""
+    from chat.models import MessageWorkerLease
+
+    leases = MessageWorkerLease.objects.using('default')
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=settings.CHAT_SHARDS['WORKER_LEASE_SECONDS'])
+    leases.bulk_create([MessageWorkerLease(slot=slot) for slot in range(1 << WORKER_BITS)], ignore_conflicts=True)
+    free = Q(expires_at__isnull=True) | Q(expires_at__lt=now)
+    # Longest free first, so a number is reused as late as possible
+    candidates = leases.filter(free).order_by(F('expires_at').asc(nulls_first=True), 'slot')
+    for slot in candidates.values_list('slot', flat=True):
+        # Only one of several processes racing for the slot updates the row
+        if leases.filter(free, slot=slot).update(owner=owner, expires_at=expires_at):
+            return slot
+    raise RuntimeError(f'All {1 << WORKER_BITS} message worker numbers are leased')
+
+
+def renew_worker(slot, owner):
+    """Extend ``owner``'s lease of ``slot``; False when it has been lost"""
+    from chat.models import MessageWorkerLease
+
+    expires_at = timezone.now() + timedelta(seconds=settings.CHAT_SHARDS['WORKER_LEASE_SECONDS'])
+    return bool(
+        MessageWorkerLease.objects.using('default')
+        .filter(slot=slot, owner=owner, expires_at__gte=timezone.now())
+        .update(expires_at=expires_at)
+    )
+
+
+def release_worker(slot, owner):
+    from chat.models import MessageWorkerLease
+
+    MessageWorkerLease.objects.using('default').filter(slot=slot, owner=owner).update(expires_at=None)
+
+
+class MessageIdGenerator:
+    """
+    Time-ordered message ids that need no coordination between shards. Each
+    process leases a worker number for WORKER_LEASE_SECONDS, renews it once
+    half of that has passed and releases it at exit. Ids are only made under
+    a lease that has not run out, so two live processes never share a number
+    (given host clocks within half a lease of each other).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+
+    def __call__(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # New process (or forked child): its own lease
+                self.pid = os.getpid()
+                self.owner = f'{socket.gethostname()}:{self.pid}:{secrets.token_hex(4)}'[-100:]
+                self.worker = None
+                self.renew_at = 0
+                self.last = -1
+                self.sequence = 0
+                atexit.register(self.release, self.pid)
+            if time.monotonic() >= self.renew_at:
+                self.renew()
+            now = int(time.time() * 1000) - MESSAGE_ID_EPOCH_MS
+            if now <= self.last:
+                # Same millisecond, or the clock went back: keep counting
+                now = self.last
+                self.sequence = (self.sequence + 1) % (1 << SEQUENCE_BITS)
+                if self.sequence == 0:
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker << SEQUENCE_BITS) | self.sequence
+
+    def renew(self):
+        lease = settings.CHAT_SHARDS['WORKER_LEASE_SECONDS']
+        # Counted from before the round trip, so the local deadline is never late
+        started = time.monotonic()
+        if self.worker is None or not renew_worker(self.worker, self.owner):
+            if self.worker is not None:
+                # Lost (the process stalled past its lease): ids continue
+                # after the last one under the new number
+                self.last += 1
+                self.sequence = -1
+            self.worker = claim_worker(self.owner)
+        self.renew_at = started + lease / 2
+
+    def release(self, pid):
+        if self.pid != pid or self.worker is None:
+            # Registered by the parent of a forked process
+            return
+        try:
+            release_worker(self.worker, self.owner)
+        except DatabaseError:
+            # The lease simply runs out
+            pass
+
+
+next_conversation_id = BlockAllocator('conversation')
+next_message_id = MessageIdGenerator()
+
+
+def assign_id(instance):
+    """Give a new Conversation or Message its cross-shard id; True if one was assigned"""
+    if not enabled() or instance.pk is not None:
+        return False
+    label = instance._meta.label
+    if label == 'chat.Conversation':
+        shard_count = len(shard_aliases())
+        if instance.direct_key:
+            index = direct_key_index(instance.direct_key)
+        else:
+            index = random.randrange(shard_count)
+        instance.pk = next_conversation_id() * shard_count + index
+    elif label == 'chat.Message':
+        instance.pk = next_message_id()
+    else:
+        return False
+    return True
+
+
+def conversation_id_of(value):
+    if isinstance(value, models.Model):
+        return value.pk
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def lookups_of(args, kwargs):
+    """Plain ``field=value`` conditions of a filter() call, including simple Q objects"""
+    lookups = dict(kwargs)
+    for arg in args:
+        if isinstance(arg, Q) and arg.connector == Q.AND and not arg.negated:
+            lookups.update(child for child in arg.children if isinstance(child, tuple))
+    return lookups
+
+
+def route(model, lookups):
+    """Aliases of the shards a filter on ``model`` can match, or None if unknown"""
+    label = model._meta.label
+    if label not in SHARDED_MODELS:
+        return None
+    if label == 'chat.Conversation' and isinstance(lookups.get('direct_key'), str):
+        return {shard_for_key(lookups['direct_key'])}
+    for name in CONVERSATION_LOOKUPS[label]:
+        if name in lookups:
+            conversation_id = conversation_id_of(lookups[name])
+            return {shard_for_id(conversation_id)} if conversation_id is not None else None
+        values = lookups.get(f'{name}__in')
+        if isinstance(values, (list, tuple, set, frozenset)):
+            ids = [conversation_id_of(value) for value in values]
+            if None in ids:
+                return None
+            return {shard_for_id(conversation_id) for conversation_id in ids} or {shard_aliases()[0]}
+    return None
+
+
+class ShardedQuerySet(models.QuerySet):
+    """QuerySet that routes itself to a shard when it filters on a conversation"""
+
+    def filter(self, *args, **kwargs):
+        queryset = super().filter(*args, **kwargs)
+        if self._db is not None or not enabled():
+            return queryset
+        aliases = route(self.model, lookups_of(args, kwargs))
+        if not aliases:
+            return queryset
+        if len(aliases) == 1:
+            return queryset.using(aliases.pop())
+        return ScatterQuerySet(queryset, aliases)
+
+    def create(self, **kwargs):
+        if self._db is not None or not enabled():
+            return super().create(**kwargs)
+        instance = self.model(**kwargs)
+        assign_id(instance)
+        instance.save(force_insert=True, using=shard_for_instance(instance))
+        return instance
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not enabled():
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        by_shard = {}
+        for instance in objs:
+            assign_id(instance)
+            by_shard.setdefault(shard_for_instance(instance), []).append(instance)
+        for alias, instances in by_shard.items():
+            self.using(alias).bulk_create(instances, *args, **kwargs)
+        return objs
+
+
+ShardedManager = models.Manager.from_queryset(ShardedQuerySet)
+
+
+def scatter(queryset):
+    """Run ``queryset`` on every shard; returned unchanged when it is already routed"""
+    if not enabled() or queryset._db is not None or isinstance(queryset, ScatterQuerySet):
+        return queryset
+    return ScatterQuerySet(queryset)
+
+
+def _field_value(row, name):
+    if isinstance(row, dict):
+        return row['id' if name == 'pk' else name]
+    return getattr(row, name)
+
+
+def _compare(ordering, a, b, value=_field_value):
+    for field in ordering:
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        value_a = value(a, name)
+        value_b = value(b, name)
+        if value_a == value_b:
+            continue
+        # Like most databases, None sorts before any value
+        if value_a is None or (value_b is not None and value_a < value_b):
+            result = -1
+        else:
+            result = 1
+        return -result if descending else result
+    return 0
+
+
+def _unique(rows):
+    seen = set()
+    for row in rows:
+        key = tuple(row.items()) if isinstance(row, dict) else row
+        if key not in seen:
+            seen.add(key)
+            yield row
+
+
+class ScatterQuerySet:
+    """
+    The same query on several shards, behaving like a read-only QuerySet.
+    Chained calls apply to every shard; a filter on a conversation narrows it
+    down to that conversation's shard and returns a plain QuerySet. Results
+    are merged in the query's ordering, so slicing ``[a:b]`` fetches at most
+    ``b`` rows from each shard; ``values_list()`` rows must select the fields
+    they are ordered by. ``distinct()`` also drops rows found on several shards.
+    """
+
+    def __init__(self, queryset, aliases=None, low=0, high=None):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.aliases = sorted(aliases or shard_aliases())
+        self.low = low
+        self.high = high
+        self._result_cache = None
+
+    def _clone(self, queryset=None, aliases=None):
+        return ScatterQuerySet(
+            self.queryset if queryset is None else queryset,
+            aliases or self.aliases, self.low, self.high,
+        )
+
+    def _chained(name):
+        def method(self, *args, **kwargs):
+            return self._clone(getattr(self.queryset, name)(*args, **kwargs))
+        method.__name__ = name
+        return method
+
+    all = _chained('all')
+    exclude = _chained('exclude')
+    order_by = _chained('order_by')
+    distinct = _chained('distinct')
+    annotate = _chained('annotate')
+    select_related = _chained('select_related')
+    prefetch_related = _chained('prefetch_related')
+    only = _chained('only')
+    defer = _chained('defer')
+    values = _chained('values')
+    values_list = _chained('values_list')
+    del _chained
+
+    def filter(self, *args, **kwargs):
+        if self.low or self.high is not None:
+            raise TypeError('Cannot filter a query once a slice has been taken.')
+        # Filter the unrouted template; routing is decided here
+        queryset = models.QuerySet.filter(self.queryset, *args, **kwargs)
+        aliases = route(self.model, lookups_of(args, kwargs))
+        aliases = set(self.aliases) & aliases if aliases else set(self.aliases)
+        if len(aliases) == 1:
+            return queryset.using(aliases.pop())
+        return self._clone(queryset, aliases or {self.aliases[0]})
+
+    @property
+    def ordering(self):
+        query = self.queryset.query
+        return list(query.order_by or (query.default_ordering and self.model._meta.ordering) or [])
+
+    @property
+    def ordered(self):
+        return bool(self.ordering)
+
+    @property
+    def db(self):
+        return self.aliases[0]
+
+    def shard_querysets(self):
+        return [
+            (self.queryset if self.high is None else self.queryset[:self.high]).using(alias)
+            for alias in self.aliases
+        ]
+
+    def _tuple_value(self):
+        """Reads an ordering field from a values_list() row by its position"""
+        query = self.queryset.query
+        names = [*query.extra_select, *query.values_select, *query.annotation_select]
+        if self.queryset._iterable_class is FlatValuesListIterable:
+            names = names[:1]
+        pk_names = {'pk', self.model._meta.pk.attname}
+        positions = {}
+        for index, name in enumerate(names):
+            for alias in (pk_names if name in pk_names else {name}):
+                positions[alias] = index
+        missing = [field.lstrip('-') for field in self.ordering if field.lstrip('-') not in positions]
+        if missing:
+            raise TypeError(f'Cannot merge values_list() rows from several shards by {missing}: select them too.')
+        if self.queryset._iterable_class is FlatValuesListIterable:
+            return lambda row, name: row
+        return lambda row, name: row[positions[name]]
+
+    def _merge(self, results):
+        ordering = self.ordering
+        if ordering and len(results) > 1:
+            value = _field_value
+            if self.queryset._iterable_class in (ValuesListIterable, FlatValuesListIterable):
+                value = self._tuple_value()
+            key = functools.cmp_to_key(functools.partial(_compare, ordering, value=value))
+            merged = heapq.merge(*results, key=key)
+        else:
+            merged = (row for rows in results for row in rows)
+        if self.queryset.query.distinct and not self.queryset.query.distinct_fields:
+            # Each shard is distinct on its own; the same row can come from several
+            merged = _unique(merged)
+        return list(merged)[self.low:self.high]
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = self._merge([list(queryset) for queryset in self.shard_querysets()])
+        return self._result_cache
+
+    async def _afetch_all(self):
+        if self._result_cache is None:
+            async def fetch(queryset):
+                return [row async for row in queryset]
+            results = await asyncio.gather(*(fetch(queryset) for queryset in self.shard_querysets()))
+            self._result_cache = self._merge(results)
+        return self._result_cache
+
+    def __iter__(self):
+        return iter(self._fetch_all())
+
+    def __aiter__(self):
+        async def generator():
+            for row in await self._afetch_all():
+                yield row
+        return generator()
+
+    def __len__(self):
+        return len(self._fetch_all())
+
+    def __bool__(self):
+        return bool(self._fetch_all())
+
+    def __getitem__(self, k):
+        if isinstance(k, int):
+            return list(self[k:k + 1])[0] if k >= 0 else self._fetch_all()[k]
+        if k.step is not None or (k.start or 0) < 0 or (k.stop is not None and k.stop < 0):
+            return self._fetch_all()[k]
+        low = self.low + (k.start or 0)
+        high = self.low + k.stop if k.stop is not None else self.high
+        if self.high is not None:
+            high = min(high, self.high) if high is not None else self.high
+        return ScatterQuerySet(self.queryset, self.aliases, low, max(low, high) if high is not None else None)
+
+    def iterator(self, chunk_size=None):
+        for queryset in self.shard_querysets():
+            yield from queryset.iterator(**({'chunk_size': chunk_size} if chunk_size else {}))
+
+    def count(self):
+        if self._result_cache is not None:
+            return len(self._result_cache)
+        total = sum(queryset.count() for queryset in self.shard_querysets())
+        # Per-shard counts are capped by high, not by low
+        return max(0, total - self.low) if self.high is None else len(self._fetch_all())
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.shard_querysets())
+
+    def first(self):
+        rows = list(self[:1])
+        return rows[0] if rows else None
+
+    def get(self, *args, **kwargs):
+        queryset = self.filter(*args, **kwargs) if args or kwargs else self
+        if not isinstance(queryset, ScatterQuerySet):
+            return queryset.get()
+        rows = list(queryset[:2])
+        if not rows:
+            raise self.model.DoesNotExist(f'{self.model._meta.object_name} matching query does not exist.')
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get() returned more than one {self.model._meta.object_name}.'
+            )
+        return rows[0]
+
+    def update(self, **kwargs):
+        return sum(queryset.update(**kwargs) for queryset in self.shard_querysets())
+
+    def delete(self):
+        deleted, per_model = 0, {}
+        for queryset in self.shard_querysets():
+            count, counts = queryset.delete()
+            deleted += count
+            for label, value in counts.items():
+                per_model[label] = per_model.get(label, 0) + value
+        return deleted, per_model
+
+    def __repr__(self):
+        return f'<ScatterQuerySet {self.aliases} {self.queryset.query}>'
+
+
+class ShardRouter:
+    """Sends sharded models to their conversation's shard when the instance is known"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.label not in SHARDED_MODELS or not enabled():
+            return None
+        instance = hints.get('instance')
+        return shard_for_instance(instance) if instance is not None else None
+
+    db_for_write = db_for_read
@@ -0,0 +1,171 @@
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+
+from chat import sharding, unread
+from chat.archive import is_archiving
+from chat.membership import (
+    invalidate_broadcast, invalidate_members, is_broadcast, refresh_participant_counts, start_read_cursors,
+)
+from chat.models import Conversation, Membership, Message
+from chat.sharding import scatter
+
+User = get_user_model()
+
+# Sent with conversation_id, reader_id and up_to (a message id, or None for
+# everything) after messages are marked read with a queryset update, which
+# fires no post_save
+messages_read = Signal()
+
+# Sent with messages ({conversation_id: [message ids]}) and conversation_ids
+# after maintenance changed chat rows with queryset updates (admin actions,
+# merge_direct_conversations), so the sync log still hears about them
+chat_rows_updated = Signal()
+
+
+@receiver(post_save, sender=Message)
+def touch_conversation(sender, instance, created, **kwargs):
+    """Bump the conversation's updated_at so inboxes sort by latest activity"""
+    if created:
+        Conversation.objects.filter(pk=instance.conversation_id).update(
+            updated_at=instance.timestamp
+        )
+
+
+@receiver(pre_save, sender=Message)
+def remember_read_state(sender, instance, using, raw=False, update_fields=None, **kwargs):
+    """Keep ``is_read`` as stored, so count_unread can tell a message was marked (un)read"""
+    if raw or instance._state.adding or (update_fields is not None and 'is_read' not in update_fields):
+        return
+    instance._stored_is_read = (
+        Message.objects.using(using).filter(pk=instance.pk).values_list('is_read', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Message)
+def count_unread(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        unread.message_created(instance)
+        return
+    stored = instance.__dict__.pop('_stored_is_read', None)
+    if stored is not None and stored != instance.is_read:
+        unread.read_state_changed(instance.conversation_id, {instance.sender_id: 1}, read=instance.is_read)
+
+
+@receiver(post_delete, sender=Message)
+def uncount_deleted_message(sender, instance, origin=None, **kwargs):
+    if instance.is_read or is_archiving() or isinstance(origin, Conversation):
+        # Archiving and conversation deletes uncount whole batches themselves
+        return
+    unread.read_state_changed(instance.conversation_id, {instance.sender_id: 1})
+
+
+@receiver(pre_delete, sender=Conversation)
+def uncount_deleted_conversation(sender, instance, **kwargs):
+    """The conversation's unread messages leave its members' badges before they are deleted"""
+    counts = unread.sender_counts(Message.objects.filter(conversation_id=instance.pk, is_read=False))
+    unread.read_state_changed(instance.pk, counts.get(instance.pk, {}))
+
+
+def membership_changed(conversation_ids):
+    """Refresh participant counts and drop cached member sets"""
+    conversation_ids = list(conversation_ids)
+    if not conversation_ids:
+        return
+    refresh_participant_counts(conversation_ids)
+    for conversation_id in conversation_ids:
+        invalidate_members(conversation_id)
+        transaction.on_commit(partial(invalidate_members, conversation_id))
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, **kwargs):
+    invalidate_broadcast(instance.pk)
+    transaction.on_commit(partial(invalidate_broadcast, instance.pk))
+
+
+def push_subscriptions(event_type, conversation_id, user_ids):
+    """Tell the users' open connections to join or leave the broadcast group"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for user_id in user_ids:
+        async_to_sync(channel_layer.group_send)(f'user_{user_id}', {
+            'type': event_type, 'conversation': conversation_id,
+        })
+
+
+def subscriptions_changed(pairs, subscribed):
+    """
+    ``(conversation_id, user_id)`` memberships added or removed: new
+    subscribers of broadcast conversations get their read cursor, and
+    connected clients join or leave the broadcast group once committed
+    """
+    by_conversation = {}
+    for conversation_id, user_id in pairs:
+        by_conversation.setdefault(conversation_id, set()).add(user_id)
+    for conversation_id, user_ids in by_conversation.items():
+        if not is_broadcast(conversation_id):
+            continue
+        if subscribed:
+            start_read_cursors(conversation_id, user_ids)
+        transaction.on_commit(partial(
+            push_subscriptions,
+            'broadcast_subscribed' if subscribed else 'broadcast_unsubscribed',
+            conversation_id, user_ids,
+        ))
+
+
+@receiver(post_save, sender=Membership)
+def membership_saved(sender, instance, created, **kwargs):
+    membership_changed([instance.conversation_id])
+    if created:
+        subscriptions_changed([(instance.conversation_id, instance.user_id)], subscribed=True)
+
+
+@receiver(post_delete, sender=Membership)
+def membership_deleted(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Conversation):
+        # The whole conversation is going away; one invalidation is enough
+        invalidate_members(instance.conversation_id)
+        return
+    membership_changed([instance.conversation_id])
+    subscriptions_changed([(instance.conversation_id, instance.user_id)], subscribed=False)
+
+
+@receiver(m2m_changed, sender=Membership)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """``conversation.participants`` and ``user.conversations`` add/remove/clear"""
+    if action == 'pre_clear' and reverse:
+        # user.conversations.clear(): remember which conversations are affected
+        instance._cleared_conversation_ids = list(
+            scatter(instance.conversations.values_list('pk', flat=True))
+        )
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        membership_changed([instance.pk])
+    elif action == 'post_clear':
+        membership_changed(getattr(instance, '_cleared_conversation_ids', []))
+    else:
+        membership_changed(pk_set or [])
+    if action != 'post_clear':
+        pairs = [(other_id, instance.pk) if reverse else (instance.pk, other_id) for other_id in pk_set or []]
+        subscriptions_changed(pairs, subscribed=action == 'post_add')
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_user_rows(sender, instance, **kwargs):
+    """Cascade a user's deletion onto the shards, which Django's collector does not reach"""
+    if not sharding.enabled():
+        return
+    scatter(Message.objects.filter(sender_id=instance.pk)).delete()
+    scatter(Membership.objects.filter(user_id=instance.pk)).delete()
+    scatter(Conversation.objects.filter(group_admin_id=instance.pk)).update(group_admin=None)
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from task.registry import periodic_task
+
+from chat.archive import archive_conversation, conversations_to_archive
+from chat.unread import reconcile_batches
+
+
+@periodic_task(every=timedelta(days=1))
+def archive_old_messages():
+    """Nightly run of the archive_messages command"""
+    for conversation in conversations_to_archive().iterator():
+        archive_conversation(conversation)
+
+
+@periodic_task(every=timedelta(days=1))
+def reconcile_unread_counters():
+    """Nightly run of the reconcile_unread_counters command"""
+    for _ in reconcile_batches():
+        pass
@@ -1,3 +1,525 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import archive, consumers, membership, sharding, unread
+from chat.archive import archive_conversation
+from chat.models import Conversation, Membership, Message, MessageArchive, MessageWorkerLease, UnreadCounter
+from chat.tasks import reconcile_unread_counters
+from notification.models import NotificationEvent
+
+User = get_user_model()
+
+
+def make_user(username, **fields):
+    return User.objects.create_user(username=username, email=f'{username}@example.com', password='pw', **fields)
+
+
+class DirectConversationTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+
+    def start(self, user, other):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/chat/conversations/', {'participants_ids': [other.pk]}, format='json')
+
+    def test_pair_gets_one_conversation(self):
+        first = self.start(self.alice, self.bob)
+        self.assertEqual(first.status_code, 201)
+        again = self.start(self.bob, self.alice)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()['id'], first.json()['id'])
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_conversation_with_oneself_is_keyed_like_the_merge_command(self):
+        first = self.start(self.alice, self.alice)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(self.start(self.alice, self.alice).json()['id'], first.json()['id'])
+        self.assertEqual(
+            Conversation.objects.get().direct_key, Conversation.make_direct_key(self.alice.pk, self.alice.pk)
+        )
+        call_command('merge_direct_conversations', stdout=StringIO())
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_merge_command_folds_duplicates(self):
+        conversations = []
+        for content in ('first', 'second'):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob])
+            # The same client_id reused in both would collide once merged
+            Message.objects.create(conversation=conversation, sender=self.alice, content=content, client_id='abc')
+            Message.objects.create(conversation=conversation, sender=self.bob, content=f'{content} reply')
+            conversations.append(conversation)
+
+        call_command('merge_direct_conversations', stdout=StringIO())
+        keeper = Conversation.objects.get()
+        self.assertEqual(keeper.pk, conversations[0].pk)
+        self.assertEqual(keeper.direct_key, Conversation.make_direct_key(self.alice.pk, self.bob.pk))
+        self.assertEqual(
+            sorted(keeper.messages.values_list('content', 'client_id')),
+            [('first', 'abc'), ('first reply', None), ('second', None), ('second reply', None)],
+        )
+
+
+class SendOnceTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, client_id, content='hi'):
+        return self.client.post('/api/chat/messages/', {
+            'conversation': self.conversation.pk, 'sender_id': self.alice.pk,
+            'content': content, 'client_id': client_id,
+        }, format='json')
+
+    def test_retry_returns_the_first_message(self):
+        first = self.send('abc')
+        self.assertEqual(first.status_code, 201)
+        retry = self.send('abc', content='edited in the meantime')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['id'], first.json()['id'])
+        self.assertEqual(retry.json()['content'], 'hi')
+        self.assertEqual(self.send('def').status_code, 201)
+        self.assertEqual(Message.objects.count(), 2)
+
+    def test_client_id_is_scoped_to_the_conversation(self):
+        first = self.send('abc')
+        other = Conversation.objects.create()
+        other.participants.set([self.alice, self.bob])
+        response = self.client.post('/api/chat/messages/', {
+            'conversation': other.pk, 'sender_id': self.alice.pk, 'content': 'hi', 'client_id': 'abc',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['id'], first.json()['id'])
+
+    def test_edits_keep_the_client_id(self):
+        message_id = self.send('abc').json()['id']
+        response = self.client.patch(
+            f'/api/chat/messages/{message_id}/', {'content': 'edited', 'client_id': 'other'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['client_id'], 'abc')
+        self.assertEqual(Message.objects.get(pk=message_id).content, 'edited')
+
+    def test_lost_race_returns_the_winner(self):
+        winner = Message.objects.create(conversation=self.conversation, sender=self.alice, content='hi', client_id='abc')
+        real_filter = Message.objects.filter
+        lookups = []
+
+        def filter(**lookup):
+            # The first lookup misses, as if the winner had not committed yet
+            lookups.append(lookup)
+            queryset = real_filter(**lookup)
+            return queryset.none() if len(lookups) == 1 else queryset
+
+        with mock.patch.object(Message.objects, 'filter', side_effect=filter):
+            message, created = Message.objects.create_once(
+                conversation=self.conversation, sender=self.alice, content='hi', client_id='abc'
+            )
+        self.assertFalse(created)
+        self.assertEqual(message.pk, winner.pk)
+        self.assertEqual(len(lookups), 2)
+
+
+class UnreadCounterTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.client = APIClient()
+
+    def send(self, sender, content='hi'):
+        return Message.objects.create(conversation=self.conversation, sender=sender, content=content)
+
+    def test_message_counts_for_recipients_only(self):
+        self.send(self.alice)
+        self.send(self.alice)
+        self.assertEqual(unread.unread_total(self.bob.pk), 2)
+        self.assertEqual(unread.unread_total(self.alice.pk), 0)
+
+    def test_rest_read_and_unread(self):
+        message = self.send(self.alice)
+        self.client.force_authenticate(self.bob)
+        url = f'/api/chat/messages/{message.pk}/'
+
+        self.client.patch(url, {'is_read': True}, format='json')
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+        # Saving again without a change moves nothing
+        self.client.patch(url, {'is_read': True}, format='json')
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+        self.client.patch(url, {'is_read': False}, format='json')
+        self.assertEqual(unread.unread_total(self.bob.pk), 1)
+
+        response = self.client.get('/api/chat/conversations/unread-total/')
+        self.assertEqual(response.json()['unread'], 1)
+
+    def test_deleting_unread_messages(self):
+        first = self.send(self.alice)
+        second = self.send(self.alice)
+        second.is_read = True
+        second.save()
+        self.assertEqual(unread.unread_total(self.bob.pk), 1)
+
+        second.delete()
+        self.assertEqual(unread.unread_total(self.bob.pk), 1)
+        first.delete()
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+
+    def test_archiving_unread_messages(self):
+        self.send(self.alice)
+        archive_conversation(self.conversation, cutoff=timezone.now() + timedelta(days=1))
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+
+    def test_deleting_the_conversation(self):
+        self.send(self.alice)
+        self.send(self.bob)
+        self.conversation.delete()
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+        self.assertEqual(unread.unread_total(self.alice.pk), 0)
+
+    def test_counters_match_a_recount(self):
+        carol = make_user('carol')
+        self.conversation.participants.add(carol)
+        for sender in (self.alice, self.bob, carol, self.alice):
+            self.send(sender)
+        Message.objects.filter(sender=self.bob).get().delete()
+        counted = unread.count_unread([self.alice.pk, self.bob.pk, carol.pk])
+        self.assertEqual(counted, {user_id: unread.unread_total(user_id) for user_id in counted})
+        self.assertEqual(unread.reconcile(list(counted)), {})
+
+    def test_message_arriving_while_marking_read_stays_unread(self):
+        self.send(self.alice)
+        real_update = QuerySet.update
+        arrived = []
+
+        def update(queryset, **kwargs):
+            # A message committed after the unread rows were read
+            if queryset.model is Message and not arrived:
+                arrived.append(self.send(self.alice, 'late'))
+            return real_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', update):
+            changed = unread.set_read_state(Message.objects.filter(conversation_id=self.conversation.pk))
+        self.assertEqual(sum(len(ids) for ids in changed.values()), 1)
+        self.assertFalse(Message.objects.get(pk=arrived[0].pk).is_read)
+        self.assertEqual(unread.unread_total(self.bob.pk), 1)
+        self.assertEqual(unread.reconcile([self.bob.pk]), {})
+
+    def test_periodic_reconcile_fixes_drift(self):
+        self.send(self.alice)
+        Message.objects.filter(conversation=self.conversation).update(is_read=True)
+        self.assertEqual(unread.unread_total(self.bob.pk), 1)
+        reconcile_unread_counters()
+        self.assertEqual(unread.unread_total(self.bob.pk), 0)
+
+    def test_add_unread_creates_counters_without_losing_increments(self):
+        unread.add_unread({self.alice.pk: 2})
+        unread.add_unread({self.alice.pk: 3, self.bob.pk: -1})
+        self.assertEqual(UnreadCounter.objects.get(user=self.alice).unread, 5)
+        # Decrements neither create counters nor go below zero
+        self.assertFalse(UnreadCounter.objects.filter(user=self.bob).exists())
+        unread.add_unread({self.alice.pk: -9})
+        self.assertEqual(UnreadCounter.objects.get(user=self.alice).unread, 0)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation = Conversation.objects.create(is_group=True, group_name='g')
+            self.conversation.participants.set([self.alice, self.bob])
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = f'/api/chat/conversations/{self.conversation.pk}/'
+
+    def get(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(self.url, **headers)
+
+    def test_not_modified_until_something_changes(self):
+        etag = self.get()['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(conversation=self.conversation, sender=self.bob, content='hi')
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_member_profile_changes_the_etag(self):
+        etag = self.get()['ETag']
+        User.objects.filter(pk=self.bob.pk).update(last_seen=timezone.now() + timedelta(seconds=5))
+        self.assertEqual(self.get(etag).status_code, 200)
+
+    def test_revalidation_cost_does_not_grow_with_members(self):
+        etag = self.get()['ETag']
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.get(etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation.participants.add(*[make_user(f'member{i}') for i in range(30)])
+        etag = self.get()['ETag']
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.get(etag).status_code, 304)
+        self.assertEqual(len(large), len(small))
+
+    def test_non_members_get_no_validators(self):
+        self.client.force_authenticate(make_user('mallory'))
+        response = self.get()
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.subscribers = [make_user(f'sub{i}') for i in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        response = self.client.post('/api/chat/conversations/', {
+            'is_broadcast': True, 'group_name': 'News', 'participants_ids': [user.pk for user in self.subscribers],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.conversation = Conversation.objects.get(pk=response.json()['id'])
+
+    def post(self, user, content='news'):
+        self.client.force_authenticate(user)
+        return self.client.post('/api/chat/messages/', {
+            'conversation': self.conversation.pk, 'sender_id': user.pk, 'content': content,
+        }, format='json')
+
+    def test_only_the_admin_posts(self):
+        bob = self.subscribers[0]
+        self.assertEqual(self.post(bob).status_code, 403)
+        self.assertEqual(self.post(self.alice).status_code, 201)
+        self.assertFalse(membership.can_post(self.conversation.pk, bob.pk))
+        self.assertTrue(membership.can_post(self.conversation.pk, self.alice.pk))
+        # Subscribers are not listed as participants
+        self.assertEqual(membership.shown_member_ids(self.conversation.pk), {self.alice.pk})
+
+    def test_unread_counts_come_from_the_read_cursor(self):
+        bob = self.subscribers[0]
+        messages = [self.post(self.alice).json()['id'] for _ in range(3)]
+        self.assertEqual(membership.unread_after_cursor(self.conversation.pk, bob.pk), 3)
+        self.assertTrue(membership.advance_read_cursor(self.conversation.pk, bob.pk, messages[1]))
+        self.assertFalse(membership.advance_read_cursor(self.conversation.pk, bob.pk, messages[0]))
+
+        self.client.force_authenticate(bob)
+        response = self.client.get(f'/api/chat/conversations/{self.conversation.pk}/')
+        self.assertEqual(response.json()['unread_count'], 1)
+        # Broadcasts stay out of the badge
+        self.assertEqual(unread.unread_total(bob.pk), 0)
+
+    def test_posting_cost_does_not_grow_with_subscribers(self):
+        def post_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(self.alice).status_code, 201)
+            return len(queries)
+
+        post_queries()
+        few = post_queries()
+        self.conversation.participants.add(*User.objects.bulk_create(
+            [User(username=f'more{i}', email=f'more{i}@example.com') for i in range(20)]
+        ))
+        post_queries()
+        self.assertEqual(post_queries(), few)
+        self.assertFalse(NotificationEvent.objects.filter(conversation_id=self.conversation.pk).exists())
+        self.assertFalse(UnreadCounter.objects.exists())
+
+
+@override_settings(CHAT_SHARDS={'ALIASES': [], 'ID_BLOCK_SIZE': 100, 'WORKER_LEASE_SECONDS': 60})
+class MessageIdTests(TestCase):
+    def test_ids_increase(self):
+        generator = sharding.MessageIdGenerator()
+        ids = [generator() for _ in range(500)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertLess(ids[-1], 2 ** 53)
+
+    def test_live_processes_never_share_a_worker_number(self):
+        slots = {sharding.claim_worker(f'process{i}') for i in range(64)}
+        self.assertEqual(len(slots), 64)
+        with self.assertRaises(RuntimeError):
+            sharding.claim_worker('one too many')
+
+        # Released and expired numbers are handed out again
+        sharding.release_worker(5, 'process5')
+        MessageWorkerLease.objects.filter(slot=9).update(expires_at=timezone.now() - timedelta(seconds=1))
+        slot = sharding.claim_worker('a')
+        self.assertEqual({slot, sharding.claim_worker('b')}, {5, 9})
+        self.assertTrue(sharding.renew_worker(slot, 'a'))
+        self.assertFalse(sharding.renew_worker(9, 'process9'))
+
+    def test_lost_lease_is_replaced(self):
+        generator = sharding.MessageIdGenerator()
+        first = generator()
+        MessageWorkerLease.objects.filter(slot=generator.worker).update(owner='someone else')
+        generator.renew_at = 0
+        second = generator()
+        self.assertNotEqual(MessageWorkerLease.objects.get(slot=generator.worker).owner, 'someone else')
+        self.assertGreater(second, first)
+
+
+class ScatterQuerySetTests(TestCase):
+    def scatter(self, queryset, *shards):
+        # Each shard's rows, as its database would return them
+        patch = mock.patch.object(sharding.ScatterQuerySet, 'shard_querysets', return_value=list(shards))
+        return patch, sharding.ScatterQuerySet(queryset, aliases=['shard0', 'shard1'])
+
+    def test_values_list_rows_are_merged_in_order(self):
+        patch, rows = self.scatter(
+            Membership.objects.values_list('conversation_id', 'user_id').order_by('-user_id'),
+            [(1, 9), (1, 4)], [(2, 7), (2, 5)],
+        )
+        with patch:
+            self.assertEqual(list(rows[:3]), [(1, 9), (2, 7), (2, 5)])
+
+    def test_distinct_flat_rows_are_unique_across_shards(self):
+        patch, contacts = self.scatter(
+            Membership.objects.values_list('user_id', flat=True).distinct().order_by('user_id'),
+            [1, 3, 4], [2, 3, 4],
+        )
+        with patch:
+            self.assertEqual(list(contacts[:4]), [1, 2, 3, 4])
+
+    def test_values_list_must_select_its_ordering(self):
+        patch, rows = self.scatter(Membership.objects.values_list('user_id').order_by('joined_at'), [], [])
+        with patch, self.assertRaises(TypeError):
+            list(rows)
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+        self.messages = []
+        for day in ('2026-01-30', '2026-01-31', '2026-02-01', '2026-02-02'):
+            message = Message.objects.create(conversation=self.conversation, sender=self.alice, content=day)
+            Message.objects.filter(pk=message.pk).update(timestamp=f'{day}T12:00:00Z')
+            self.messages.append(message)
+
+    def archive(self, **kwargs):
+        return archive_conversation(self.conversation, cutoff=timezone.now(), **kwargs)
+
+    def test_each_month_is_written_once(self):
+        with mock.patch('chat.archive.write_segment', wraps=archive.write_segment) as write_segment:
+            self.assertEqual(self.archive(batch_size=1), 4)
+        self.assertEqual(
+            [(call.args[1], len(call.args[2])) for call in write_segment.call_args_list],
+            [(date(2026, 1, 1), 2), (date(2026, 2, 1), 2)],
+        )
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+        archived = archive.archived_messages(self.conversation, date(2026, 2, 1))
+        self.assertEqual([message.content for message in archived], ['2026-02-01', '2026-02-02'])
+
+    def test_later_runs_merge_into_the_segment(self):
+        archive_conversation(self.conversation, cutoff=parse_datetime('2026-01-31T00:00:00Z'))
+        self.archive()
+        segment = MessageArchive.objects.get(conversation=self.conversation, month=date(2026, 1, 1))
+        self.assertEqual(segment.message_count, 2)
+
+    @override_settings(CHAT_ARCHIVE={'AFTER_DAYS': 0, 'BATCH_SIZE': 100})
+    def test_archiving_is_opt_in(self):
+        self.assertIsNone(archive.archive_cutoff(self.conversation))
+        self.assertNotIn(self.conversation, archive.conversations_to_archive())
+        self.conversation.retention_days = 30
+        self.assertIsNotNone(archive.archive_cutoff(self.conversation))
+
+    @override_settings(CHAT_ARCHIVE={'AFTER_DAYS': 30, 'BATCH_SIZE': 100})
+    def test_zero_retention_disables_archiving(self):
+        self.conversation.retention_days = 0
+        self.conversation.save()
+        self.assertIsNone(archive.archive_cutoff(self.conversation))
+        self.assertEqual(archive_conversation(self.conversation), 0)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    headers = [(b'host', b'testserver'), (b'origin', b'http://testserver')]
+
+    def setUp(self):
+        from pingme.asgi import application
+
+        self.application = application
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.set([self.alice, self.bob])
+
+    def communicator(self, user=None, token=None):
+        if user is not None:
+            token = AccessToken.for_user(user)
+        path = '/ws/chat/' if token is None else f'/ws/chat/?token={token}'
+        return WebsocketCommunicator(self.application, path, headers=self.headers)
+
+    async def receive(self, communicator, *types):
+        """The next frame of one of ``types``, skipping badge and ack frames"""
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame['type'] in types:
+                return frame
+
+    def test_rejected_connections_disconnect_cleanly(self):
+        async def run():
+            for communicator in (self.communicator(), self.communicator(token='invalid')):
+                connected, _ = await communicator.connect()
+                self.assertFalse(connected)
+                await communicator.disconnect()
+
+        async_to_sync(run)()
+
+    def test_message_reaches_the_other_member(self):
+        async def run():
+            alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+            self.assertTrue((await alice.connect())[0])
+            self.assertTrue((await bob.connect())[0])
+            await alice.send_json_to({
+                'type': 'message', 'conversation': self.conversation.pk, 'content': 'hi', 'client_id': 'c1',
+            })
+            ack = await self.receive(alice, 'message_ack')
+            self.assertFalse(ack['duplicate'])
+            frame = await self.receive(bob, 'chat_message')
+            self.assertEqual(frame['message']['content'], 'hi')
+            await alice.disconnect()
+            await bob.disconnect()
+
+        async_to_sync(run)()
+
+    def test_drain_asks_clients_to_reconnect_and_refuses_new_ones(self):
+        async def run():
+            alice = self.communicator(self.alice)
+            await alice.connect()
+            self.assertEqual(await consumers.drain_consumers(), 1)
+            frame = await self.receive(alice, 'reconnect')
+            self.assertGreaterEqual(frame['retry_after'], 0)
+            self.assertEqual((await alice.receive_output())['code'], consumers.SERVICE_RESTART)
+
+            late = self.communicator(self.bob)
+            self.assertFalse((await late.connect())[0])
+            await late.disconnect()
+            await alice.wait()
+
+        try:
+            async_to_sync(run)()
+        finally:
+            consumers._draining = False
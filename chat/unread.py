@@ -0,0 +1,194 @@
+"""
+Per-user unread badge (UnreadCounter): the sum of ``unread_count`` over the
+user's conversations, moved by one UPDATE when messages are created or
+marked read instead of being recounted. Broadcast conversations are left
+out; their unread counts come from read cursors (chat.membership).
+
+Changes reach the user's ``user_<id>`` group as ``{"type": "unread_total",
+"unread": n}`` once committed. Saving or deleting a message moves the counters
+through chat.signals; anything else that changes read state in bulk (queryset
+updates other than ``set_read_state``, leaving a conversation) drifts them
+until the daily ``reconcile_unread_counters`` task puts them right.
+"""
+from collections import Counter, defaultdict
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from chat.membership import is_broadcast, member_ids
+from chat.models import Membership, Message, UnreadCounter
+from chat.sharding import scatter
+
+User = get_user_model()
+
+
+def unread_total(user_id):
+    return UnreadCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first() or 0
+
+
+def add_unread(changes):
+    """
+    Apply ``{user_id: n}`` (n may be negative) with one UPDATE per distinct n;
+    counters never go below zero
+    """
+    changes = {user_id: amount for user_id, amount in changes.items() if amount}
+    if not changes:
+        return
+    increased = [user_id for user_id, amount in changes.items() if amount > 0]
+    if increased:
+        # Missing counters are created at zero first, so every increment is an
+        # UPDATE and concurrent first messages cannot overwrite each other
+        UnreadCounter.objects.bulk_create(
+            [UnreadCounter(user_id=user_id) for user_id in increased], ignore_conflicts=True,
+        )
+    by_amount = defaultdict(list)
+    for user_id, amount in changes.items():
+        by_amount[amount].append(user_id)
+    for amount, user_ids in by_amount.items():
+        counters = UnreadCounter.objects.filter(user_id__in=user_ids)
+        if amount < 0:
+            counters.update(unread=Greatest(F('unread') + amount, 0))
+        else:
+            counters.update(unread=F('unread') + amount)
+    transaction.on_commit(partial(push_unread, list(changes)))
+
+
+def message_created(message):
+    """Every other member of the conversation has one more unread message"""
+    if message.is_read or is_broadcast(message.conversation_id):
+        return
+    recipients = member_ids(message.conversation_id) - {message.sender_id}
+    add_unread(dict.fromkeys(recipients, 1))
+
+
+def read_state_changed(conversation_id, sender_counts, read=True):
+    """
+    ``sender_counts`` ``{sender_id: n}`` messages of the conversation were
+    marked read (or unread): ``is_read`` is shared by the conversation, so
+    every member but each message's sender counts them
+    """
+    if not sender_counts or is_broadcast(conversation_id):
+        return
+    total = sum(sender_counts.values())
+    sign = -1 if read else 1
+    add_unread({
+        user_id: sign * (total - sender_counts.get(user_id, 0))
+        for user_id in member_ids(conversation_id)
+    })
+
+
+def set_read_state(messages, read=True):
+    """
+    Mark ``messages`` read (or unread) and move the badges by exactly the rows
+    that changed; returns ``{conversation_id: [message ids]}`` of those rows.
+    The rows are locked while they are counted, so a message arriving between
+    the count and the UPDATE is neither marked nor uncounted.
+    """
+    with transaction.atomic(using=messages.db):
+        rows = list(
+            messages.filter(is_read=not read).select_for_update()
+            .values_list('pk', 'conversation_id', 'sender_id')
+        )
+        if not rows:
+            return {}
+        messages.filter(pk__in=[pk for pk, _, _ in rows]).update(is_read=read)
+    changed = defaultdict(list)
+    counts = defaultdict(Counter)
+    for pk, conversation_id, sender_id in rows:
+        changed[conversation_id].append(pk)
+        counts[conversation_id][sender_id] += 1
+    for conversation_id, senders in counts.items():
+        read_state_changed(conversation_id, dict(senders), read=read)
+    return changed
+
+
+def sender_counts(messages):
+    """``{(conversation_id, sender_id): n}`` of a message queryset, before its read state is updated"""
+    rows = scatter(
+        messages.order_by().values('conversation_id', 'sender_id').annotate(total=Count('pk'))
+    )
+    counts = defaultdict(dict)
+    for row in rows:
+        counts[row['conversation_id']][row['sender_id']] = row['total']
+    return counts
+
+
+def push_unread(user_ids):
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    totals = dict(UnreadCounter.objects.filter(user_id__in=user_ids).values_list('user_id', 'unread'))
+    for user_id in user_ids:
+        async_to_sync(channel_layer.group_send)(f'user_{user_id}', {
+            'type': 'unread_total',
+            'unread': totals.get(user_id, 0),
+        })
+
+
+def count_unread(user_ids):
+    """``{user_id: unread}`` recounted from the messages, one query per database"""
+    unread = (
+        Message.objects
+        .filter(conversation=OuterRef('conversation_id'), is_read=False)
+        .exclude(sender_id=OuterRef('user_id'))
+        .values('conversation')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    rows = scatter(
+        Membership.objects
+        .filter(user_id__in=user_ids, conversation__is_broadcast=False)
+        .annotate(unread=Coalesce(Subquery(unread, output_field=IntegerField()), 0))
+        .values_list('user_id', 'unread')
+    )
+    totals = dict.fromkeys(user_ids, 0)
+    for user_id, count in rows:
+        totals[user_id] += count
+    return totals
+
+
+def reconcile(user_ids):
+    """
+    Set the counters of ``user_ids`` to a recount; returns ``{user_id: (was,
+    now)}`` for the ones that had drifted. A message arriving meanwhile can
+    leave one off by its increment until the next run.
+    """
+    actual = count_unread(user_ids)
+    counters = UnreadCounter.objects.in_bulk(user_ids)
+    drifted = {
+        user_id: (counters[user_id].unread if user_id in counters else 0, count)
+        for user_id, count in actual.items()
+        if (counters[user_id].unread if user_id in counters else 0) != count
+    }
+    if not drifted:
+        return drifted
+    with transaction.atomic():
+        UnreadCounter.objects.bulk_create(
+            [UnreadCounter(user_id=user_id) for user_id in drifted if user_id not in counters],
+            ignore_conflicts=True,
+        )
+        UnreadCounter.objects.bulk_update(
+            [UnreadCounter(user_id=user_id, unread=now) for user_id, (_, now) in drifted.items()],
+            ['unread'],
+        )
+    transaction.on_commit(partial(push_unread, list(drifted)))
+    return drifted
+
+
+def reconcile_batches(user_ids=None, batch_size=500):
+    """reconcile() every user (or ``user_ids``) in pk order; yields ``(batch, drifted)``"""
+    users = User.objects.order_by('pk')
+    if user_ids:
+        users = users.filter(pk__in=user_ids)
+    last_pk = 0
+    while True:
+        batch = list(users.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return
+        yield batch, reconcile(batch)
+        last_pk = batch[-1]
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import ConversationViewSet, MessageViewSet
+from .async_views import InboxView, MessageHistoryView
 
 router = DefaultRouter()
 router.register(r'conversations', ConversationViewSet, basename='conversation')
@@ -8,4 +9,8 @@ router.register(r'messages', MessageViewSet, basename='message')
 
 urlpatterns = [
     path('', include(router.urls)),
+    
+    # Async read endpoints
+    path('async/inbox/', InboxView.as_view(), name='async_inbox'),
+    path('async/conversations/<int:pk>/messages/', MessageHistoryView.as_view(), name='async_message_history'),
 ]
\ No newline at end of file
@@ -1,48 +1,213 @@
+from functools import partial
+
+from django.db.models import Max
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema
 
-from chat.serializers import ConversationSerializer, MessageSerializer
-from chat.models import Conversation, Message
+from chat.serializers import (
+    CompactMessageSerializer, ConversationSerializer, MessageSerializer, compact_messages,
+)
+from chat.models import Conversation, Membership, Message, MessageArchive
+from chat.membership import attach_participants, can_post, changed_by, is_member, members_last_seen
+from chat.archive import archived_messages, parse_month
+from chat.sharding import scatter
+from chat import unread
+from api.serializers import load_only, requested_fields, serializer_columns
+from api.views import ReadReplicaMixin, conditional_response, make_etag
+from sync.changes import latest_change
+from user.serializers import UserProfileSerializer
+
+class MessagePageMixin:
+    """
+    Paginated message lists. ``?compact=1`` replaces each embedded sender
+    profile with its id and adds one ``users`` map per page; ``?fields=``
+    picks the message fields to return.
+    """
+    
+    def message_page_response(self, messages):
+        params = self.request.query_params
+        fields = requested_fields(params)
+        compact = params.get('compact') in ('1', 'true')
+        serializer_class = CompactMessageSerializer if compact else MessageSerializer
+        if hasattr(messages, 'only'):
+            # Archived pages are lists of rebuilt messages, not querysets
+            messages = load_only(messages, serializer_class(fields=fields))
+        page = self.paginate_queryset(messages)
+        items = page if page is not None else list(messages)
+        if compact:
+            results, users = compact_messages(items, fields)
+        else:
+            results, users = MessageSerializer(items, many=True, fields=fields).data, None
+        if page is None:
+            return Response(results if users is None else {'results': results, 'users': users})
+        response = self.get_paginated_response(results)
+        if users is not None:
+            response.data['users'] = users
+        return response
 
 @extend_schema(tags=['Chat'])
-class ConversationViewSet(viewsets.ModelViewSet):
+class ConversationViewSet(MessagePageMixin, ReadReplicaMixin, viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsAuthenticated]
+    replica_actions = ('list', 'retrieve', 'messages', 'archives')
     
     queryset = Conversation.objects.all()
     
     def get_queryset(self):
-        return self.request.user.conversations.all().distinct()
+        # Scatter-gather over the shards when chat is sharded
+        conversations = self.request.user.conversations.order_by('-updated_at', '-id').distinct()
+        if self.action in ('list', 'retrieve'):
+            conversations = load_only(conversations, self.get_serializer())
+        return scatter(conversations)
+    
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None and self.action == 'list':
+            attach_participants(page, user_columns=serializer_columns(UserProfileSerializer())[0])
+        return page
+    
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # The creator is not told they were added to their own group
+        with changed_by(request.user.pk):
+            conversation = serializer.save()
+        # An existing 1:1 conversation is returned as is
+        created = getattr(conversation, 'created', True)
+        return Response(
+            self.get_serializer(conversation).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
         context.update({'request': self.request})
         return context
     
+    def get_validators(self, archives=False):
+        """
+        ETag and Last-Modified of the conversation in the URL, from its
+        updated_at, its newest change log entry (messages, edits, reads,
+        membership) and its members' newest last_seen (profiles and
+        presence); None when the user cannot see it.
+        """
+        try:
+            conversation_id = int(self.kwargs['pk'])
+        except ValueError:
+            return None
+        if not is_member(conversation_id, self.request.user.id):
+            return None
+        updated_at = (
+            Conversation.objects.filter(pk=conversation_id).values_list('updated_at', flat=True).first()
+        )
+        if updated_at is None:
+            return None
+        sequence, changed_at = latest_change(conversation_id)
+        last_seen = members_last_seen(conversation_id)
+        archived_at = None
+        if archives:
+            # Archiving moves messages without a change log entry
+            archived_at = (
+                MessageArchive.objects.filter(conversation_id=conversation_id)
+                .aggregate(last=Max('updated_at'))['last']
+            )
+        versions = [updated_at, changed_at, archived_at, last_seen]
+        etag = make_etag(self.action, self.request.user.id, updated_at, sequence, archived_at, last_seen)
+        return etag, max(version for version in versions if version)
+    
+    def retrieve(self, request, *args, **kwargs):
+        return conditional_response(
+            request, self.get_validators(), partial(super().retrieve, request, *args, **kwargs)
+        )
+    
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
+        return conditional_response(
+            request, self.get_validators(archives=True), partial(self.list_messages, request)
+        )
+    
+    def list_messages(self, request):
         conversation = self.get_object()
-        messages = conversation.messages.all().order_by('timestamp')
-        page = self.paginate_queryset(messages)
-        if page is not None:
-            serializer = MessageSerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        if 'month' in request.query_params:
+            # Archived history, one monthly segment at a time (?month=YYYY-MM)
+            month = parse_month(request.query_params['month'])
+            if month is None:
+                return Response({'month': 'Expected YYYY-MM.'}, status=status.HTTP_400_BAD_REQUEST)
+            messages = archived_messages(conversation, month)
+        else:
+            messages = conversation.messages.all().order_by('timestamp')
+        return self.message_page_response(messages)
+
+    @action(detail=True, methods=['get'])
+    def archives(self, request, pk=None):
+        """Months of archived history available through messages/?month="""
+        conversation = self.get_object()
+        segments = conversation.archives.values('month', 'message_count')
+        return Response([
+            {'month': segment['month'].strftime('%Y-%m'), 'message_count': segment['message_count']}
+            for segment in segments
+        ])
+
+    @action(detail=False, methods=['get'], url_path='unread-total')
+    def unread_total(self, request):
+        """The unread badge: unread messages across the user's conversations, broadcast ones aside"""
+        return Response({'unread': unread.unread_total(request.user.pk)})
+
+    @action(detail=True, methods=['post'])
+    def subscribe(self, request, pk=None):
+        """Subscribe to a broadcast conversation"""
+        conversation = self.get_broadcast()
+        _, created = Membership.objects.get_or_create(conversation=conversation, user=request.user)
+        return Response(
+            self.get_serializer(conversation).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=['post'])
+    def unsubscribe(self, request, pk=None):
+        """Leave a broadcast conversation"""
+        conversation = self.get_broadcast()
+        Membership.objects.filter(conversation_id=conversation.pk, user_id=request.user.pk).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_broadcast(self):
+        # Not get_object(): subscribers are not members yet
+        try:
+            return Conversation.objects.get(pk=int(self.kwargs['pk']), is_broadcast=True)
+        except (ValueError, Conversation.DoesNotExist):
+            raise NotFound('No broadcast conversation matches the given query.')
 
 @extend_schema(tags=['Chat'])
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(MessagePageMixin, ReadReplicaMixin, viewsets.ModelViewSet):
     serializer_class = MessageSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Message.objects.filter(
+        messages = Message.objects.filter(
             conversation__participants=self.request.user
         ).order_by('-timestamp')
+        if self.action == 'retrieve':
+            messages = load_only(messages, self.get_serializer())
+        return scatter(messages)
+    
+    def list(self, request, *args, **kwargs):
+        return self.message_page_response(self.filter_queryset(self.get_queryset()))
     
-    def perform_create(self, serializer):
-        serializer.save(sender=self.request.user)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        conversation = serializer.validated_data['conversation']
+        if not can_post(conversation.id, request.user.id):
+            raise PermissionDenied('You cannot post to this conversation.')
+        message = serializer.save(sender=request.user)
+        # A retried send gets the message it created the first time
+        created = getattr(message, 'created', True)
+        return Response(
+            self.get_serializer(message).data,
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+        )
@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import Notification, NotificationCounter
 
-# Register your models here.
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['id', 'recipient', 'kind', 'text', 'count', 'updated_at', 'read_at']
+    list_filter = ['kind']
+    search_fields = ['recipient__email', 'recipient__username', 'text']
+    raw_id_fields = ['recipient', 'conversation', 'actor']
+    list_select_related = ['recipient']
+    list_per_page = 50
+
+
+@admin.register(NotificationCounter)
+class NotificationCounterAdmin(admin.ModelAdmin):
+    list_display = ['user', 'unread']
+    raw_id_fields = ['user']
@@ -0,0 +1,143 @@
+"""Coalesce queued notification events and deliver them in batches."""
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from chat.models import Conversation
+
+from .models import Notification, NotificationCounter, NotificationEvent
+from .serializers import NotificationSerializer
+
+User = get_user_model()
+
+
+def conversation_label(conversation, actor):
+    if conversation is None:
+        return ''
+    if conversation.group_name:
+        return conversation.group_name
+    return actor.username if actor is not None else 'a conversation'
+
+
+def notification_text(kind, count, conversation, actor):
+    label = conversation_label(conversation, actor)
+    actor_name = actor.username if actor is not None else 'Someone'
+    if kind == 'mention':
+        if count > 1:
+            return f'{count} mentions in {label}'
+        return f'{actor_name} mentioned you in {label}'
+    if kind == 'added_to_group':
+        return f'You were added to {label}'
+    if count > 1:
+        return f'{count} new messages in {label}'
+    return f'New message from {actor_name}'
+
+
+def deliver_pending(batch_size=None, settle_seconds=None):
+    """
+    Turn one batch of settled outbox events into notifications and push them
+    to the recipients' ``user_<id>`` groups. Events younger than
+    ``settle_seconds`` are left alone so a burst lands in a single
+    notification. Returns the number of events processed.
+    """
+    config = settings.NOTIFICATIONS
+    batch_size = batch_size or config['BATCH_SIZE']
+    if settle_seconds is None:
+        settle_seconds = config['SETTLE_SECONDS']
+    cutoff = timezone.now() - timedelta(seconds=settle_seconds)
+
+    with transaction.atomic():
+        events = NotificationEvent.objects.filter(created_at__lte=cutoff).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            events = events.select_for_update(skip_locked=True)
+        events = list(events[:batch_size])
+        if not events:
+            return 0
+
+        grouped = defaultdict(list)
+        for event in events:
+            grouped[(event.recipient_id, event.conversation_id, event.kind)].append(event)
+
+        conversations = Conversation.objects.in_bulk({event.conversation_id for event in events} - {None})
+        actors = User.objects.only('id', 'username').in_bulk({event.actor_id for event in events} - {None})
+
+        # Unread notifications of the same kind absorb the new events
+        existing = {}
+        unread = Notification.objects.filter(
+            read_at__isnull=True,
+            recipient_id__in={key[0] for key in grouped},
+            conversation_id__in={key[1] for key in grouped} - {None},
+        )
+        for notification in unread.order_by('updated_at'):
+            existing[(notification.recipient_id, notification.conversation_id, notification.kind)] = notification
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        new_unread = defaultdict(int)
+        for (recipient_id, conversation_id, kind), group in grouped.items():
+            actor_id = group[-1].actor_id
+            notification = existing.get((recipient_id, conversation_id, kind))
+            if notification is None:
+                notification = Notification(
+                    recipient_id=recipient_id, kind=kind, conversation_id=conversation_id, count=0
+                )
+                to_create.append(notification)
+                new_unread[recipient_id] += 1
+            else:
+                to_update.append(notification)
+            notification.count += len(group)
+            notification.actor_id = actor_id
+            notification.updated_at = now
+            notification.text = notification_text(
+                kind, notification.count, conversations.get(conversation_id), actors.get(actor_id)
+            )
+
+        Notification.objects.bulk_create(to_create)
+        Notification.objects.bulk_update(to_update, ['count', 'actor', 'text', 'updated_at'])
+        increment_counters(new_unread)
+        NotificationEvent.objects.filter(pk__in=[event.pk for event in events]).delete()
+
+        delivered = to_create + to_update
+        transaction.on_commit(lambda: push(delivered))
+    return len(events)
+
+
+def increment_counters(increments):
+    """Add ``{user_id: n}`` to the unread counters with one UPDATE per distinct n"""
+    if not increments:
+        return
+    NotificationCounter.objects.bulk_create(
+        [NotificationCounter(user_id=user_id) for user_id in increments],
+        ignore_conflicts=True,
+    )
+    by_amount = defaultdict(list)
+    for user_id, amount in increments.items():
+        by_amount[amount].append(user_id)
+    for amount, user_ids in by_amount.items():
+        NotificationCounter.objects.filter(user_id__in=user_ids).update(unread=F('unread') + amount)
+
+
+def push(notifications):
+    """Send each recipient one frame with all of its notifications and unread count"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    by_recipient = defaultdict(list)
+    for notification in notifications:
+        by_recipient[notification.recipient_id].append(notification)
+    counters = dict(
+        NotificationCounter.objects.filter(user_id__in=by_recipient).values_list('user_id', 'unread')
+    )
+    for recipient_id, items in by_recipient.items():
+        async_to_sync(channel_layer.group_send)(f'user_{recipient_id}', {
+            'type': 'notification_batch',
+            'notifications': NotificationSerializer(items, many=True).data,
+            'unread': counters.get(recipient_id, 0),
+        })
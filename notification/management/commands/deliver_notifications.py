@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from notification.delivery import deliver_pending
+
+
+class Command(BaseCommand):
+    help = 'Coalesce queued notification events and deliver them in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATIONS['BATCH_SIZE'])
+        parser.add_argument(
+            '--interval', type=float, default=settings.NOTIFICATIONS['SETTLE_SECONDS'],
+            help='Seconds to sleep when the outbox is empty',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            processed = deliver_pending(batch_size=options['batch_size'])
+            while processed:
+                self.stdout.write(f'Delivered {processed} event(s)')
+                processed = deliver_pending(batch_size=options['batch_size'])
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -1,3 +1,56 @@
 from django.db import models
+from django.contrib.auth import get_user_model
 
-# Create your models here.
+User = get_user_model()
+
+KIND_CHOICES = [
+    ('new_message', 'New message'),
+    ('added_to_group', 'Added to group'),
+    ('mention', 'Mention'),
+]
+
+class Notification(models.Model):
+    """A delivered notification; bursts of events are coalesced into one row"""
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    conversation = models.ForeignKey(
+        'chat.Conversation', on_delete=models.CASCADE, null=True, blank=True, related_name='+',
+        # Conversations may live on a shard, see chat/sharding.py
+        db_constraint=False,
+    )
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    count = models.PositiveIntegerField(default=1)
+    text = models.CharField(max_length=255)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['recipient', '-id'], name='notification_recipient_id_idx'),
+            models.Index(
+                fields=['recipient', 'conversation', 'kind'],
+                condition=models.Q(read_at__isnull=True),
+                name='notification_unread_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return self.text
+
+class NotificationEvent(models.Model):
+    """Outbox entry: one raw event waiting for the delivery worker"""
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    conversation = models.ForeignKey(
+        'chat.Conversation', on_delete=models.CASCADE, null=True, blank=True, related_name='+',
+        # Conversations may live on a shard, see chat/sharding.py
+        db_constraint=False,
+    )
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+class NotificationCounter(models.Model):
+    """Per-user unread notification count, so the API never runs COUNT(*)"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.PositiveIntegerField(default=0)
@@ -0,0 +1,22 @@
+from rest_framework import serializers
+
+from notification.models import Notification
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'kind', 'conversation', 'actor', 'count', 'text',
+                  'created_at', 'updated_at', 'read_at']
+        read_only_fields = fields
+
+
+class AcknowledgeSerializer(serializers.Serializer):
+    """Either a list of notification ids or ``all: true``"""
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False)
+    all = serializers.BooleanField(default=False)
+    
+    def validate(self, attrs):
+        if not attrs.get('ids') and not attrs['all']:
+            raise serializers.ValidationError('Provide "ids" or "all".')
+        return attrs
@@ -0,0 +1,99 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from chat import sharding
+from chat.membership import is_broadcast, member_ids, membership_actor
+from chat.models import Conversation, Membership, Message
+
+from .models import Notification, NotificationEvent
+
+User = get_user_model()
+
+MENTION_RE = re.compile(r'@([\w.@+-]+)')
+
+
+@receiver(post_save, sender=Message)
+def queue_message_events(sender, instance, created, **kwargs):
+    """Queue new_message/mention events; the delivery worker coalesces them"""
+    if not created:
+        return
+    if is_broadcast(instance.conversation_id):
+        # Subscribers find new posts through their read cursors; an event
+        # per subscriber would make posting cost grow with the audience
+        return
+    recipients = member_ids(instance.conversation_id) - {instance.sender_id}
+    if not recipients:
+        return
+    
+    mentioned = set()
+    names = set(MENTION_RE.findall(instance.content or ''))
+    if names:
+        mentioned = set(
+            User.objects.filter(username__in=names, id__in=recipients).values_list('id', flat=True)
+        )
+    muted = set(
+        Membership.objects
+        .filter(conversation_id=instance.conversation_id, muted=True)
+        .values_list('user_id', flat=True)
+    )
+    
+    events = [
+        NotificationEvent(
+            recipient_id=user_id,
+            kind='mention' if user_id in mentioned else 'new_message',
+            conversation_id=instance.conversation_id,
+            actor_id=instance.sender_id,
+        )
+        for user_id in recipients
+        # Mentions get through even when the conversation is muted
+        if user_id in mentioned or user_id not in muted
+    ]
+    NotificationEvent.objects.bulk_create(events)
+
+
+def queue_added_to_group(conversation_ids, user_ids):
+    # Subscribing to a broadcast conversation is the user's own doing, and so
+    # is joining a group one creates (chat.membership.changed_by)
+    actor_id = membership_actor()
+    user_ids = [user_id for user_id in user_ids if user_id != actor_id]
+    if not user_ids:
+        return
+    group_ids = set(
+        Conversation.objects
+        .filter(pk__in=conversation_ids, is_group=True, is_broadcast=False)
+        .values_list('pk', flat=True)
+    )
+    NotificationEvent.objects.bulk_create([
+        NotificationEvent(
+            recipient_id=user_id, kind='added_to_group', conversation_id=conversation_id, actor_id=actor_id
+        )
+        for conversation_id in group_ids
+        for user_id in user_ids
+    ])
+
+
+@receiver(post_save, sender=Membership)
+def membership_created(sender, instance, created, **kwargs):
+    if created:
+        queue_added_to_group([instance.conversation_id], [instance.user_id])
+
+
+@receiver(m2m_changed, sender=Membership)
+def participants_added(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    if reverse:
+        queue_added_to_group(pk_set, [instance.pk])
+    else:
+        queue_added_to_group([instance.pk], pk_set)
+
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    """A sharded conversation's deletion does not cascade to `default`"""
+    if sharding.enabled():
+        Notification.objects.filter(conversation_id=instance.pk).delete()
+        NotificationEvent.objects.filter(conversation_id=instance.pk).delete()
@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from django.conf import settings
+
+from task.registry import periodic_task
+
+from .delivery import deliver_pending
+
+
+@periodic_task(every=timedelta(seconds=settings.NOTIFICATIONS['SETTLE_SECONDS']))
+def deliver_notifications():
+    """Drain the notification outbox"""
+    while deliver_pending():
+        pass
@@ -1,3 +1,64 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
+
+from chat.models import Conversation, Message
+from notification.delivery import deliver_pending
+from notification.models import Notification
+from notification.views import NotificationPagination
+
+User = get_user_model()
+
+
+def make_user(username):
+    return User.objects.create_user(username=username, email=f'{username}@example.com', password='pw')
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.alice = make_user('alice')
+        self.bob = make_user('bob')
+        self.client = APIClient()
+
+    def test_group_creator_is_not_notified(self):
+        self.client.force_authenticate(self.alice)
+        response = self.client.post('/api/chat/conversations/', {
+            'participants_ids': [self.bob.pk], 'is_group': True, 'group_name': 'Team',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        deliver_pending(settle_seconds=0)
+        added = Notification.objects.get(kind='added_to_group')
+        self.assertEqual((added.recipient, added.actor), (self.bob, self.alice))
+
+    @mock.patch.object(NotificationPagination, 'page_size', 1)
+    def test_cursor_is_stable_when_notifications_coalesce(self):
+        conversations = []
+        for _ in range(3):
+            conversation = Conversation.objects.create()
+            conversation.participants.set([self.alice, self.bob])
+            Message.objects.create(conversation=conversation, sender=self.alice, content='hi')
+            deliver_pending(settle_seconds=0)
+            conversations.append(conversation)
+
+        self.client.force_authenticate(self.bob)
+        first = self.client.get('/api/notifications/').json()
+        # The oldest notification absorbs a new message while bob pages
+        Message.objects.create(conversation=conversations[0], sender=self.alice, content='again')
+        deliver_pending(settle_seconds=0)
+        seen = [item['id'] for item in first['results']]
+        url = first['next']
+        while url:
+            page = self.client.get(url).json()
+            seen += [item['id'] for item in page['results']]
+            url = page['next']
+        self.assertEqual(seen, sorted(Notification.objects.values_list('id', flat=True), reverse=True))
 
-# Create your tests here.
+    def test_unread_count(self):
+        conversation = Conversation.objects.create()
+        conversation.participants.set([self.alice, self.bob])
+        Message.objects.create(conversation=conversation, sender=self.alice, content='hi')
+        deliver_pending(settle_seconds=0)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/notifications/unread-count/').json(), {'unread': 1})
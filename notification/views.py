@@ -1,14 +1,58 @@
-from urllib import request
-from django.http import HttpResponse
-from django.shortcuts import render
-from rest_framework import viewsets
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from rest_framework import mixins, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema
 
+from notification.models import Notification, NotificationCounter
+from notification.serializers import AcknowledgeSerializer, NotificationSerializer
+
+
+class NotificationPagination(CursorPagination):
+    # Coalescing moves updated_at, which would make a cursor skip or repeat
+    # rows; the id never changes
+    ordering = '-id'
+
+
+def count_unread(user):
+    return (
+        NotificationCounter.objects.filter(user=user).values_list('unread', flat=True).first() or 0
+    )
+
 
 @extend_schema(tags=['Notification'])
-class NotificationView(viewsets.ModelViewSet):
-    serializer_class = None  # Placeholder, define your serializer here
-    permission_classes = []  # Placeholder, define your permissions here
-    def get(self, request):
-        return Response("Notification View Response")
\ No newline at end of file
+class NotificationViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    serializer_class = NotificationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = NotificationPagination
+    
+    def get_queryset(self):
+        notifications = Notification.objects.filter(recipient=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            notifications = notifications.filter(read_at__isnull=True)
+        return notifications
+    
+    @extend_schema(request=AcknowledgeSerializer)
+    @action(detail=False, methods=['post'])
+    def acknowledge(self, request):
+        """Mark notifications as read and return the new unread count"""
+        serializer = AcknowledgeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        
+        notifications = Notification.objects.filter(recipient=request.user, read_at__isnull=True)
+        if not serializer.validated_data['all']:
+            notifications = notifications.filter(id__in=serializer.validated_data['ids'])
+        acknowledged = notifications.update(read_at=timezone.now())
+        if acknowledged:
+            NotificationCounter.objects.filter(user=request.user).update(
+                unread=Greatest(F('unread') - acknowledged, 0)
+            )
+        return Response({'acknowledged': acknowledged, 'unread': count_unread(request.user)})
+    
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        return Response({'unread': count_unread(request.user)})
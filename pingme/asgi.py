@@ -13,4 +13,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pingme.settings')
 
-application = get_asgi_application()
+# Initialize Django before importing anything that touches models
+django_asgi_app = get_asgi_application()
+
+from channels.auth import AuthMiddlewareStack
+from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.security.websocket import AllowedHostsOriginValidator
+from django.conf import settings
+
+from chat.routing import websocket_urlpatterns
+from user.middleware import JWTAuthMiddleware
+
+websocket_router = URLRouter(websocket_urlpatterns)
+websocket_app = AuthMiddlewareStack(websocket_router)
+if settings.WEBSOCKET_QUERY_TOKEN:
+    # Token connections skip the cookie and session stack
+    websocket_app = JWTAuthMiddleware(websocket_router, session_inner=websocket_app)
+
+application = ProtocolTypeRouter({
+    'http': django_asgi_app,
+    'websocket': AllowedHostsOriginValidator(websocket_app),
+})
@@ -0,0 +1,150 @@
+"""Caching helpers shared by the local apps."""
+import pickle
+import threading
+import time
+
+from django.core.cache import cache
+
+from pingme.routers import primary_reads
+
+
+class LocalTTLCache:
+    """Process-local cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                # Cheap eviction: drop expired entries, then the oldest ones
+                now = time.monotonic()
+                self._data = {k: v for k, v in list(self._data.items()) if v[0] >= now}
+                while len(self._data) >= self.max_entries:
+                    self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data = {}
+
+
+class TwoLevelCache:
+    """
+    Short-lived process-local cache in front of Django's shared cache.
+
+    Values are kept pickled, so every caller gets its own copy and can mutate
+    it freely. Pass ``immutable=True`` for values such as frozensets to keep
+    the decoded object in the local layer instead. A ``loader`` returning
+    ``None`` is never cached. Loaders always read from the primary database
+    so a lagging replica cannot be cached.
+
+    ``delete`` only reaches the local layer of the calling process. With
+    ``generation_poll`` it also bumps a shared generation counter that every
+    process reads at most once per ``generation_poll`` seconds, clearing its
+    local layer when the counter moved, so a change is seen everywhere
+    within that interval instead of ``local_ttl``.
+    """
+
+    def __init__(self, prefix, local_ttl, shared_ttl, immutable=False, generation_poll=None):
+        self.prefix = prefix
+        self.shared_ttl = shared_ttl
+        self.immutable = immutable
+        self.local = LocalTTLCache(local_ttl)
+        self.generation_poll = generation_poll
+        self._generation = None
+        self._generation_read_at = float('-inf')
+
+    def make_key(self, key):
+        return f'{self.prefix}:{key}'
+
+    @property
+    def generation_key(self):
+        return f'{self.prefix}:generation'
+
+    def _generation_due(self):
+        if self.generation_poll is None:
+            return False
+        now = time.monotonic()
+        if now - self._generation_read_at < self.generation_poll:
+            return False
+        self._generation_read_at = now
+        return True
+
+    def _set_generation(self, generation, own=False):
+        """Clear the local layer unless ``generation`` is the one it was filled under"""
+        if generation == self._generation:
+            return
+        if not (own and self._generation is not None and generation == self._generation + 1):
+            self.local.clear()
+        self._generation = generation
+
+    def get(self, key, loader):
+        if self._generation_due():
+            self._set_generation(cache.get(self.generation_key, 0))
+        cache_key = self.make_key(key)
+        local = self.local.get(cache_key)
+        if local is not None:
+            return self._from_local(local)
+        payload = cache.get(cache_key)
+        if payload is None:
+            with primary_reads():
+                value = loader()
+            if value is None:
+                return None
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            cache.set(cache_key, payload, self.shared_ttl)
+        return self._to_local(cache_key, payload)
+
+    async def aget(self, key, loader):
+        """Async variant of ``get``; ``loader`` must be a coroutine function"""
+        if self._generation_due():
+            self._set_generation(await cache.aget(self.generation_key, 0))
+        cache_key = self.make_key(key)
+        local = self.local.get(cache_key)
+        if local is not None:
+            return self._from_local(local)
+        payload = await cache.aget(cache_key)
+        if payload is None:
+            with primary_reads():
+                value = await loader()
+            if value is None:
+                return None
+            payload = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            await cache.aset(cache_key, payload, self.shared_ttl)
+        return self._to_local(cache_key, payload)
+
+    def _to_local(self, cache_key, payload):
+        value = pickle.loads(payload)
+        self.local.set(cache_key, value if self.immutable else payload)
+        return value
+
+    def _from_local(self, local):
+        return local if self.immutable else pickle.loads(local)
+
+    def delete(self, key):
+        cache_key = self.make_key(key)
+        self.local.delete(cache_key)
+        cache.delete(cache_key)
+        if self.generation_poll is not None:
+            try:
+                generation = cache.incr(self.generation_key)
+            except ValueError:
+                cache.add(self.generation_key, 0, None)
+                generation = cache.incr(self.generation_key)
+            self._set_generation(generation, own=True)
@@ -0,0 +1,102 @@
+"""Database connection profiles selected from the environment (DB_PROFILE)."""
+import copy
+import os
+
+# Applied on every new SQLite connection. WAL lets readers run alongside the
+# single writer, synchronous=NORMAL is durable under WAL except for the last
+# commits on power loss, and busy_timeout makes writers wait for the lock
+# instead of failing with "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
+
+def env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def sqlite_config(name, tuned=False):
+    config = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': name,
+    }
+    if tuned:
+        pragmas = dict(
+            SQLITE_PRAGMAS,
+            busy_timeout=env_int('DB_BUSY_TIMEOUT_MS', SQLITE_PRAGMAS['busy_timeout']),
+            mmap_size=env_int('DB_MMAP_SIZE', SQLITE_PRAGMAS['mmap_size']),
+        )
+        config['OPTIONS'] = {
+            'init_command': ';'.join(f'PRAGMA {key}={value}' for key, value in pragmas.items()),
+            # Take the write lock at BEGIN: a deferred transaction that reads
+            # and then writes cannot wait on busy_timeout and fails at once
+            'transaction_mode': 'IMMEDIATE',
+        }
+        config['CONN_MAX_AGE'] = env_int('DB_CONN_MAX_AGE', 600)
+        config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
+def postgres_config():
+    """PostgreSQL through psycopg 3 with a per-process connection pool"""
+    config = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.getenv('DB_NAME', 'pingme'),
+        'USER': os.getenv('DB_USER', 'pingme'),
+        'PASSWORD': os.getenv('DB_PASSWORD', ''),
+        'HOST': os.getenv('DB_HOST', 'localhost'),
+        'PORT': os.getenv('DB_PORT', '5432'),
+    }
+    pool_size = env_int('DB_POOL_MAX_SIZE', 0)
+    if pool_size:
+        # Requires the optional ``psycopg[pool]`` package. The pool replaces
+        # persistent connections, so CONN_MAX_AGE must stay 0.
+        config['OPTIONS'] = {
+            'pool': {
+                'min_size': env_int('DB_POOL_MIN_SIZE', 2),
+                'max_size': pool_size,
+                'timeout': env_int('DB_POOL_TIMEOUT', 10),
+            },
+        }
+    else:
+        config['CONN_MAX_AGE'] = env_int('DB_CONN_MAX_AGE', 600)
+        config['CONN_HEALTH_CHECKS'] = True
+    return config
+
+
+def located_config(primary, location):
+    """Copy of the primary's settings pointing at another SQLite file or Postgres host"""
+    config = copy.deepcopy(primary)
+    if primary['ENGINE'].endswith('sqlite3'):
+        config['NAME'] = location
+    else:
+        config['HOST'] = location
+    return config
+
+
+def replica_config(primary, location):
+    config = located_config(primary, location)
+    # Tests run against the primary only
+    config['TEST'] = {'MIRROR': 'default'}
+    return config
+
+
+def database_config(profile, sqlite_name):
+    """
+    ``sqlite``: Django's defaults, a fresh connection per request.
+    ``sqlite-tuned``: WAL, mmap, busy timeout, IMMEDIATE transactions and
+    persistent connections.
+    ``postgres``: PostgreSQL, pooled when DB_POOL_MAX_SIZE is set.
+    """
+    if profile == 'sqlite':
+        return sqlite_config(sqlite_name)
+    if profile == 'sqlite-tuned':
+        return sqlite_config(sqlite_name, tuned=True)
+    if profile == 'postgres':
+        return postgres_config()
+    raise ValueError(f"Unknown DB_PROFILE {profile!r}, use 'sqlite', 'sqlite-tuned' or 'postgres'")
@@ -0,0 +1,216 @@
+"""
+Pre-fork launcher for the ASGI application: ``python -m pingme.launcher``
+binds the port once and runs LAUNCHER['WORKERS'] daphne processes that
+accept connections on the shared socket, restarting any that die. More
+than one worker needs the Redis channel layer and cache (REDIS_URL).
+
+SIGTERM (or SIGINT) drains instead of dropping connections: every worker
+stops accepting, asks its WebSocket clients to reconnect after a jittered
+delay (see chat.consumers.drain_consumers), waits for in-flight requests and
+messages, then exits. Workers still busy after DRAIN_TIMEOUT are killed.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+logger = logging.getLogger('pingme.launcher')
+
+# Time the master gives workers on top of their own drain timeout
+KILL_GRACE_SECONDS = 5
+
+
+class Master:
+    def __init__(self, address, workers, worker_args, drain_timeout):
+        self.address = address
+        self.worker_count = workers
+        self.worker_args = worker_args
+        self.drain_timeout = drain_timeout
+        self.workers = set()
+        self.listener = None
+        self.deadline = None
+
+    def run(self):
+        self.listener = socket.create_server(self.address, backlog=2048)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logger.info('Listening on %s:%s with %s workers', *self.address, self.worker_count)
+        for _ in range(self.worker_count):
+            self.spawn()
+
+        while self.workers:
+            for process in list(self.workers):
+                code = process.poll()
+                if code is None:
+                    continue
+                self.workers.discard(process)
+                if self.deadline is None:
+                    logger.warning('Worker %s exited with %s, starting another', process.pid, code)
+                    self.spawn()
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                for process in self.workers:
+                    logger.warning('Worker %s did not drain in time, killing it', process.pid)
+                    process.kill()
+                self.deadline = float('inf')
+            time.sleep(0.2)
+        logger.info('All workers stopped')
+
+    def spawn(self):
+        fd = self.listener.fileno()
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'pingme.launcher', '--worker-fd', str(fd), *self.worker_args],
+            pass_fds=[fd],
+        )
+        self.workers.add(process)
+
+    def stop(self, signum, frame):
+        if self.deadline is not None:
+            return
+        logger.info('Draining %s workers', len(self.workers))
+        self.deadline = time.monotonic() + self.drain_timeout + KILL_GRACE_SECONDS
+        # Once the workers stop listening too, new connections are refused
+        # instead of waiting in the backlog of a socket nobody accepts on
+        self.listener.close()
+        for process in self.workers:
+            process.send_signal(signal.SIGTERM)
+
+
+def draining_server_class():
+    # daphne.server installs the asyncio Twisted reactor on import, only
+    # workers should do that
+    from daphne.server import Server
+    from twisted.internet import reactor
+
+    class DrainingServer(Server):
+        """daphne's Server that can stop accepting and wait for open work before stopping"""
+
+        def __init__(self, *args, drain_timeout, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.drain_timeout = drain_timeout
+            self.ports = []
+            self.draining = False
+
+        def listen_success(self, port):
+            self.ports.append(port)
+            super().listen_success(port)
+
+        def drain(self):
+            if self.draining:
+                return
+            self.draining = True
+            for port in self.ports:
+                port.stopListening()
+            asyncio.ensure_future(self.finish_drain())
+
+        async def finish_drain(self):
+            from chat.consumers import drain_consumers
+
+            asked = await drain_consumers()
+            logger.info('Worker %s draining, %s WebSocket clients asked to reconnect', os.getpid(), asked)
+            deadline = time.monotonic() + self.drain_timeout
+            while self.busy() and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            self.stop()
+
+        def busy(self):
+            """Whether an HTTP request or WebSocket connection is still being handled"""
+            return any(
+                not details['application_instance'].done()
+                for details in self.connections.values()
+                if 'application_instance' in details
+            )
+
+        def install_signal_handlers(self):
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: reactor.callFromThread(self.drain))
+
+    return DrainingServer
+
+
+def run_worker(fd, verbosity, proxy_headers):
+    DrainingServer = draining_server_class()
+    from daphne.access import AccessLogGenerator
+    from django.conf import settings
+
+    from pingme.asgi import application
+
+    server = DrainingServer(
+        application,
+        endpoints=[f'fd:fileno={fd}'],
+        signal_handlers=False,
+        action_logger=AccessLogGenerator(sys.stdout) if verbosity >= 1 else None,
+        verbosity=verbosity,
+        proxy_forwarded_address_header='X-Forwarded-For' if proxy_headers else None,
+        proxy_forwarded_port_header='X-Forwarded-Port' if proxy_headers else None,
+        proxy_forwarded_proto_header='X-Forwarded-Proto' if proxy_headers else None,
+        drain_timeout=settings.LAUNCHER['DRAIN_TIMEOUT'],
+    )
+    server.install_signal_handlers()
+    server.run()
+
+
+def process_local_backends():
+    """Channel layers and caches configured to live inside one process"""
+    from django.conf import settings
+
+    local = [
+        f'CHANNEL_LAYERS[{alias!r}]'
+        for alias, layer in settings.CHANNEL_LAYERS.items()
+        if layer['BACKEND'] == 'channels.layers.InMemoryChannelLayer'
+    ]
+    local += [
+        f'CACHES[{alias!r}]'
+        for alias, cache in settings.CACHES.items()
+        if cache['BACKEND'] == 'django.core.cache.backends.locmem.LocMemCache'
+    ]
+    return local
+
+
+def main(argv=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pingme.settings')
+    from django.conf import settings
+
+    parser = argparse.ArgumentParser(prog='python -m pingme.launcher', description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('-b', '--bind', default='0.0.0.0', help='Address to listen on')
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('-w', '--workers', type=int, default=settings.LAUNCHER['WORKERS'])
+    parser.add_argument('-v', '--verbosity', type=int, default=1, help='As for daphne')
+    parser.add_argument(
+        '--proxy-headers', action='store_true',
+        help='Take the client address and scheme from X-Forwarded-* headers',
+    )
+    parser.add_argument('--worker-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level={0: logging.WARN, 1: logging.INFO}.get(args.verbosity, logging.DEBUG),
+        format='%(asctime)-15s %(levelname)-8s %(message)s',
+    )
+    if args.worker_fd is not None:
+        run_worker(args.worker_fd, args.verbosity, args.proxy_headers)
+        return
+
+    local = process_local_backends()
+    if args.workers > 1 and local:
+        # Group sends and cache invalidations would only reach the sockets of
+        # the worker they happen on
+        parser.error(
+            f'{args.workers} workers need a shared channel layer and cache, but '
+            f'{", ".join(local)} live in each process: set REDIS_URL or run one worker'
+        )
+
+    worker_args = ['--verbosity', str(args.verbosity)]
+    if args.proxy_headers:
+        worker_args.append('--proxy-headers')
+    Master(
+        (args.bind, args.port), args.workers, worker_args, settings.LAUNCHER['DRAIN_TIMEOUT'],
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Pagination for tables too large to COUNT(*) on every page view."""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+def estimated_row_count(model, using='default'):
+    """Row count from the database's planner statistics, or None when there are none"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # -1 until the table has been vacuumed or analyzed
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+            row = cursor.fetchone()
+            return row[0] if row and row[0] >= 0 else None
+        if connection.vendor == 'sqlite':
+            # Written by ANALYZE (or PRAGMA optimize); the first number is the row count
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone() is None:
+                return None
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+    return None
+
+
+class AtLeast(int):
+    """A row count that was cut off: at least this many, shown as e.g. "10,000+" """
+
+    def __str__(self):
+        return f'{int(self):,}+'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator whose count never scans a large table. When the planner expects
+    more than ``count_limit`` rows, an unfiltered list uses its estimate and a
+    filtered one counts up to ``count_limit`` rows, past which the count is an
+    ``AtLeast`` that grows as later pages are asked for, so every page stays
+    reachable. Smaller tables are counted exactly.
+    """
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        estimate = estimated_row_count(queryset.model, queryset.db)
+        if estimate is not None and estimate <= self.count_limit:
+            return queryset.order_by().values('pk').count()
+        if not queryset.query.where and estimate is not None:
+            return estimate
+        return self.count_up_to(self.count_limit)
+
+    def count_up_to(self, limit):
+        """The exact count when at most ``limit``, else ``AtLeast(limit)``"""
+        # COUNT(*) over a LIMITed subquery of bare ids, without annotations
+        count = self.object_list.order_by().values('pk')[:limit + 1].count()
+        return count if count <= limit else AtLeast(limit)
+
+    def page(self, number):
+        try:
+            end = int(number) * self.per_page
+        except (TypeError, ValueError):
+            end = None
+        if end is not None and isinstance(self.count, AtLeast) and end >= self.count:
+            # Count on to one page past the one asked for, so it links onward
+            self.__dict__['count'] = self.count_up_to(end + self.per_page)
+            self.__dict__.pop('num_pages', None)
+        return super().page(number)
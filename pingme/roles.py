@@ -0,0 +1,44 @@
+"""Settings trimmed for processes that serve only part of the project (PINGME_ROLE)."""
+
+# Apps the slim roles do without: the admin (and its theme), the API docs,
+# query-string filtering, and daphne's app, which only adds the ASGI
+# runserver but imports Twisted in every process (the daphne server loads
+# it itself)
+DEFERRED_APPS = [
+    'daphne',
+    'jazzmin',
+    'django.contrib.admin',
+    'drf_spectacular',
+    'drf_spectacular_sidecar',
+    'django_filters',
+]
+ROLE_DEFERRED_APPS = {
+    'all': [],
+    # HTTP API and auth endpoints
+    'api': DEFERRED_APPS,
+    # WebSockets only: nothing serves static files either
+    'ws': DEFERRED_APPS + ['django.contrib.staticfiles'],
+}
+
+
+def role_settings(role, installed_apps, rest_framework):
+    """
+    ``(INSTALLED_APPS, REST_FRAMEWORK)`` for ``role``:
+    ``all``: everything, one process serves the whole project.
+    ``api``: no admin, API docs, django-filter or ASGI runserver; the URLs for
+    them are not mounted.
+    ``ws``: like ``api``, without staticfiles.
+    """
+    if role not in ROLE_DEFERRED_APPS:
+        raise ValueError(f"Unknown PINGME_ROLE {role!r}, use 'all', 'api' or 'ws'")
+    deferred = ROLE_DEFERRED_APPS[role]
+    if not deferred:
+        return installed_apps, rest_framework
+    rest_framework = dict(
+        rest_framework,
+        DEFAULT_FILTER_BACKENDS=tuple(
+            backend for backend in rest_framework.get('DEFAULT_FILTER_BACKENDS', ())
+            if backend.split('.')[0] not in deferred
+        ),
+    )
+    return [app for app in installed_apps if app not in deferred], rest_framework
@@ -0,0 +1,72 @@
+"""
+Read-replica routing.
+
+Reads go to a replica only inside a block marked with ``replica_reads`` (set
+by ReadReplicaMixin and the async read views for safe requests); everything
+else, including all writes, uses the primary. A user who has just written is
+"pinned" to the primary for READ_REPLICAS['STICKY_SECONDS'] so they always
+see their own changes despite replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_aliases():
+    return settings.READ_REPLICAS['ALIASES']
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Route reads in the block to a replica (or, with enabled=False, back to the primary)"""
+    token = _use_replica.set(enabled and bool(replica_aliases()))
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def primary_reads():
+    """For loaders whose results are cached, so stale replica rows are never stored"""
+    return replica_reads(enabled=False)
+
+
+def _pin_key(user_id):
+    return f'db-pinned:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send the user's reads to the primary until replicas have caught up with a write"""
+    if replica_aliases() and user_id is not None:
+        cache.set(_pin_key(user_id), True, settings.READ_REPLICAS['STICKY_SECONDS'])
+
+
+def is_pinned(user_id):
+    return bool(cache.get(_pin_key(user_id)))
+
+
+async def ais_pinned(user_id):
+    return bool(await cache.aget(_pin_key(user_id)))
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _use_replica.get():
+            return random.choice(replica_aliases())
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema through replication
+        return db not in replica_aliases()
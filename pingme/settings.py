@@ -25,6 +25,7 @@ ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '').split(',')
 # Application definition
 
 INSTALLED_APPS = [
+    'daphne',
     'jazzmin',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -34,9 +35,11 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     
     # Third-party apps
+    'channels',
     'rest_framework',
     'rest_framework.authtoken',
     'rest_framework_simplejwt',
+    'rest_framework_simplejwt.token_blacklist',
     'drf_spectacular',
     'drf_spectacular_sidecar',  # optional, for Swagger UI assets
     'django_filters',
@@ -46,16 +49,22 @@ INSTALLED_APPS = [
     'api',
     'chat',
     'notification',
+    'task',
+    'sync',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # gzip/Brotli: listed early so it compresses after the others changed the body
+    'pingme.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last: runs flagged DRF views of staff users under a profiler
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'pingme.urls'
@@ -76,17 +85,49 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'pingme.wsgi.application'
+ASGI_APPLICATION = 'pingme.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# DB_PROFILE is 'sqlite' (default), 'sqlite-tuned' or 'postgres', see
+# pingme/database.py. Compare them with `python manage.py bench_db_writes`.
+from pingme.database import database_config, located_config, replica_config
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(os.getenv('DB_PROFILE', 'sqlite'), BASE_DIR / 'db.sqlite3'),
+}
+
+# Read replicas: DB_REPLICAS is a comma separated list of SQLite files (kept
+# in sync locally by `python manage.py replicate_sqlite`) or Postgres hosts.
+# Safe viewset actions read from them, except for users who wrote within the
+# last STICKY_SECONDS, see pingme/routers.py
+READ_REPLICAS = {
+    'ALIASES': [],
+    'STICKY_SECONDS': int(os.getenv('DB_REPLICA_STICKY_SECONDS', '10')),
+}
+for index, location in enumerate(filter(None, os.getenv('DB_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{index}'] = replica_config(DATABASES['default'], location)
+    READ_REPLICAS['ALIASES'].append(f'replica{index}')
+
+# Sharding: DB_SHARDS is a comma separated list of SQLite files or Postgres
+# hosts. Conversations and their memberships, messages and archives are
+# spread over them by conversation id; users and everything else stay on
+# `default`. The number of shards must not change once data exists, see
+# chat/sharding.py
+CHAT_SHARDS = {
+    'ALIASES': [],
+    # Conversation ids reserved per process and round trip to `default`
+    'ID_BLOCK_SIZE': int(os.getenv('CHAT_SHARD_ID_BLOCK_SIZE', '100')),
+    # Lease on a message id worker number, renewed by the process using it
+    'WORKER_LEASE_SECONDS': int(os.getenv('CHAT_SHARD_WORKER_LEASE_SECONDS', '300')),
 }
+for index, location in enumerate(filter(None, os.getenv('DB_SHARDS', '').split(','))):
+    DATABASES[f'shard{index}'] = located_config(DATABASES['default'], location)
+    CHAT_SHARDS['ALIASES'].append(f'shard{index}')
+
+DATABASE_ROUTERS = ['chat.sharding.ShardRouter', 'pingme.routers.ReplicaRouter']
 
 
 # Password validation
@@ -109,9 +150,20 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTHENTICATION_BACKENDS = [
     'user.backends.EmailOrUsernameModelBackend',
-    'django.contrib.auth.backends.ModelBackend',
 ]
 
+PASSWORD_HASHERS = [
+    'user.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 work factor; unset keeps Django's default. Size it with
+# `python manage.py bench_password_hasher`.
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', '0')) or None
+
 AUTH_USER_MODEL = 'user.User'
 
 # Internationalization
@@ -126,6 +178,148 @@ USE_I18N = True
 USE_TZ = True
 
 
+# Cache
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Channels
+# https://channels.readthedocs.io/en/latest/topics/channel_layers.html
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
+# WebSockets (/ws/chat/, see pingme/asgi.py) authenticate with the session
+# cookie. Browsers cannot set an Authorization header on a WebSocket, so API
+# clients may instead pass their access token as ?token=; URLs end up in
+# proxy and server logs, so deployments that only use sessions turn it off.
+WEBSOCKET_QUERY_TOKEN = os.getenv('WEBSOCKET_QUERY_TOKEN', '1') == '1'
+
+# `python -m pingme.launcher`: WORKERS daphne processes share the port. On
+# SIGTERM they stop accepting and ask WebSocket clients to reconnect after a
+# random delay of up to RECONNECT_SPREAD_MS, so a deploy does not cause a
+# reconnect storm; workers still busy after DRAIN_TIMEOUT seconds are killed.
+# Without REDIS_URL the channel layer and caches live in each process, so
+# sockets on different workers could not reach each other: one worker then.
+LAUNCHER = {
+    'WORKERS': int(os.getenv('WEB_CONCURRENCY', '0')) or (os.cpu_count() if REDIS_URL else 1) or 1,
+    'DRAIN_TIMEOUT': int(os.getenv('LAUNCHER_DRAIN_TIMEOUT', '30')),
+    'RECONNECT_SPREAD_MS': int(os.getenv('LAUNCHER_RECONNECT_SPREAD_MS', '10000')),
+}
+
+# Authenticated users are cached per process for LOCAL_TTL seconds and in the
+# shared cache for SHARED_TTL seconds, see user/cache.py
+USER_CACHE = {
+    'LOCAL_TTL': int(os.getenv('USER_CACHE_LOCAL_TTL', '5')),
+    'SHARED_TTL': int(os.getenv('USER_CACHE_SHARED_TTL', '300')),
+    # How often each process checks for users changed elsewhere, in seconds
+    'GENERATION_POLL': float(os.getenv('USER_CACHE_GENERATION_POLL', '1')),
+}
+
+# Conversation member sets used for fan-out and permission checks, see
+# chat/membership.py
+MEMBERSHIP_CACHE = {
+    'LOCAL_TTL': int(os.getenv('MEMBERSHIP_CACHE_LOCAL_TTL', '5')),
+    'SHARED_TTL': int(os.getenv('MEMBERSHIP_CACHE_SHARED_TTL', '300')),
+}
+
+# Notification outbox: events younger than SETTLE_SECONDS wait so bursts are
+# coalesced, see notification/delivery.py
+NOTIFICATIONS = {
+    'SETTLE_SECONDS': float(os.getenv('NOTIFICATION_SETTLE_SECONDS', '2')),
+    'BATCH_SIZE': int(os.getenv('NOTIFICATION_BATCH_SIZE', '500')),
+}
+
+# Background tasks, run with `python manage.py run_tasks`. Workers heartbeat
+# their running tasks every 30 seconds; a task without a heartbeat for
+# VISIBILITY_TIMEOUT seconds is assumed lost and queued again. Finished tasks
+# are kept for RESULT_TTL seconds.
+TASKS = {
+    'VISIBILITY_TIMEOUT': int(os.getenv('TASK_VISIBILITY_TIMEOUT', '600')),
+    'RESULT_TTL': int(os.getenv('TASK_RESULT_TTL', '86400')),
+}
+
+# Messages older than AFTER_DAYS (or Conversation.retention_days) are moved
+# into compressed monthly segments by `python manage.py archive_messages`,
+# after which history only reaches them with ?month=. Opt-in: the default 0
+# archives only conversations with their own retention_days. BATCH_SIZE rows
+# are read and deleted per query.
+CHAT_ARCHIVE = {
+    'AFTER_DAYS': int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '0')),
+    'BATCH_SIZE': int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '5000')),
+}
+
+# Delta sync (api/sync/): at most PAGE_SIZE change log entries per response;
+# entries are kept RETENTION_DAYS, older tokens get a full reload.
+SYNC = {
+    'PAGE_SIZE': int(os.getenv('SYNC_PAGE_SIZE', '500')),
+    'RETENTION_DAYS': int(os.getenv('SYNC_RETENTION_DAYS', '30')),
+}
+
+# People search (auth/users/search/): PAGE_SIZE results per page, ranked from
+# at most CANDIDATES index rows per query; trigram matches need at least
+# TRIGRAM_SIMILARITY of the query's trigrams and read at most TRIGRAM_ROWS
+# users per trigram. Contacts are the members of 1:1 conversations and groups
+# of up to CONTACT_GROUP_SIZE, at most CONTACTS of them, see user/search.py
+USER_SEARCH = {
+    'PAGE_SIZE': int(os.getenv('USER_SEARCH_PAGE_SIZE', '20')),
+    'CANDIDATES': int(os.getenv('USER_SEARCH_CANDIDATES', '1000')),
+    'TRIGRAM_SIMILARITY': float(os.getenv('USER_SEARCH_TRIGRAM_SIMILARITY', '0.3')),
+    'TRIGRAM_ROWS': int(os.getenv('USER_SEARCH_TRIGRAM_ROWS', '2000')),
+    'CONTACT_GROUP_SIZE': int(os.getenv('USER_SEARCH_CONTACT_GROUP_SIZE', '50')),
+    'CONTACTS': int(os.getenv('USER_SEARCH_CONTACTS', '1000')),
+}
+
+# Prebuilt OpenAPI schema (api/schema/): `manage.py build_schema` writes it to
+# ARTIFACT_DIR, otherwise the first request builds it. An artifact belongs to
+# one CODE_VERSION (e.g. the git revision at deploy); when unset, a hash of
+# the sources is used so code changes still get a fresh schema.
+OPENAPI_SCHEMA = {
+    'ARTIFACT_DIR': Path(os.getenv('OPENAPI_SCHEMA_DIR', BASE_DIR / 'build' / 'schema')),
+    'CODE_VERSION': os.getenv('CODE_VERSION', ''),
+}
+
+# Request profiling on demand (api/profiling.py): a staff user's DRF request
+# with an X-Profile header or ?profile=, or WebSocket frame with "profile",
+# is profiled and stored for the admin. TOP_FUNCTIONS lines of profile and at
+# most MAX_QUERIES queries are kept, with placeholders instead of their
+# parameters; `sample` takes a stack every SAMPLE_INTERVAL_MS instead of
+# tracing every call. Paths under EXCLUDED_PATHS (logins, tokens, passwords)
+# are never profiled.
+PROFILING = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'True').lower() == 'true',
+    'SAMPLE_INTERVAL_MS': float(os.getenv('PROFILING_SAMPLE_INTERVAL_MS', '2')),
+    'TOP_FUNCTIONS': int(os.getenv('PROFILING_TOP_FUNCTIONS', '80')),
+    'MAX_QUERIES': int(os.getenv('PROFILING_MAX_QUERIES', '1000')),
+    'EXCLUDED_PATHS': ['/auth/'],
+}
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/6.0/howto/static-files/
 
@@ -149,7 +343,7 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.CachedJWTAuthentication',
     ),
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.IsAuthenticated",
@@ -163,6 +357,15 @@ REST_FRAMEWORK = {
     ),
 }
 
+# PINGME_ROLE: 'all' (default) serves everything; 'api' (HTTP API only) and
+# 'ws' (WebSockets only) leave out the admin, API docs and django-filter so
+# autoscaled workers start faster with less memory, see pingme/roles.py.
+# Compare them with `python manage.py bench_startup`.
+from pingme.roles import role_settings
+
+PINGME_ROLE = os.getenv('PINGME_ROLE', 'all')
+INSTALLED_APPS, REST_FRAMEWORK = role_settings(PINGME_ROLE, INSTALLED_APPS, REST_FRAMEWORK)
+
 
 # Spectacular settings
 SPECTACULAR_SETTINGS =  {
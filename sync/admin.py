@@ -0,0 +1,17 @@
+from django.contrib import admin
+
+from .models import Change
+
+
+@admin.register(Change)
+class ChangeAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'conversation_id', 'user_id', 'object_id', 'created_at']
+    list_filter = ['kind']
+    search_fields = ['=conversation_id', '=user_id']
+    list_per_page = 50
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,209 @@
+"""
+The change log behind delta sync: entries are recorded as chat and profile
+rows change, then replayed for one user from the token their client holds.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, router, transaction
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from chat.models import Conversation, Membership, Message
+from chat.sharding import scatter
+from sync.models import Change
+
+User = get_user_model()
+
+MEMBERSHIP_KINDS = ('membership', 'membership_deleted')
+
+
+def record(using, *changes):
+    """
+    Save ``changes`` (unsaved Change instances) once the transaction on
+    ``using`` commits, so an entry is never visible before the row it
+    describes.
+    """
+    if changes:
+        transaction.on_commit(partial(write_changes, changes), using=using)
+
+
+def write_changes(changes):
+    """
+    Insert log entries so that ids become visible in increasing order: a
+    client holding token N must never see an entry below N appear later.
+    SQLite has a single writer; PostgreSQL draws ids from a sequence when a
+    row is inserted, so two concurrent transactions could commit out of id
+    order. A table lock taken before the insert lets one log write run at a
+    time (reads are not blocked), which makes ids follow commit order.
+    """
+    using = router.db_for_write(Change)
+    with transaction.atomic(using=using):
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            table = connection.ops.quote_name(Change._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+        Change.objects.using(using).bulk_create(changes)
+
+
+def parse_token(value):
+    """Sequence number in a client token, or None when malformed"""
+    try:
+        since = int(value)
+    except (TypeError, ValueError):
+        return None
+    return since if since >= 0 else None
+
+
+def latest_sequence():
+    return Change.objects.aggregate(last=Max('id'))['last'] or 0
+
+
+def latest_change(conversation_id):
+    """``(id, created_at)`` of the conversation's newest entry, a version for conditional requests"""
+    return (
+        Change.objects.filter(conversation_id=conversation_id)
+        .order_by('-id').values_list('id', 'created_at').first()
+    ) or (0, None)
+
+
+def is_expired(since):
+    """
+    Entries after ``since`` are no longer all in the log (purged, or the token
+    comes from another database), so the client has to reload everything.
+    """
+    bounds = Change.objects.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['last'] is None:
+        return since != 0
+    return since > bounds['last'] or since < bounds['first'] - 1
+
+
+def purge_changes(retention_days=None):
+    """Delete entries past retention; the newest is always kept as the log's high-water mark"""
+    retention_days = retention_days or settings.SYNC['RETENTION_DAYS']
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    newest = latest_sequence()
+    deleted, _ = Change.objects.filter(created_at__lt=cutoff, id__lt=newest).delete()
+    return deleted
+
+
+def visible_changes(user, since, until):
+    """Entries in (since, until] that concern ``user``, oldest first"""
+    conversation_ids = list(
+        scatter(Membership.objects.filter(user_id=user.pk).values_list('conversation_id', flat=True))
+    )
+    contact_ids = set(
+        Membership.objects.filter(conversation_id__in=conversation_ids).values_list('user_id', flat=True)
+    )
+    contact_ids.add(user.pk)
+    return (
+        Change.objects
+        .filter(id__gt=since, id__lte=until)
+        .filter(
+            Q(conversation_id__in=conversation_ids)
+            # Joining and leaving, including conversations the user is no longer in
+            | Q(user_id=user.pk, kind__in=MEMBERSHIP_KINDS)
+            | Q(kind='user', user_id__in=contact_ids)
+        )
+        .order_by('id')
+    )
+
+
+def delta(user, since, limit=None):
+    """
+    Everything that changed for ``user`` after ``since``, folded so each object
+    appears once in its latest state. Returns a dict shaped like
+    DeltaSerializer; ``has_more`` means the client should sync again right away.
+    """
+    limit = limit or settings.SYNC['PAGE_SIZE']
+    latest = latest_sequence()
+    if is_expired(since):
+        return empty_delta(latest, reset=True)
+
+    entries = list(visible_changes(user, since, latest)[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # Later entries overwrite earlier ones: True while the object exists
+    conversations = {}
+    messages = {}
+    message_conversations = {}
+    reads = []
+    user_ids = set()
+    for entry in entries:
+        if entry.kind in ('message', 'message_deleted'):
+            messages[entry.object_id] = entry.kind == 'message'
+            message_conversations[entry.object_id] = entry.conversation_id
+        elif entry.kind == 'read':
+            reads.append({'conversation': entry.conversation_id, 'reader': entry.user_id, 'up_to': entry.object_id})
+        elif entry.kind == 'user':
+            user_ids.add(entry.user_id)
+        else:
+            conversations[entry.conversation_id] = not (
+                entry.kind == 'membership_deleted' and entry.user_id == user.pk
+            )
+
+    changed_conversations = load_conversations(
+        [conversation_id for conversation_id, exists in conversations.items() if exists]
+    )
+    message_ids = [message_id for message_id, exists in messages.items() if exists]
+    changed_messages = sorted(
+        Message.objects.filter(
+            conversation_id__in={message_conversations[message_id] for message_id in message_ids},
+            pk__in=message_ids,
+        ),
+        key=lambda message: message.pk,
+    ) if message_ids else []
+
+    found = {conversation.pk for conversation in changed_conversations}
+    return {
+        # Without entries for this user the token still moves up to ``latest``,
+        # so the next sync does not scan the same range again
+        'token': str(entries[-1].id if has_more else latest),
+        'reset': False,
+        'has_more': has_more,
+        'conversations': changed_conversations,
+        # Left, or deleted (the row is gone even though the entry said it changed)
+        'removed_conversations': [
+            conversation_id for conversation_id, exists in conversations.items()
+            if not exists or conversation_id not in found
+        ],
+        'messages': changed_messages,
+        # Rows missing from ``changed_messages`` were archived, not deleted
+        'deleted_messages': [message_id for message_id, exists in messages.items() if not exists],
+        'reads': reads,
+        'users': list(User.objects.filter(pk__in=user_ids)) if user_ids else [],
+    }
+
+
+def empty_delta(latest, reset=False):
+    return {
+        'token': str(latest),
+        'reset': reset,
+        'has_more': False,
+        'conversations': [],
+        'removed_conversations': [],
+        'messages': [],
+        'deleted_messages': [],
+        'reads': [],
+        'users': [],
+    }
+
+
+def load_conversations(conversation_ids):
+    """Conversations with ``participant_ids`` set from one membership query per shard"""
+    if not conversation_ids:
+        return []
+    members = defaultdict(list)
+    for conversation_id, user_id in (
+        Membership.objects.filter(conversation_id__in=conversation_ids).values_list('conversation_id', 'user_id')
+    ):
+        members[conversation_id].append(user_id)
+    conversations = sorted(Conversation.objects.filter(pk__in=conversation_ids), key=lambda c: c.pk)
+    for conversation in conversations:
+        conversation.participant_ids = sorted(members[conversation.pk])
+    return conversations
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('message', 'Message created or edited'), ('message_deleted', 'Message deleted'), ('conversation', 'Conversation changed'), ('membership', 'Member joined'), ('membership_deleted', 'Member left'), ('read', 'Messages read'), ('user', 'Profile changed')], max_length=20)),
+                ('conversation_id', models.BigIntegerField(blank=True, null=True)),
+                ('user_id', models.BigIntegerField(blank=True, null=True)),
+                ('object_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation_id', 'id'], name='sync_change_conversation_idx'), models.Index(fields=['user_id', 'id'], name='sync_change_user_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+from django.db import models
+
+
+class Change(models.Model):
+    """
+    One entry of the change log replayed by delta sync. The id is the sync
+    sequence: a client's token is the id of the last entry it has seen, and
+    entries become visible in id order (see sync.changes.write_changes).
+
+    Entries hold plain ids rather than foreign keys so tombstones outlive the
+    rows they describe, and so they can point at sharded chat tables.
+    """
+    KIND_CHOICES = [
+        ('message', 'Message created or edited'),
+        ('message_deleted', 'Message deleted'),
+        ('conversation', 'Conversation changed'),
+        ('membership', 'Member joined'),
+        ('membership_deleted', 'Member left'),
+        ('read', 'Messages read'),
+        ('user', 'Profile changed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    conversation_id = models.BigIntegerField(null=True, blank=True)
+    user_id = models.BigIntegerField(null=True, blank=True)
+    # The message for message kinds, the last message read for 'read'
+    object_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation_id', 'id'], name='sync_change_conversation_idx'),
+            models.Index(fields=['user_id', 'id'], name='sync_change_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.id} {self.kind}'
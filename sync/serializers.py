@@ -0,0 +1,34 @@
+from rest_framework import serializers
+
+from chat.models import Conversation
+from chat.serializers import CompactMessageSerializer
+from user.serializers import UserProfileSerializer
+
+
+class SyncConversationSerializer(serializers.ModelSerializer):
+    participants = serializers.ListField(
+        source='participant_ids', child=serializers.IntegerField(), read_only=True
+    )
+
+    class Meta:
+        model = Conversation
+        fields = ['id', 'participants', 'created_at', 'updated_at', 'is_group',
+                  'group_name', 'group_admin', 'retention_days']
+
+
+class ReadSerializer(serializers.Serializer):
+    conversation = serializers.IntegerField()
+    reader = serializers.IntegerField()
+    up_to = serializers.IntegerField(allow_null=True, help_text='Last message read, null for all of them')
+
+
+class DeltaSerializer(serializers.Serializer):
+    token = serializers.CharField(help_text='Pass as ?since= on the next sync')
+    reset = serializers.BooleanField(help_text='The token has expired: reload everything, then sync from token')
+    has_more = serializers.BooleanField(help_text='More changes are waiting; sync again right away')
+    conversations = SyncConversationSerializer(many=True)
+    removed_conversations = serializers.ListField(child=serializers.IntegerField())
+    messages = CompactMessageSerializer(many=True)
+    deleted_messages = serializers.ListField(child=serializers.IntegerField())
+    reads = ReadSerializer(many=True)
+    users = UserProfileSerializer(many=True)
@@ -0,0 +1,119 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from chat.archive import is_archiving
+from chat.models import Conversation, Membership, Message
+from chat.sharding import scatter
+from chat.signals import chat_rows_updated, messages_read
+from sync.changes import record
+from sync.models import Change
+
+User = get_user_model()
+
+# Saves touching only these fields (last_login, presence) are not profile changes
+UNSYNCED_USER_FIELDS = {'last_login', 'is_online', 'last_seen', 'password'}
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, using, **kwargs):
+    record(using, Change(
+        kind='message', conversation_id=instance.conversation_id, object_id=instance.pk,
+    ))
+
+
+@receiver(post_delete, sender=Message)
+def message_deleted(sender, instance, using, origin=None, **kwargs):
+    if is_archiving() or isinstance(origin, Conversation):
+        # Archived rows still exist; a deleted conversation is reported through
+        # its memberships
+        return
+    record(using, Change(
+        kind='message_deleted', conversation_id=instance.conversation_id, object_id=instance.pk,
+    ))
+
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, using, **kwargs):
+    record(using, Change(kind='conversation', conversation_id=instance.pk))
+
+
+@receiver(post_save, sender=Membership)
+def membership_saved(sender, instance, using, created, **kwargs):
+    if created:
+        record(using, Change(
+            kind='membership', conversation_id=instance.conversation_id, user_id=instance.user_id,
+        ))
+
+
+@receiver(post_delete, sender=Membership)
+def membership_deleted(sender, instance, using, **kwargs):
+    # Carries the user so they see the removal once the conversation is no longer theirs
+    record(using, Change(
+        kind='membership_deleted', conversation_id=instance.conversation_id, user_id=instance.user_id,
+    ))
+
+
+@receiver(m2m_changed, sender=Membership)
+def participants_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    """``conversation.participants`` and ``user.conversations`` add/remove/clear"""
+    if action == 'pre_clear':
+        if reverse:
+            instance._sync_cleared_ids = list(
+                scatter(Membership.objects.filter(user_id=instance.pk).values_list('conversation_id', flat=True))
+            )
+        else:
+            instance._sync_cleared_ids = list(
+                Membership.objects.filter(conversation_id=instance.pk).values_list('user_id', flat=True)
+            )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    kind = 'membership' if action == 'post_add' else 'membership_deleted'
+    other_ids = getattr(instance, '_sync_cleared_ids', []) if action == 'post_clear' else pk_set or []
+    record(using, *[
+        Change(kind=kind, conversation_id=other_id, user_id=instance.pk) if reverse
+        else Change(kind=kind, conversation_id=instance.pk, user_id=other_id)
+        for other_id in other_ids
+    ])
+
+
+@receiver(messages_read)
+def read_marked(sender, conversation_id, reader_id, up_to, **kwargs):
+    record(
+        Message.objects.filter(conversation_id=conversation_id).db,
+        Change(kind='read', conversation_id=conversation_id, user_id=reader_id, object_id=up_to),
+    )
+
+
+@receiver(chat_rows_updated)
+def chat_rows_updated_in_bulk(sender, messages, conversation_ids, **kwargs):
+    for conversation_id, message_ids in messages.items():
+        record(Message.objects.filter(conversation_id=conversation_id).db, *[
+            Change(kind='message', conversation_id=conversation_id, object_id=message_id)
+            for message_id in message_ids
+        ])
+    for conversation_id in conversation_ids:
+        record(
+            Conversation.objects.filter(pk=conversation_id).db,
+            Change(kind='conversation', conversation_id=conversation_id),
+        )
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, using, **kwargs):
+    """Conversations the user administers lose their admin through an update, not a save"""
+    record(using, *[
+        Change(kind='conversation', conversation_id=conversation_id)
+        for conversation_id in scatter(
+            Conversation.objects.filter(group_admin_id=instance.pk).values_list('pk', flat=True)
+        )
+    ])
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, using, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= UNSYNCED_USER_FIELDS:
+        return
+    record(using, Change(kind='user', user_id=instance.pk))
+
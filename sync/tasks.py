@@ -0,0 +1,11 @@
+from datetime import timedelta
+
+from task.registry import periodic_task
+
+from .changes import purge_changes
+
+
+@periodic_task(every=timedelta(hours=1))
+def purge_old_changes():
+    """Drop change log entries older than SYNC['RETENTION_DAYS']"""
+    purge_changes()
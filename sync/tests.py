@@ -0,0 +1,82 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from chat.admin import MessageAdmin
+from chat.models import Conversation, Message
+from sync.changes import delta, latest_sequence
+from sync.models import Change
+
+User = get_user_model()
+
+
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', email='alice@example.com', password='pw')
+        self.bob = User.objects.create_user(username='bob', email='bob@example.com', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.conversation = Conversation.objects.create()
+            self.conversation.participants.set([self.alice, self.bob])
+
+    def sync(self, since):
+        response = self.client.get('/api/sync/', {'since': since})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_token_replays_only_later_changes(self):
+        token = self.client.get('/api/sync/').json()['token']
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(conversation=self.conversation, sender=self.alice, content='hi')
+
+        result = self.sync(token)
+        self.assertFalse(result['reset'])
+        self.assertEqual([m['id'] for m in result['messages']], [message.pk])
+        self.assertEqual(int(result['token']), latest_sequence())
+        self.assertEqual(self.sync(result['token'])['messages'], [])
+
+    def test_deletes_and_paging(self):
+        token = latest_sequence()
+        with self.captureOnCommitCallbacks(execute=True):
+            messages = [
+                Message.objects.create(conversation=self.conversation, sender=self.alice, content=str(i))
+                for i in range(3)
+            ]
+            deleted_id = messages[0].pk
+            messages[0].delete()
+
+        first = delta(self.bob, token, limit=2)
+        self.assertTrue(first['has_more'])
+        self.assertEqual([m.pk for m in first['messages']], [messages[1].pk])
+        self.assertEqual(first['deleted_messages'], [])
+        rest = delta(self.bob, int(first['token']), limit=2)
+        self.assertFalse(rest['has_more'])
+        self.assertEqual([m.pk for m in rest['messages']], [messages[2].pk])
+        self.assertEqual(rest['deleted_messages'], [deleted_id])
+
+    def test_other_users_changes_are_not_visible(self):
+        carol = User.objects.create_user(username='carol', email='carol@example.com', password='pw')
+        token = latest_sequence()
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Conversation.objects.create()
+            other.participants.set([self.alice, carol])
+            Message.objects.create(conversation=other, sender=carol, content='private')
+        result = self.sync(token)
+        self.assertEqual(result['messages'], [])
+        self.assertEqual(result['conversations'], [])
+
+    def test_expired_and_invalid_tokens(self):
+        self.assertTrue(self.sync(latest_sequence() + 100)['reset'])
+        response = self.client.get('/api/sync/', {'since': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_queryset_updates_are_logged(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(conversation=self.conversation, sender=self.alice, content='hi')
+        token = latest_sequence()
+        with self.captureOnCommitCallbacks(execute=True):
+            MessageAdmin.update_read_state(None, Message.objects.filter(pk=message.pk), read=True)
+        self.assertTrue(Change.objects.filter(id__gt=token, kind='message', object_id=message.pk).exists())
+        result = self.sync(token)
+        self.assertEqual([(m['id'], m['is_read']) for m in result['messages']], [(message.pk, True)])
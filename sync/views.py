@@ -0,0 +1,32 @@
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from rest_framework import status
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from sync.changes import delta, empty_delta, latest_sequence, parse_token
+from sync.serializers import DeltaSerializer
+
+
+@extend_schema(tags=['Sync'])
+class SyncView(APIView):
+    """
+    Delta sync for mobile clients. Without ``since`` the response only carries
+    a token (with ``reset`` set): load the inbox as usual, then keep calling
+    with ``?since=<token>`` to receive what changed in between.
+    """
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(
+        parameters=[OpenApiParameter('since', OpenApiTypes.STR, description='Token from the previous sync')],
+        responses=DeltaSerializer,
+    )
+    def get(self, request):
+        token = request.query_params.get('since')
+        if token is None:
+            return Response(DeltaSerializer(empty_delta(latest_sequence(), reset=True)).data)
+        since = parse_token(token)
+        if since is None:
+            return Response({'since': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(DeltaSerializer(delta(request.user, since)).data)
@@ -0,0 +1,22 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from .models import Task
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['id', 'name', 'status', 'attempts', 'run_at', 'finished_at']
+    list_filter = ['status', 'name']
+    search_fields = ['name']
+    readonly_fields = ['created_at', 'started_at', 'finished_at', 'claimed_by', 'last_error']
+    list_per_page = 50
+    actions = ['retry']
+    
+    def retry(self, request, queryset):
+        """Admin action to queue failed tasks again"""
+        updated = queryset.filter(status='failed').update(
+            status='pending', attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'{updated} task(s) queued again.')
+    retry.short_description = "Retry selected failed tasks"
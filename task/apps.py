@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class TaskConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'task'
+
+    def ready(self):
+        from django.utils.module_loading import autodiscover_modules
+
+        # Register the @task functions declared in each app's tasks.py
+        autodiscover_modules('tasks')
@@ -0,0 +1,98 @@
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from task.metrics import task_metrics
+from task.runner import init_process, run_task
+from task.worker import claim, heartbeat, purge_finished, requeue_stale, schedule_periodic
+
+logger = logging.getLogger(__name__)
+
+MAINTENANCE_INTERVAL = 30
+STATS_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks in a pool of worker processes (no broker needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue polls when idle')
+        parser.add_argument('--once', action='store_true', help='Run everything currently due, then exit')
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_process,
+        )
+        inflight = {}
+        last_maintenance = last_stats = 0.0
+        completed = failed = 0
+        self.stdout.write(f'Task worker started with {processes} process(es)')
+
+        try:
+            while True:
+                now = time.monotonic()
+                if now - last_maintenance >= MAINTENANCE_INTERVAL:
+                    # Also while draining, so running tasks are not handed out again
+                    heartbeat(list(inflight.values()))
+                    if not self.stopping:
+                        requeue_stale()
+                        purge_finished()
+                    last_maintenance = now
+                if not self.stopping:
+                    schedule_periodic()
+
+                claimed = []
+                if not self.stopping:
+                    # Keep every process busy plus one task queued behind it
+                    claimed = claim(processes * 2 - len(inflight))
+                    for task_id in claimed:
+                        inflight[pool.submit(run_task, task_id)] = task_id
+                # Don't hold a connection open while idling
+                connections.close_all()
+
+                if inflight:
+                    done, _ = wait(inflight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task_id = inflight.pop(future)
+                        try:
+                            status = future.result()
+                        except Exception:
+                            logger.exception('Worker process crashed running task #%s', task_id)
+                            status = 'failed'
+                        if status == 'done':
+                            completed += 1
+                        elif status == 'failed':
+                            failed += 1
+                elif self.stopping or (options['once'] and not claimed):
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+                if time.monotonic() - last_stats >= STATS_INTERVAL:
+                    metrics = task_metrics()
+                    self.stdout.write(
+                        f'completed={completed} failed={failed} '
+                        f'depth={metrics["queue_depth"]} oldest_due={metrics["oldest_due_seconds"]:.1f}s'
+                    )
+                    last_stats = time.monotonic()
+        finally:
+            pool.shutdown(wait=True)
+        self.stdout.write(f'Task worker stopped: {completed} completed, {failed} failed')
+
+    def stop(self, signum, frame):
+        # Finish in-flight tasks, stop claiming new ones
+        self.stopping = True
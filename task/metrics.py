@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from task.models import Task
+
+
+def task_metrics(window=60):
+    """Queue depth per status and completions over the last ``window`` seconds"""
+    now = timezone.now()
+    depth = dict(
+        Task.objects.values_list('status').annotate(total=Count('id')).order_by()
+    )
+    oldest_due = (
+        Task.objects.filter(status='pending', run_at__lte=now)
+        .aggregate(oldest=Min('run_at'))['oldest']
+    )
+    since = now - timedelta(seconds=window)
+    finished = dict(
+        Task.objects.filter(status__in=['done', 'failed'], finished_at__gte=since)
+        .values_list('status').annotate(total=Count('id')).order_by()
+    )
+    return {
+        'queue_depth': {status: depth.get(status, 0) for status in ('pending', 'running', 'done', 'failed')},
+        'oldest_due_seconds': (now - oldest_due).total_seconds() if oldest_due else 0,
+        'window_seconds': window,
+        'completed': finished.get('done', 0),
+        'failed': finished.get('failed', 0),
+        'throughput_per_second': finished.get('done', 0) / window,
+    }
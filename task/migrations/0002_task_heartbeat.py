@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:58
+
+from django.db import migrations, models
+
+
+def start_heartbeats(apps, schema_editor):
+    # Tasks already running count from their start, as before
+    Task = apps.get_model('task', 'Task')
+    Task.objects.filter(status='running').update(heartbeat_at=models.F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_heartbeats, migrations.RunPython.noop),
+    ]
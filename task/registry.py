@@ -0,0 +1,63 @@
+"""``@task`` / ``@periodic_task`` decorators and the registry the worker runs from."""
+from datetime import timedelta
+
+from django.utils import timezone
+
+registry = {}
+periodic = {}
+
+
+class TaskFunction:
+    """Wraps a function so it can be queued with ``.delay()`` or ``.schedule()``"""
+
+    def __init__(self, func, name, max_attempts, retry_delay):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.__doc__ = func.__doc__
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def delay(self, *args, **kwargs):
+        """Queue the call to run as soon as a worker is free"""
+        return self.schedule(args=args, kwargs=kwargs)
+
+    def schedule(self, args=(), kwargs=None, countdown=None, eta=None):
+        """Queue the call to run after ``countdown`` seconds or at ``eta``"""
+        from task.models import Task
+
+        run_at = eta or timezone.now()
+        if countdown:
+            run_at += timedelta(seconds=countdown)
+        return Task.objects.create(
+            name=self.name,
+            args=list(args),
+            kwargs=kwargs or {},
+            max_attempts=self.max_attempts,
+            run_at=run_at,
+        )
+
+
+def task(name=None, max_attempts=3, retry_delay=10):
+    """
+    Register a function as a background task. Arguments must be JSON
+    serializable. Failed runs are retried with exponential backoff starting
+    at ``retry_delay`` seconds, up to ``max_attempts`` runs in total.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        wrapped = TaskFunction(func, task_name, max_attempts, retry_delay)
+        registry[task_name] = wrapped
+        return wrapped
+    return decorator
+
+
+def periodic_task(every, name=None, max_attempts=1):
+    """Register a task the worker re-queues every ``every`` (a timedelta)"""
+    def decorator(func):
+        wrapped = task(name=name, max_attempts=max_attempts)(func)
+        periodic[wrapped.name] = every
+        return wrapped
+    return decorator
@@ -0,0 +1,16 @@
+"""
+Entry points for worker child processes. Children are spawned fresh, so
+nothing Django-related may be imported at module level here.
+"""
+
+
+def init_process():
+    import django
+
+    django.setup()
+
+
+def run_task(task_id):
+    from task.worker import execute
+
+    return execute(task_id)
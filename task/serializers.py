@@ -0,0 +1,17 @@
+from rest_framework import serializers
+
+
+class QueueDepthSerializer(serializers.Serializer):
+    pending = serializers.IntegerField()
+    running = serializers.IntegerField()
+    done = serializers.IntegerField()
+    failed = serializers.IntegerField()
+
+
+class TaskMetricsSerializer(serializers.Serializer):
+    queue_depth = QueueDepthSerializer(help_text='Tasks per status')
+    oldest_due_seconds = serializers.FloatField(help_text='How long the oldest due task has been waiting')
+    window_seconds = serializers.IntegerField()
+    completed = serializers.IntegerField(help_text='Tasks done within the window')
+    failed = serializers.IntegerField(help_text='Tasks that failed for good within the window')
+    throughput_per_second = serializers.FloatField()
@@ -0,0 +1,71 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from task.models import Task
+from task.registry import task
+from task.worker import claim, execute, heartbeat, requeue_stale
+
+calls = []
+
+
+@task(name='task.tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task(name='task.tests.stall')
+def stall():
+    """Runs past the visibility timeout without heartbeats"""
+    calls.append('stall')
+    Task.objects.filter(name='task.tests.stall').update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+    requeue_stale()
+
+
+@override_settings(TASKS={'VISIBILITY_TIMEOUT': 60, 'RESULT_TTL': 60})
+class WorkerTests(TestCase):
+    def setUp(self):
+        calls.clear()
+        record.delay('x')
+        [self.task_id] = claim(10)
+
+    def age(self, seconds):
+        Task.objects.filter(pk=self.task_id).update(heartbeat_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_heartbeat_keeps_long_tasks_claimed(self):
+        self.age(120)
+        heartbeat([self.task_id])
+        self.assertEqual(requeue_stale(), 0)
+        self.assertEqual(execute(self.task_id), 'done')
+
+    def test_requeued_run_does_not_record_its_outcome(self):
+        self.assertEqual(execute(self.task_id), 'done')
+        job = stall.delay()
+        [task_id] = claim(10)
+        self.assertEqual(execute(task_id), 'lost')
+        self.assertEqual(Task.objects.get(pk=job.pk).status, 'pending')
+        self.assertEqual(claim(10), [job.pk])
+
+    def test_requeued_task_is_not_started_by_its_old_worker(self):
+        self.age(120)
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(execute(self.task_id), 'lost')
+        self.assertEqual(calls, [])
+
+
+class TaskMetricsViewTests(TestCase):
+    def test_metrics_are_documented(self):
+        from drf_spectacular.settings import spectacular_settings
+
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=spectacular_settings.SERVE_URLCONF)
+        document = generator.get_schema(request=None, public=True)
+        response = document['paths']['/api/tasks/metrics/']['get']['responses']['200']
+        self.assertEqual(response['content']['application/json']['schema']['$ref'], '#/components/schemas/TaskMetrics')
+
+        staff = get_user_model().objects.create_user(username='staff', email='staff@example.com', password='pw', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+        self.assertEqual(client.get('/api/tasks/metrics/').json()['queue_depth']['pending'], 0)
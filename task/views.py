@@ -0,0 +1,17 @@
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from drf_spectacular.utils import extend_schema
+
+from task.metrics import task_metrics
+from task.serializers import TaskMetricsSerializer
+
+
+@extend_schema(tags=['Tasks'])
+class TaskMetricsView(APIView):
+    """Queue depth and throughput of the background task queue (staff only)"""
+    permission_classes = [IsAdminUser]
+    
+    @extend_schema(responses=TaskMetricsSerializer)
+    def get(self, request):
+        return Response(TaskMetricsSerializer(task_metrics()).data)
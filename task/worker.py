@@ -0,0 +1,113 @@
+"""Claiming, running and retrying queued tasks."""
+import logging
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from task.models import Task
+from task.registry import periodic, registry
+
+logger = logging.getLogger(__name__)
+
+
+def claim(limit):
+    """Atomically move up to ``limit`` due tasks to running and return their ids"""
+    now = timezone.now()
+    due = list(
+        Task.objects
+        .filter(status='pending', run_at__lte=now)
+        .order_by('run_at', 'id')
+        .values_list('id', flat=True)[:limit]
+    )
+    if not due:
+        return []
+    token = uuid.uuid4().hex
+    # Only rows still pending are taken, so concurrent workers never share a task
+    Task.objects.filter(id__in=due, status='pending').update(
+        status='running', started_at=now, heartbeat_at=now, claimed_by=token
+    )
+    return list(Task.objects.filter(claimed_by=token).values_list('id', flat=True))
+
+
+def heartbeat(task_ids):
+    """Tell ``requeue_stale`` the worker running these tasks is still alive"""
+    if task_ids:
+        Task.objects.filter(id__in=task_ids, status='running').update(heartbeat_at=timezone.now())
+
+
+def execute(task_id):
+    """
+    Run one claimed task and record the outcome; returns the final status, or
+    'lost' when the task was requeued in the meantime and its outcome dropped.
+    A worker that stops heartbeating can have its task run again elsewhere,
+    so tasks should be safe to run twice.
+    """
+    job = Task.objects.get(pk=task_id)
+    if job.status != 'running':
+        return 'lost'
+    claimed_by = job.claimed_by
+    func = registry.get(job.name)
+    job.attempts += 1
+    try:
+        if func is None:
+            raise LookupError(f'No task registered as {job.name!r}')
+        func(*job.args, **job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = (func.retry_delay if func else 10) * 2 ** (job.attempts - 1)
+            job.status = 'pending'
+            job.run_at = timezone.now() + timedelta(seconds=delay)
+        else:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        logger.warning('Task %s #%s failed (attempt %s)', job.name, job.pk, job.attempts)
+    else:
+        job.status = 'done'
+        job.finished_at = timezone.now()
+    # Only while the claim holds: a requeued run belongs to its new worker
+    recorded = Task.objects.filter(pk=job.pk, status='running', claimed_by=claimed_by).update(
+        status=job.status, attempts=job.attempts, run_at=job.run_at,
+        finished_at=job.finished_at, last_error=job.last_error,
+    )
+    if not recorded:
+        logger.warning('Task %s #%s was requeued while running; outcome dropped', job.name, job.pk)
+        return 'lost'
+    return job.status
+
+
+def requeue_stale():
+    """Give tasks whose worker stopped heartbeating back to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=settings.TASKS['VISIBILITY_TIMEOUT'])
+    return Task.objects.filter(status='running', heartbeat_at__lt=cutoff).update(
+        status='pending', claimed_by=''
+    )
+
+
+def schedule_periodic():
+    """Make sure every periodic task has exactly one queued or running instance"""
+    now = timezone.now()
+    for name, every in periodic.items():
+        active = Task.objects.filter(name=name, status__in=['pending', 'running'])
+        if active.exists():
+            continue
+        last = (
+            Task.objects.filter(name=name, finished_at__isnull=False)
+            .order_by('-finished_at')
+            .values_list('finished_at', flat=True)
+            .first()
+        )
+        registry[name].schedule(eta=max(now, last + every) if last else now)
+
+
+def purge_finished():
+    """Delete finished tasks older than TASKS['RESULT_TTL'] seconds"""
+    cutoff = timezone.now() - timedelta(seconds=settings.TASKS['RESULT_TTL'])
+    deleted, _ = Task.objects.filter(
+        Q(status='done') | Q(status='failed'), finished_at__lt=cutoff
+    ).delete()
+    return deleted
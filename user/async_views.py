@@ -0,0 +1,11 @@
+from api.views import AsyncAPIView
+
+from .serializers import UserProfileSerializer
+
+
+class AsyncUserProfileView(AsyncAPIView):
+    """Async profile of the authenticated user, served from the user cache"""
+    
+    async def get(self, request):
+        serializer = UserProfileSerializer(request.user, context={'request': request})
+        return self.render(serializer.data)
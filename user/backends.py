@@ -1,6 +1,8 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models.functions import Lower
+
+from .cache import get_cached_user
 
 User = get_user_model()
 
@@ -8,17 +10,43 @@ class EmailOrUsernameModelBackend(ModelBackend):
     """Authenticate using email or username"""
     
     def authenticate(self, request, username=None, password=None, **kwargs):
-        try:
-            user = User.objects.get(
-                Q(email=username) | Q(username=username)
-            )
-            if user.check_password(password):
-                return user
-        except User.DoesNotExist:
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        
+        user = self.get_login_user(username)
+        if user is None:
+            # Run the password hasher once so unknown and ambiguous logins
+            # take as long as a wrong password for an existing user
+            User().set_password(password)
             return None
+        
+        # check_password re-encodes the hash when the hasher settings changed
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+    
+    def get_login_user(self, identifier):
+        """
+        Resolve a login identifier through the lower-cased email and username
+        indexes. Returns None when nothing or more than one user matches.
+        """
+        value = identifier.strip().lower()
+        fields = ('email', 'username') if '@' in value else ('username',)
+        
+        for field in fields:
+            candidates = list(
+                User.objects.annotate(login_key=Lower(field)).filter(login_key=value)
+            )
+            if len(candidates) == 1:
+                return candidates[0]
+            if candidates:
+                # Legacy rows that only differ by case: trust an exact match only
+                exact = [user for user in candidates if getattr(user, field) == identifier]
+                return exact[0] if len(exact) == 1 else None
+        return None
     
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+        user = get_cached_user(user_id)
+        return user if self.user_can_authenticate(user) else None
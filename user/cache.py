@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from pingme.cache import TwoLevelCache
+
+User = get_user_model()
+
+_users = TwoLevelCache(
+    'auth-user-v2',
+    local_ttl=settings.USER_CACHE['LOCAL_TTL'],
+    shared_ttl=settings.USER_CACHE['SHARED_TTL'],
+    generation_poll=settings.USER_CACHE['GENERATION_POLL'],
+)
+
+
+def trim(user):
+    """
+    The user as it may be cached: the password hash is deferred (reading it
+    queries the database) and only its token revocation marker is kept, so
+    the shared cache never holds a hash.
+    """
+    if user is not None:
+        user.password_marker = get_md5_hash_password(user.password)
+        del user.__dict__['password']
+    return user
+
+
+def get_cached_user(user_id):
+    """Return the user with ``user_id`` from the cache, or ``None``"""
+    return _users.get(user_id, lambda: trim(User.objects.filter(pk=user_id).first()))
+
+
+async def aget_cached_user(user_id):
+    """Async variant of ``get_cached_user``"""
+    async def load():
+        return trim(await User.objects.filter(pk=user_id).afirst())
+    return await _users.aget(user_id, load)
+
+
+def invalidate_user(user_id):
+    """Drop a user from the shared cache and every process's local layer"""
+    _users.delete(user_id)
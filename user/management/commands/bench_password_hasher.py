@@ -0,0 +1,57 @@
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Benchmark password hashing at different work factors to size CPU for login bursts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations', type=int, nargs='+',
+            help='PBKDF2 iteration counts to measure (default: the configured one)',
+        )
+        parser.add_argument('--rounds', type=int, default=20, help='Hashes per work factor')
+        parser.add_argument(
+            '--burst', type=int, default=100,
+            help='Logins per second to size cores for',
+        )
+
+    def handle(self, *args, **options):
+        hasher = get_hasher()
+        iteration_counts = options['iterations'] or [hasher.iterations]
+        rounds = options['rounds']
+        burst = options['burst']
+        salt = hasher.salt()
+
+        self.stdout.write(
+            f'{hasher.algorithm}, {rounds} rounds, sizing for {burst} logins/s '
+            f'({os.cpu_count()} cores available)'
+        )
+        self.stdout.write(f'{"iterations":>12} {"median ms":>10} {"p95 ms":>8} {"logins/s/core":>14} {"cores":>6}')
+
+        for iterations in iteration_counts:
+            timings = []
+            for _ in range(rounds):
+                started = time.perf_counter()
+                hasher.encode('benchmark-password', salt, iterations)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            median = statistics.median(timings)
+            p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+            per_core = 1 / median
+            self.stdout.write(
+                f'{iterations:>12} {median * 1000:>10.1f} {p95 * 1000:>8.1f} '
+                f'{per_core:>14.1f} {burst / per_core:>6.1f}'
+            )
+
+        configured = settings.PASSWORD_HASH_ITERATIONS
+        self.stdout.write(
+            f'Set PASSWORD_HASH_ITERATIONS to change the work factor '
+            f'(currently {configured or "Django default"}); existing hashes are '
+            f'upgraded on the next successful login.'
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from user.models import User
+from user.search import reindex_users
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the people search index from the user table, in batches; '
+        'run once after deploying it, saves keep it up to date afterwards'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        columns = ['username', 'first_name', 'last_name', 'email']
+        last_pk = 0
+        total = 0
+        while True:
+            batch = list(User.objects.filter(pk__gt=last_pk).order_by('pk').only(*columns)[:options['batch_size']])
+            if not batch:
+                break
+            reindex_users(batch)
+            last_pk = batch[-1].pk
+            total += len(batch)
+            self.stdout.write(f'Indexed {total} users')
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {total} users'))
@@ -0,0 +1,76 @@
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+from .authentication import CachedJWTAuthentication
+from .cache import aget_cached_user
+
+
+class ConnectionUser:
+    """
+    What a WebSocket connection keeps of its authenticated user for its whole
+    lifetime: the id and the flags checked while it is open. A full ``User``
+    costs kilobytes per idle connection; ``aget()`` loads it (from the user
+    cache) when it is really needed.
+    """
+    __slots__ = ('id', 'is_staff')
+
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, is_staff=False):
+        self.id = id
+        self.is_staff = is_staff
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.pk, user.is_staff)
+
+    @property
+    def pk(self):
+        return self.id
+
+    async def aget(self):
+        """The full ``User``, or ``None`` if it was deleted since"""
+        return await aget_cached_user(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, ConnectionUser) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __repr__(self):
+        return f'<ConnectionUser {self.id}>'
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Channels middleware that authenticates WebSocket connections from a
+    ``?token=<access token>`` query parameter, since browsers cannot set an
+    Authorization header on WebSocket requests; ``scope['user']`` is then a
+    ``ConnectionUser``. Connections without a token go through
+    ``session_inner`` (the cookie and session stack wrapping ``inner``), so
+    token connections do not pay for sessions they never use.
+    """
+
+    def __init__(self, inner, session_inner=None):
+        super().__init__(inner)
+        self.session_inner = session_inner or inner
+
+    async def __call__(self, scope, receive, send):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if 'token' not in query:
+            return await self.session_inner(scope, receive, send)
+        scope = dict(scope, user=await self.get_user(query['token'][0]))
+        return await self.inner(scope, receive, send)
+
+    async def get_user(self, raw_token):
+        try:
+            user, _ = await CachedJWTAuthentication().aauthenticate_token(raw_token.encode())
+            return ConnectionUser.from_user(user)
+        except (InvalidToken, AuthenticationFailed):
+            return AnonymousUser()
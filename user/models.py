@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.db.models.functions import Lower
 from django.utils.translation import gettext_lazy as _
 
 class User(AbstractUser):    
@@ -23,10 +24,47 @@ class User(AbstractUser):
     class Meta:
         verbose_name = _('User')
         verbose_name_plural = _('Users')
+        indexes = [
+            # Case-insensitive login lookups, see user/backends.py
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            models.Index(Lower('username'), name='user_username_lower_idx'),
+        ]
     
     def __str__(self):
         return self.email
     
     @property
     def full_name(self):
-        return f"{self.first_name} {self.last_name}".strip()
\ No newline at end of file
+        return f"{self.first_name} {self.last_name}".strip()
+
+class SearchTerm(models.Model):
+    """
+    A normalized word of a user's name, username or email, for prefix
+    search (see user/search.py). The (term, user) index serves range scans
+    for a prefix, the unique (user, term) one reindexing and the checks of
+    further query words.
+    """
+    term = models.CharField(max_length=64)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'term'], name='user_searchterm_user_term_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['term', 'user'], name='user_searchterm_term_idx'),
+        ]
+
+
+class SearchTrigram(models.Model):
+    """Three-character slice of a user's search terms, for misspelled and infix queries"""
+    trigram = models.CharField(max_length=3)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'trigram'], name='user_searchtrigram_user_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['trigram', 'user'], name='user_searchtrigram_idx'),
+        ]
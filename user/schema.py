@@ -0,0 +1,7 @@
+"""OpenAPI extensions for the user app's DRF classes (only loaded with drf-spectacular)"""
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """The ``jwtAuth`` bearer scheme; spectacular's own extension does not match subclasses"""
+    target_class = 'user.authentication.CachedJWTAuthentication'
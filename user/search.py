@@ -0,0 +1,255 @@
+"""
+People search over an index of normalized words (SearchTerm) and their
+trigrams (SearchTrigram), kept in step with users by user/signals.py.
+Queries read bounded ranges of those indexes instead of scanning users;
+results are ranked in memory and paginated by keyset (score, user id).
+"""
+import base64
+import binascii
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import QuerySet
+
+from chat import sharding
+from chat.membership import ID_CHUNK_SIZE, contact_ids, contact_memberships
+from user.models import SearchTerm, SearchTrigram, User
+
+TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+
+# Sorts after every string starting with a given prefix: prefix matches are
+# an index range scan (term >= prefix AND term < prefix + PREFIX_END), which
+# unlike LIKE does so on every backend and collation
+PREFIX_END = '\U0010ffff'
+
+# Scores: prefix matches 200-300, more for words matched in full, trigram
+# matches below 100 by similarity. Contacts get CONTACT_BOOST: enough to lead
+# their kind of match, never to lift a trigram match over a prefix one
+PREFIX_SCORE = 200
+EXACT_SCORE = 100
+TRIGRAM_SCORE = 100
+CONTACT_BOOST = 100
+
+re_word = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Case-folded, without accents: 'Zoë' and 'zoe' index the same"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def words(text):
+    return [word[:TERM_LENGTH] for word in re_word.findall(normalize(text))]
+
+
+def user_terms(user):
+    """Words of the username, names and email address before the @, and the whole address"""
+    email = normalize(user.email)
+    terms = set(words(user.username) + words(user.first_name) + words(user.last_name))
+    terms.update(words(email.partition('@')[0]))
+    if email:
+        terms.add(email[:TERM_LENGTH])
+    return terms
+
+
+def query_words(query):
+    """The words to match, longest first; an email address is matched whole"""
+    query = normalize(query).strip()
+    if '@' in query and not query.count(' '):
+        return [query[:TERM_LENGTH]]
+    return sorted(set(words(query)), key=len, reverse=True)
+
+
+def trigrams(word):
+    """Slices of ``word`` padded with a space on each side, so starts and ends count"""
+    padded = f' {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def term_trigrams(terms):
+    # The whole email address repeats its local part, already among the words
+    return set().union(*(trigrams(term) for term in terms if '@' not in term))
+
+
+def index_user(user):
+    """Bring the user's index rows in line with their fields; writes only what changed"""
+    terms = user_terms(user)
+    indexed = set(SearchTerm.objects.filter(user_id=user.pk).values_list('term', flat=True))
+    if terms == indexed:
+        return
+    grams = term_trigrams(terms)
+    indexed_grams = set(SearchTrigram.objects.filter(user_id=user.pk).values_list('trigram', flat=True))
+    with transaction.atomic():
+        SearchTerm.objects.filter(user_id=user.pk, term__in=indexed - terms).delete()
+        SearchTerm.objects.bulk_create([SearchTerm(user_id=user.pk, term=term) for term in terms - indexed])
+        SearchTrigram.objects.filter(user_id=user.pk, trigram__in=indexed_grams - grams).delete()
+        SearchTrigram.objects.bulk_create(
+            [SearchTrigram(user_id=user.pk, trigram=gram) for gram in grams - indexed_grams]
+        )
+
+
+def reindex_users(users):
+    """Rebuild the index rows of many users at once, e.g. to backfill"""
+    users = list(users)
+    user_ids = [user.pk for user in users]
+    terms = {user.pk: user_terms(user) for user in users}
+    with transaction.atomic():
+        SearchTerm.objects.filter(user_id__in=user_ids).delete()
+        SearchTrigram.objects.filter(user_id__in=user_ids).delete()
+        SearchTerm.objects.bulk_create([
+            SearchTerm(user_id=user_id, term=term)
+            for user_id, indexed in terms.items() for term in indexed
+        ])
+        SearchTrigram.objects.bulk_create([
+            SearchTrigram(user_id=user_id, trigram=gram)
+            for user_id, indexed in terms.items() for gram in term_trigrams(indexed)
+        ])
+
+
+def parse_cursor(value):
+    """``(score, user_id)`` from a cursor, or None when malformed"""
+    try:
+        score, user_id = base64.urlsafe_b64decode(value.encode()).decode().split(':')
+        return int(score), int(user_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        return None
+
+
+def make_cursor(score, user_id):
+    return base64.urlsafe_b64encode(f'{score}:{user_id}'.encode()).decode()
+
+
+def _prefix_matches(word, user_ids=None, limit=None):
+    """
+    ``(user_id, term)`` rows with a term starting with ``word``, in index
+    order. ``user_ids`` narrows them down either as a subquery or, for a
+    collection of ids, chunk by chunk (and then not in order).
+    """
+    rows = (
+        SearchTerm.objects
+        .filter(term__gte=word, term__lt=word + PREFIX_END)
+        .order_by('term', 'user_id')
+        .values_list('user_id', 'term')
+    )
+    if user_ids is not None and not isinstance(user_ids, QuerySet):
+        user_ids = sorted(user_ids)
+        return [
+            row
+            for start in range(0, len(user_ids), ID_CHUNK_SIZE)
+            for row in rows.filter(user_id__in=user_ids[start:start + ID_CHUNK_SIZE])
+        ]
+    if user_ids is not None:
+        rows = rows.filter(user_id__in=user_ids)
+    return rows[:limit] if limit else rows
+
+
+def _exact_words(rows, word):
+    """``{user_id: {word}}`` for users whose matching term is ``word`` itself, else an empty set"""
+    exact = {}
+    for user_id, term in rows:
+        found = exact.setdefault(user_id, set())
+        if term == word:
+            found.add(word)
+    return exact
+
+
+def _prefix_scores(query_words, contacts, candidates):
+    """
+    Users with a term starting with each query word, scored by how many are
+    exact. ``contacts`` is a subquery or collection of user ids whose matches
+    are read on top of the first ``candidates`` rows, so they are not cut off.
+    """
+    # The longest word is the most selective; its range drives
+    driver, *others = query_words
+    rows = list(_prefix_matches(driver, limit=candidates))
+    if contacts:
+        rows += _prefix_matches(driver, user_ids=contacts, limit=candidates)
+    exact = _exact_words(rows, driver)
+    for word in others:
+        # Users without a term for ``word`` drop out
+        matched = _exact_words(_prefix_matches(word, user_ids=list(exact)), word)
+        exact = {user_id: exact[user_id] | found for user_id, found in matched.items()}
+    return {
+        user_id: PREFIX_SCORE + EXACT_SCORE * len(found) // len(query_words)
+        for user_id, found in exact.items()
+    }
+
+
+def _trigram_scores(query_words, candidates):
+    """
+    Users sharing at least TRIGRAM_SIMILARITY of the query's trigrams, scored
+    by the share. Rare trigrams are read first and in full; one shared by
+    more than USER_SEARCH['TRIGRAM_ROWS'] users is only looked up for the
+    users found so far, so a common slice like 'an' never reads its whole range.
+    """
+    grams = term_trigrams(query_words)
+    if not grams:
+        return {}
+    needed = max(1, math.ceil(len(grams) * settings.USER_SEARCH['TRIGRAM_SIMILARITY']))
+    cap = settings.USER_SEARCH['TRIGRAM_ROWS']
+    by_gram = SearchTrigram.objects.order_by('user_id').values_list('user_id', flat=True)
+    # Counting stops at the cap, an index range of at most cap + 1 rows
+    sizes = {gram: by_gram.filter(trigram=gram)[:cap + 1].count() for gram in grams}
+
+    shared = Counter()
+    for gram in sorted(grams, key=sizes.get):
+        if sizes[gram] <= cap:
+            shared.update(by_gram.filter(trigram=gram))
+            continue
+        found = sorted(shared)
+        for start in range(0, len(found), ID_CHUNK_SIZE):
+            shared.update(by_gram.filter(trigram=gram, user_id__in=found[start:start + ID_CHUNK_SIZE]))
+
+    ranked = sorted(
+        ((user_id, count) for user_id, count in shared.items() if count >= needed),
+        key=lambda item: (-item[1], item[0]),
+    )[:candidates]
+    return {user_id: min(TRIGRAM_SCORE - 1, TRIGRAM_SCORE * count // len(grams)) for user_id, count in ranked}
+
+
+def search(user, query, cursor=None, limit=None):
+    """
+    Ids of one page of the users matching ``query`` for ``user``, best first,
+    and the cursor of the next page (None on the last one). Every query word
+    has to start a word of the username, names or email address; when fewer
+    than a page of users match that way, misspellings and infixes are found
+    by trigram similarity. Contacts rank first.
+    """
+    limit = limit or settings.USER_SEARCH['PAGE_SIZE']
+    candidates = settings.USER_SEARCH['CANDIDATES']
+    matched_words = query_words(query)
+    if not matched_words:
+        return [], None
+
+    contacts = contact_ids(user.pk)
+    # Unsharded, contacts' index rows are found by joining their memberships;
+    # a shard holds memberships but not the index, so there the ids are bound
+    contact_filter = contacts if sharding.enabled() else contact_memberships(user.pk).values('user_id')
+    scores = _prefix_scores(matched_words, contacts and contact_filter, candidates)
+    if len(scores) < limit:
+        for user_id, score in _trigram_scores(matched_words, candidates).items():
+            scores.setdefault(user_id, score)
+    scores.pop(user.pk, None)
+
+    ranked = sorted(
+        ((score + CONTACT_BOOST if user_id in contacts else score, user_id) for user_id, score in scores.items()),
+        key=lambda item: (-item[0], item[1]),
+    )
+    if cursor is not None:
+        after = (-cursor[0], cursor[1])
+        ranked = [item for item in ranked if (-item[0], item[1]) > after]
+    page = ranked[:limit]
+    next_cursor = make_cursor(*page[-1]) if len(ranked) > limit else None
+    return [user_id for _, user_id in page], next_cursor
+
+
+def load_users(user_ids, queryset=None):
+    """Active users with the given ids, in that order"""
+    queryset = User.objects.all() if queryset is None else queryset
+    users = queryset.filter(is_active=True).in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
@@ -93,6 +93,8 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'date_joined',
             'last_login'
         ]
+        # Model columns behind non-field attributes, see api.serializers.load_only
+        source_columns = {'full_name': ['first_name', 'last_name']}
         read_only_fields = [
             'id',
             'email',
@@ -103,6 +105,25 @@ class UserProfileSerializer(serializers.ModelSerializer):
             'last_seen'
         ]
 
+class UserSummarySerializer(serializers.ModelSerializer):
+    """The profile fields a chat client shows next to messages"""
+    full_name = serializers.CharField(read_only=True)
+    
+    class Meta:
+        model = User
+        fields = [
+            'id',
+            'username',
+            'first_name',
+            'last_name',
+            'full_name',
+            'profile_picture',
+            'is_online',
+            'last_seen'
+        ]
+        read_only_fields = fields
+        source_columns = {'full_name': ['first_name', 'last_name']}
+
 class UserUpdateSerializer(serializers.ModelSerializer):
     """Serializer for updating user profile"""
     class Meta:
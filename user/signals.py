@@ -0,0 +1,29 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import invalidate_user
+from .models import User
+from .search import index_user
+
+# The fields people search indexes, see user/search.py
+SEARCHED_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Keep the auth user cache in step with password, status and profile changes"""
+    invalidate_user(instance.pk)
+    # Drop it again once the write is visible, in case a concurrent request
+    # re-cached the old row in between
+    transaction.on_commit(partial(invalidate_user, instance.pk))
+
+
+@receiver(post_save, sender=User)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not SEARCHED_FIELDS & set(update_fields)):
+        return
+    index_user(instance)
@@ -1,3 +1,180 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from chat import membership
+from chat.membership import contact_ids
+from chat.models import Conversation
+from pingme.cache import TwoLevelCache
+from .authentication import CachedJWTAuthentication
+from .cache import _users, get_cached_user, invalidate_user
+from .models import User
+from .search import parse_cursor, search
+
+
+def make_user(username):
+    return User.objects.create_user(username=username, email=f'{username}@example.com', password='pw')
+
+
+class OpenApiSchemaTests(SimpleTestCase):
+    def test_jwt_scheme_is_documented(self):
+        from drf_spectacular.settings import spectacular_settings
+
+        generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(urlconf=spectacular_settings.SERVE_URLCONF)
+        document = generator.get_schema(request=None, public=True)
+        self.assertEqual(document['components']['securitySchemes']['jwtAuth']['scheme'], 'bearer')
+        self.assertIn({'jwtAuth': []}, document['paths']['/api/chat/conversations/']['get']['security'])
+
+
+class LoginBackendTests(TestCase):
+    def setUp(self):
+        self.carol = User.objects.create_user(username='Carol', email='Carol@example.com', password='pw')
+
+    def test_email_and_username_ignore_case(self):
+        for identifier in ('carol@example.com', 'CAROL@EXAMPLE.COM', ' carol ', 'cAROL'):
+            self.assertEqual(authenticate(username=identifier, password='pw'), self.carol, identifier)
+        self.assertIsNone(authenticate(username='carol@example.com', password='wrong'))
+
+    def test_email_keyword_used_by_the_login_views(self):
+        self.assertEqual(authenticate(email='carol@example.com', password='pw'), self.carol)
+        response = APIClient().post('/auth/login/', {'email': 'CAROL@example.com', 'password': 'pw'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['id'], self.carol.pk)
+
+    def test_users_differing_only_by_case_need_an_exact_match(self):
+        twin = User.objects.create_user(username='carol2', email='carol@example.com', password='pw')
+        self.assertEqual(authenticate(username='Carol@example.com', password='pw'), self.carol)
+        self.assertEqual(authenticate(username='carol@example.com', password='pw'), twin)
+        with mock.patch.object(User, 'set_password') as dummy_hash:
+            self.assertIsNone(authenticate(username='CAROL@EXAMPLE.COM', password='pw'))
+        # Ambiguous logins still pay for one hash, like a wrong password
+        dummy_hash.assert_called_once_with('pw')
+
+    def test_inactive_users_cannot_log_in(self):
+        self.carol.is_active = False
+        self.carol.save()
+        self.assertIsNone(authenticate(username='carol@example.com', password='pw'))
+        self.assertIsNone(authenticate(email='carol@example.com', password='pw'))
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _users.local.clear()
+        self.user = make_user('alice')
+
+    def test_password_hash_is_not_cached(self):
+        user = get_cached_user(self.user.pk)
+        self.assertNotIn('password', user.__dict__)
+        payload = cache.get(_users.make_key(self.user.pk))
+        self.assertNotIn(self.user.password.encode(), payload)
+        self.assertEqual(user.password_marker, get_md5_hash_password(self.user.password))
+
+    def test_saves_invalidate_the_cache(self):
+        self.assertTrue(get_cached_user(self.user.pk).is_active)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertFalse(get_cached_user(self.user.pk).is_active)
+
+    def test_other_processes_drop_their_local_copy(self):
+        other = TwoLevelCache(_users.prefix, local_ttl=60, shared_ttl=60, generation_poll=0)
+
+        def load():
+            return User.objects.get(pk=self.user.pk)
+
+        self.assertEqual(other.get(self.user.pk, load).first_name, '')
+        User.objects.filter(pk=self.user.pk).update(first_name='Alice')
+        self.assertEqual(other.get(self.user.pk, load).first_name, '')
+        invalidate_user(self.user.pk)
+        self.assertEqual(other.get(self.user.pk, load).first_name, 'Alice')
+
+    # simplejwt's modules keep the settings object they imported, so patch that one
+    @mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True)
+    def test_password_change_revokes_tokens(self):
+        authentication = CachedJWTAuthentication()
+        token = authentication.get_validated_token(str(AccessToken.for_user(self.user)))
+        self.assertEqual(authentication.get_user(token), self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('changed')
+            self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            authentication.get_user(token)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        membership._contacts.local.clear()
+        self.me = make_user('searcher')
+
+    def test_ranking(self):
+        exact = make_user('anna')
+        prefix = make_user('annabel')
+        contact = make_user('annalise')
+        misspelt = make_user('hannah')
+        make_user('bob')
+        conversation = Conversation.objects.create()
+        conversation.participants.set([self.me, contact])
+
+        user_ids, next_cursor = search(self.me, 'anna')
+        # Full words beat prefixes, a contact leads the other prefix matches
+        # and similar spellings only follow them
+        self.assertEqual(user_ids, [exact.pk, contact.pk, prefix.pk, misspelt.pk])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(search(self.me, 'Annà')[0][:3], user_ids[:3])
+        self.assertEqual(search(self.me, 'searcher'), ([], None))
+
+    @override_settings(USER_SEARCH={**settings.USER_SEARCH, 'CONTACT_GROUP_SIZE': 3})
+    def test_contacts_come_from_direct_and_small_groups(self):
+        friend, colleague, stranger, subscriber = [make_user(name) for name in ('friend', 'colleague', 'stranger', 'sub')]
+        direct = Conversation.objects.create()
+        direct.participants.set([self.me, friend])
+        team = Conversation.objects.create(is_group=True)
+        team.participants.set([self.me, colleague, friend])
+        crowd = Conversation.objects.create(is_group=True)
+        crowd.participants.set([self.me, friend, colleague, stranger])
+        channel = Conversation.objects.create(is_group=True, is_broadcast=True)
+        channel.participants.set([self.me, subscriber])
+        self.assertEqual(contact_ids(self.me.pk), {friend.pk, colleague.pk})
+
+    @override_settings(USER_SEARCH={**settings.USER_SEARCH, 'TRIGRAM_ROWS': 1})
+    def test_common_trigrams_are_capped(self):
+        wanted = make_user('jonathan')
+        for i in range(3):
+            make_user(f'nat{i}')
+        with CaptureQueriesContext(connection) as queries:
+            user_ids, _ = search(self.me, 'jonatan')
+        self.assertEqual(user_ids, [wanted.pk])
+        # 'nat' is shared by every user: only the users found through rarer
+        # trigrams are looked up in it, after a count bounded by the cap
+        reads = [query['sql'] for query in queries if "\"trigram\" = 'nat'" in query['sql']]
+        self.assertEqual(len(reads), 2)
+        self.assertIn('LIMIT 2', reads[0])
+        self.assertIn(f'IN ({wanted.pk})', reads[1])
+
+    def test_cursor_pages(self):
+        users = [make_user(f'sam{i}') for i in range(5)]
+        seen, cursor = [], None
+        while True:
+            user_ids, cursor = search(self.me, 'sam', parse_cursor(cursor) if cursor else None, limit=2)
+            seen += user_ids
+            if cursor is None:
+                break
+        self.assertEqual(seen, [user.pk for user in users])
+
+    def test_view_rejects_bad_cursors(self):
+        client = APIClient()
+        client.force_authenticate(self.me)
+        response = client.get('/auth/users/search/', {'q': 'sam', 'cursor': '!!'})
+        self.assertEqual(response.status_code, 400)
@@ -5,6 +5,7 @@ from rest_framework_simplejwt.views import (
 )
 
 from .views import *
+from .async_views import AsyncUserProfileView
 
 urlpatterns = [
     # Authentication
@@ -20,7 +21,9 @@ urlpatterns = [
     path('profile/', UserProfileView.as_view(), name='profile'),
     path('profile/update/', UserUpdateView.as_view(), name='profile_update'),
     path('change-password/', ChangePasswordView.as_view(), name='change_password'),
+    path('async/profile/', AsyncUserProfileView.as_view(), name='async_profile'),
     
     # Users (for testing)
     path('users/', UserListView.as_view(), name='user_list'),
+    path('users/search/', UserSearchView.as_view(), name='user_search'),
 ]
\ No newline at end of file
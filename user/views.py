@@ -1,12 +1,32 @@
+from functools import partial
+
 from rest_framework import status, generics, permissions
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView
 from django.contrib.auth import login, logout
+from django.utils import timezone
+
+from api.serializers import load_only
+from api.views import conditional_response, make_etag
 
 from .serializers import *
 from .models import User
+from .cache import invalidate_user
+from .search import load_users, parse_cursor, search
+
+
+def set_online_status(user_id, is_online):
+    """
+    Presence as one UPDATE: cheaper than a full save, and than queueing a task,
+    which writes a row to do the same write later
+    """
+    User.objects.filter(pk=user_id).update(is_online=is_online, last_seen=timezone.now())
+    invalidate_user(user_id)
+
 
 class UserRegistrationView(generics.CreateAPIView):
     """View for user registration"""
@@ -51,7 +71,7 @@ class UserLoginView(APIView):
         
         # Update online status
         user.is_online = True
-        user.save()
+        set_online_status(user.pk, True)
         
         response_data = {
             'message': 'Login successful',
@@ -76,8 +96,7 @@ class UserLogoutView(APIView):
             token.blacklist()
             
             # Update online status
-            request.user.is_online = False
-            request.user.save()
+            set_online_status(request.user.pk, False)
             
             return Response(
                 {"message": "Logout successful"},
@@ -96,6 +115,17 @@ class UserProfileView(generics.RetrieveAPIView):
     
     def get_object(self):
         return self.request.user
+    
+    def retrieve(self, request, *args, **kwargs):
+        # last_seen is bumped by every save and presence change
+        user = request.user
+        validators = (
+            make_etag(user.pk, user.last_seen, user.last_login, user.is_online),
+            max(filter(None, [user.last_seen, user.last_login])),
+        )
+        return conditional_response(
+            request, validators, partial(super().retrieve, request, *args, **kwargs)
+        )
 
 class UserUpdateView(generics.UpdateAPIView):
     """View for updating user profile"""
@@ -132,10 +162,38 @@ class ChangePasswordView(APIView):
             status=status.HTTP_200_OK
         )
 
+class UserCursorPagination(CursorPagination):
+    """Keyset pages by id: no OFFSET scan and no COUNT of the user table"""
+    ordering = 'id'
+
 class UserListView(generics.ListAPIView):
-    """View for listing all users (for testing)"""
+    """View for listing all users (for testing); use UserSearchView to find people"""
     serializer_class = UserProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserCursorPagination
     
     def get_queryset(self):
-        return User.objects.exclude(id=self.request.user.id)
\ No newline at end of file
+        return User.objects.exclude(id=self.request.user.id)
+
+class UserSearchView(APIView):
+    """
+    People search: ``?q=`` matched against the start of words in usernames,
+    names and email addresses (by trigram similarity when few match),
+    contacts first. Follow ``next`` for further pages.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = UserSummarySerializer
+    
+    def get(self, request):
+        cursor = request.query_params.get('cursor')
+        if cursor is not None:
+            cursor = parse_cursor(cursor)
+            if cursor is None:
+                return Response({'cursor': 'Invalid cursor.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_ids, next_cursor = search(request.user, request.query_params.get('q', ''), cursor)
+        users = load_users(user_ids, load_only(User.objects.all(), UserSummarySerializer()))
+        return Response({
+            'next': next_cursor and replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor),
+            'results': UserSummarySerializer(users, many=True).data,
+        })
\ No newline at end of file